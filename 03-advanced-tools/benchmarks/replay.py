@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+mineru / olmocr.pipeline 的錄製與重播替身
+
+錄製（record）：替身轉發給真正的引擎，同時記下命令列、返回碼、stdout/stderr 時間線、耗時與輸出文件；
+重播（replay）：沒有模型與 GPU 的機器上，替身按錄製的時間線（可按比例縮放）輸出同樣的日誌、
+寫出同樣的文件並以同樣的返回碼退出，用於離線壓測並發、超時、快取與解析邏輯。
+
+錄製目錄（cassette）結構：
+    <cassette>/mineru/<PDF 雜湊>/run.json     命令列、返回碼、耗時、時間線
+    <cassette>/mineru/<PDF 雜湊>/files/...    -o 目錄下的輸出
+    <cassette>/olmocr/<PDF 雜湊>/run.json     同上，另含 Dolma 記錄
+    <cassette>/olmocr/<PDF 雜湊>/files/...    --markdown 輸出
+
+環境變量（由 run 子命令設定，替身讀取）：
+    OCR_REPLAY_MODE   record 或 replay
+    OCR_REPLAY_DIR    錄製目錄
+    OCR_REPLAY_SCALE  重播時間倍率（預設 1；0.1 表示快 10 倍，0 表示不等待）
+    OCR_REPLAY_MATCH  exact：只重播同一份 PDF 的錄製；any（預設）：沒有時按文件名確定性地挑一份錄製，
+                      用少量錄製壓測大量文件
+    OCR_REPLAY_SHIMS  替身所在目錄（錄製時用來找到真正的引擎）
+
+用法：
+    python benchmarks/replay.py run --mode record --cassette cassettes/gpu01 -- python mineru/demo.py
+    python benchmarks/replay.py run --mode replay --cassette cassettes/gpu01 --scale 0.1 -- python mineru/demo.py
+    python benchmarks/replay.py list cassettes/gpu01
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "olmocr"))
+from workspace_reader import RESULTS_DIR, SHARD_PREFIX, Workspace  # noqa: E402
+
+ENGINES = ('mineru', 'olmocr')
+RUN_FILE = "run.json"
+FILES_DIR = "files"
+MISSING_RECORDING = 3
+
+SHIM_SCRIPT = """#!{python}
+import sys
+sys.path.insert(0, {bench_dir!r})
+import replay
+sys.exit(replay.{entry}(sys.argv[1:]))
+"""
+
+
+# ---------- 錄製目錄 ----------
+
+def pdf_key(pdf_path):
+    """錄製鍵：PDF 內容的雜湊（不存在的本地文件或遠端路徑用路徑字串）"""
+    path = Path(pdf_path)
+    digest = hashlib.sha256()
+    if '://' not in str(pdf_path) and path.is_file():
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    else:
+        digest.update(str(pdf_path).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def recordings(cassette, engine):
+    engine_dir = Path(cassette) / engine
+    if not engine_dir.exists():
+        return []
+    return sorted(p for p in engine_dir.iterdir() if (p / RUN_FILE).exists())
+
+
+def find_recording(cassette, engine, pdf_path, match='any'):
+    """找出某 PDF 的錄製；match='any' 時沒有完全相同的文件就按文件名確定性地挑一份"""
+    exact = Path(cassette) / engine / pdf_key(pdf_path)
+    if (exact / RUN_FILE).exists():
+        return exact
+    if match != 'any':
+        return None
+    available = recordings(cassette, engine)
+    if not available:
+        return None
+    return available[zlib.crc32(Path(str(pdf_path)).name.encode('utf-8')) % len(available)]
+
+
+def _save_recording(cassette, engine, key, run, files):
+    """先寫到臨時目錄再改名；同一份 PDF 已有錄製時保留舊的"""
+    target = Path(cassette) / engine / key
+    target.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=target.parent))
+    try:
+        for relative, source in files:
+            destination = staging / FILES_DIR / relative
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, destination)
+        with open(staging / RUN_FILE, 'w', encoding='utf-8') as f:
+            json.dump(run, f, ensure_ascii=False, indent=2)
+        os.rename(staging, target)
+    except OSError:
+        if not target.exists():
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+# ---------- 錄製 ----------
+
+def _die_with_parent():
+    """Linux 上讓真正的引擎隨替身一起結束（runner 超時 kill 替身時不留下孤兒進程）"""
+    try:
+        import ctypes
+        import signal
+        ctypes.CDLL("libc.so.6", use_errno=True).prctl(1, signal.SIGKILL)  # PR_SET_PDEATHSIG
+    except (OSError, AttributeError):
+        pass
+
+
+def _record_process(cmd, env=None):
+    """運行真正的引擎，同步轉發輸出並記錄時間線，返回 (返回碼, 耗時, 時間線)"""
+    timeline = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors='replace',
+                            env=env, preexec_fn=_die_with_parent if sys.platform.startswith('linux') else None)
+
+    def pump(stream, name, sink):
+        for line in stream:
+            with lock:
+                timeline.append([round(time.perf_counter() - start, 4), name, line])
+            sink.write(line)
+            sink.flush()
+
+    pumps = [threading.Thread(target=pump, args=(proc.stdout, 'stdout', sys.stdout), daemon=True),
+             threading.Thread(target=pump, args=(proc.stderr, 'stderr', sys.stderr), daemon=True)]
+    for thread in pumps:
+        thread.start()
+    returncode = proc.wait()
+    for thread in pumps:
+        thread.join()
+    return returncode, time.perf_counter() - start, sorted(timeline, key=lambda event: event[0])
+
+
+def _without_shims(value):
+    shims = os.environ.get('OCR_REPLAY_SHIMS')
+    return os.pathsep.join(p for p in (value or '').split(os.pathsep)
+                           if p and Path(p).resolve() != Path(shims or '').resolve())
+
+
+def _real_env():
+    """去掉替身目錄後的環境（錄製時讓子進程找到真正的引擎）"""
+    env = dict(os.environ, PATH=_without_shims(os.environ.get('PATH')))
+    env['PYTHONPATH'] = _without_shims(os.environ.get('PYTHONPATH'))
+    for name in ('OCR_REPLAY_MODE', 'OCR_REPLAY_DIR', 'OCR_REPLAY_SCALE', 'OCR_REPLAY_MATCH', 'OCR_REPLAY_SHIMS'):
+        env.pop(name, None)
+    return env
+
+
+def _option(args, flag, default=None):
+    return args[args.index(flag) + 1] if flag in args and args.index(flag) + 1 < len(args) else default
+
+
+def _olmocr_pdfs(args):
+    """--pdfs 後直到下一個選項為止的路徑"""
+    if '--pdfs' not in args:
+        return []
+    pdfs = []
+    for value in args[args.index('--pdfs') + 1:]:
+        if value.startswith('--'):
+            break
+        pdfs.append(value)
+    return pdfs
+
+
+def _olmocr_record(workspace, pdf_path):
+    """workspace 結果分片中屬於 pdf_path 的原始 Dolma 記錄"""
+    for _, record in Workspace(workspace).iter_records(pdf_path):
+        return record
+    return None
+
+
+def record_mineru(args, cassette):
+    env = _real_env()
+    binary = shutil.which('mineru', path=env['PATH'])
+    if binary is None:
+        print("❌ 錄製模式找不到真正的 mineru 命令", file=sys.stderr)
+        return 127
+    returncode, duration, timeline = _record_process([binary] + args, env)
+
+    pdf, output_dir = _option(args, '-p'), _option(args, '-o')
+    if pdf is None or '--version' in args:
+        return returncode
+    output_dir = Path(output_dir) if output_dir else None
+    files = []
+    if output_dir and output_dir.exists():
+        files = [(str(p.relative_to(output_dir)), p) for p in sorted(output_dir.rglob('*')) if p.is_file()]
+    _save_recording(cassette, 'mineru', pdf_key(pdf), {
+        'engine': 'mineru',
+        'argv': args,
+        'pdf': Path(pdf).name,
+        'stem': Path(pdf).stem,
+        'returncode': returncode,
+        'duration': duration,
+        'timeline': timeline,
+        'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }, files)
+    return returncode
+
+
+def record_olmocr(args, cassette):
+    env = _real_env()
+    returncode, duration, timeline = _record_process([sys.executable, '-m', 'olmocr.pipeline'] + args, env)
+
+    pdfs = _olmocr_pdfs(args)
+    if not pdfs or not args or args[0].startswith('--'):
+        return returncode
+    workspace = Workspace(args[0])
+    # 一次運行多份 PDF 時耗時平均分攤，時間線只記在第一份上
+    share = duration / len(pdfs)
+    for i, pdf in enumerate(pdfs):
+        files = [(str(p.relative_to(workspace.path)), p) for p in workspace.markdown_files(pdf)]
+        _save_recording(cassette, 'olmocr', pdf_key(pdf), {
+            'engine': 'olmocr',
+            'argv': args,
+            'pdf': Path(pdf).name,
+            'stem': Path(pdf).stem,
+            'returncode': returncode,
+            'duration': share,
+            'timeline': timeline if i == 0 else [],
+            'document': _olmocr_record(workspace.path, pdf),
+            'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }, files)
+    return returncode
+
+
+# ---------- 重播 ----------
+
+def _scale():
+    return float(os.environ.get('OCR_REPLAY_SCALE') or 1.0)
+
+
+def _play(run, start, offset, scale):
+    """按時間線輸出日誌，返回本次錄製結束的時間點（相對 start，已縮放）"""
+    for at, stream, line in run['timeline']:
+        delay = start + offset + at * scale - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sink = sys.stdout if stream == 'stdout' else sys.stderr
+        sink.write(line)
+        sink.flush()
+    end = offset + run['duration'] * scale
+    delay = start + end - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+    return end
+
+
+def _load(recording):
+    with open(recording / RUN_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _rename_part(part, old_stem, stem):
+    """路徑中的一段：等於原文件名或以「原文件名.」「原文件名_」開頭時換成當前文件名（auto/ 等目錄不受影響）"""
+    if part == old_stem:
+        return stem
+    if part.startswith(old_stem) and part[len(old_stem):len(old_stem) + 1] in ('.', '_'):
+        return stem + part[len(old_stem):]
+    return part
+
+
+def _copy_files(recording, run, destination, stem):
+    """把錄製的輸出複製到新的輸出目錄，路徑中的原文件名換成當前 PDF 的文件名"""
+    files_dir = recording / FILES_DIR
+    if not files_dir.exists():
+        return
+    for source in files_dir.rglob('*'):
+        if source.is_file():
+            parts = source.relative_to(files_dir).parts
+            target = Path(destination).joinpath(*(_rename_part(part, run['stem'], stem) for part in parts))
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target)
+
+
+def _missing(engine, pdf):
+    print(f"replay: 沒有 {engine} 對 {pdf} 的錄製（OCR_REPLAY_MATCH=exact）", file=sys.stderr)
+    return MISSING_RECORDING
+
+
+def replay_mineru(args, cassette):
+    if '--version' in args:
+        print(f"mineru-replay ({cassette})")
+        return 0
+    pdf, output_dir = _option(args, '-p'), _option(args, '-o')
+    recording = find_recording(cassette, 'mineru', pdf, os.environ.get('OCR_REPLAY_MATCH', 'any'))
+    if recording is None:
+        return _missing('mineru', pdf)
+    run = _load(recording)
+    _play(run, time.perf_counter(), 0.0, _scale())
+    if output_dir and run['returncode'] == 0:
+        _copy_files(recording, run, output_dir, Path(pdf).stem)
+    return run['returncode']
+
+
+def replay_olmocr(args, cassette):
+    workspace = Path(args[0]) if args and not args[0].startswith('--') else None
+    match = os.environ.get('OCR_REPLAY_MATCH', 'any')
+    scale = _scale()
+    start, offset, returncode = time.perf_counter(), 0.0, 0
+    for pdf in _olmocr_pdfs(args):
+        recording = find_recording(cassette, 'olmocr', pdf, match)
+        if recording is None:
+            return _missing('olmocr', pdf)
+        run = _load(recording)
+        offset = _play(run, start, offset, scale)
+        returncode = max(returncode, run['returncode'])
+        if workspace is None or not run.get('document'):
+            continue
+        # Dolma 記錄改寫為當前 PDF，一份 PDF 一個結果分片
+        document = dict(run['document'], metadata=dict(run['document'].get('metadata') or {}, **{'Source-File': pdf}))
+        results = workspace / RESULTS_DIR
+        results.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha1(pdf.encode('utf-8')).hexdigest()
+        with open(results / f"{SHARD_PREFIX}{digest}.jsonl", 'w', encoding='utf-8') as f:
+            f.write(json.dumps(document, ensure_ascii=False) + '\n')
+        _copy_files(recording, run, workspace, Path(pdf).stem)
+    return returncode
+
+
+# ---------- 替身入口 ----------
+
+def _entry(engine, args):
+    mode = os.environ.get('OCR_REPLAY_MODE', 'replay')
+    cassette = os.environ.get('OCR_REPLAY_DIR')
+    if not cassette:
+        print("replay: 未設定 OCR_REPLAY_DIR", file=sys.stderr)
+        return 2
+    handlers = {
+        ('mineru', 'record'): record_mineru, ('mineru', 'replay'): replay_mineru,
+        ('olmocr', 'record'): record_olmocr, ('olmocr', 'replay'): replay_olmocr,
+    }
+    return handlers[(engine, mode)](args, cassette)
+
+
+def mineru_main(args):
+    return _entry('mineru', args)
+
+
+def olmocr_main(args):
+    return _entry('olmocr', args)
+
+
+def install_shims(shim_dir):
+    """
+    在 shim_dir 寫出 mineru 命令與 olmocr.pipeline 模組替身，
+    shim_dir 同時加到 PATH 與 PYTHONPATH 最前面即可取代真正的引擎
+    """
+    shim_dir = Path(shim_dir)
+    (shim_dir / "olmocr").mkdir(parents=True, exist_ok=True)
+    script = shim_dir / "mineru"
+    script.write_text(SHIM_SCRIPT.format(python=sys.executable, bench_dir=str(BENCH_DIR), entry='mineru_main'))
+    script.chmod(0o755)
+    (shim_dir / "olmocr" / "__init__.py").write_text("")
+    (shim_dir / "olmocr" / "pipeline.py").write_text(
+        SHIM_SCRIPT.format(python=sys.executable, bench_dir=str(BENCH_DIR), entry='olmocr_main'))
+    return shim_dir
+
+
+def shim_env(shim_dir, mode, cassette, scale=None, match=None):
+    """替身生效所需的環境變量"""
+    prepend = lambda name: os.pathsep.join(p for p in (str(shim_dir), os.environ.get(name)) if p)
+    env = dict(os.environ, PATH=prepend('PATH'), PYTHONPATH=prepend('PYTHONPATH'),
+               OCR_REPLAY_MODE=mode, OCR_REPLAY_DIR=str(Path(cassette).resolve()),
+               OCR_REPLAY_SHIMS=str(shim_dir))
+    if scale is not None:
+        env['OCR_REPLAY_SCALE'] = str(scale)
+    if match:
+        env['OCR_REPLAY_MATCH'] = match
+    return env
+
+
+# ---------- 命令列 ----------
+
+def _cmd_run(args):
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        print("❌ 請在 -- 之後給出要運行的命令")
+        return 2
+    with tempfile.TemporaryDirectory(prefix="ocr-replay-") as shim_dir:
+        install_shims(shim_dir)
+        env = shim_env(shim_dir, args.mode, args.cassette, args.scale, args.match)
+        icon = '⏺️ ' if args.mode == 'record' else '▶️ '
+        print(f"{icon} {args.mode}: {args.cassette}" + (f"（時間 ×{args.scale}）" if args.scale is not None else ''))
+        return subprocess.call(command, env=env)
+
+
+def _cmd_list(args):
+    for engine in ENGINES:
+        runs = [_load(r) for r in recordings(args.cassette, engine)]
+        if not runs:
+            continue
+        failed = sum(1 for run in runs if run['returncode'] != 0)
+        total = sum(run['duration'] for run in runs)
+        print(f"📼 {engine}: {len(runs)} 份錄製，失敗 {failed} 份，"
+              f"總耗時 {total:.1f}秒（平均 {total / len(runs):.1f}秒）")
+        if args.verbose:
+            for run in runs:
+                mark = '✅' if run['returncode'] == 0 else f"❌ {run['returncode']}"
+                print(f"   {run['pdf']:<40} {run['duration']:>8.1f}秒  {len(run['timeline']):>5} 行  {mark}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="mineru / olmocr.pipeline 錄製與重播替身")
+    sub = parser.add_subparsers(dest="subcommand", required=True)
+    p_run = sub.add_parser("run", help="在替身環境中運行命令（例如 python mineru/demo.py）")
+    p_run.add_argument("--mode", choices=("record", "replay"), required=True)
+    p_run.add_argument("--cassette", required=True, help="錄製目錄")
+    p_run.add_argument("--scale", type=float, help="重播時間倍率（預設 1）")
+    p_run.add_argument("--match", choices=("exact", "any"), help="沒有同一份 PDF 的錄製時是否借用其他錄製")
+    p_run.add_argument("command", nargs=argparse.REMAINDER)
+    p_list = sub.add_parser("list", help="列出錄製內容")
+    p_list.add_argument("cassette")
+    p_list.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    return _cmd_run(args) if args.subcommand == "run" else _cmd_list(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+包裝層（orchestration overhead）基準測試
+
+以確定性替身代替 mineru / unstructured / olmOCR，在合成語料上測量我們自己的代碼：
+每個文件（或元素）的開銷、記憶體增長，以及隨線程數的擴展，並與 baselines.json 比較，
+超過閾值時以非零狀態退出。
+
+用法：
+    python benchmarks/run_benchmarks.py                    # 預設套件，與基線比較
+    python benchmarks/run_benchmarks.py --full             # 加入 1 萬～10 萬文件的大語料
+    python benchmarks/run_benchmarks.py --only mineru      # 只跑名稱包含 mineru 的案例
+    python benchmarks/run_benchmarks.py --update-baseline  # 以本次結果更新基線
+
+每個案例在獨立子進程中運行，記憶體增長不會互相污染。
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+TOOLS_DIR = BENCH_DIR.parent
+BASELINE_FILE = BENCH_DIR / "baselines.json"
+
+sys.path.insert(0, str(TOOLS_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+import stubs
+
+# (案例, 規模, 線程數)；規模是文件數，markdown_render 為元素數，olmocr_workspace_read 為結果分片數，
+# olmocr_server_pool 的線程數是 stub 實例數
+DEFAULT_SUITE = [
+    ('markdown_render', 10000, 1),
+    ('discovery', 10, 1),
+    ('discovery', 10000, 1),
+    ('unstructured_convert', 1000, 1),
+    ('unstructured_pipeline', 10, 1),
+    ('unstructured_pipeline', 1000, 1),
+    ('unstructured_pipeline', 1000, 4),
+    ('mineru_convert', 50, 1),
+    ('mineru_pipeline', 200, 1),
+    ('mineru_pipeline', 200, 4),
+    ('olmocr_wrapper', 10, 1),
+    ('olmocr_workspace_read', 1000, 1),
+    ('olmocr_server_pool', 20000, 3),
+]
+FULL_SUITE = DEFAULT_SUITE + [
+    ('discovery', 100000, 1),
+    ('unstructured_pipeline', 10000, 4),
+    ('unstructured_pipeline', 100000, 4),
+    ('mineru_pipeline', 2000, 4),
+    ('olmocr_workspace_read', 10000, 1),
+]
+
+# 超過 基線 × ratio + slack 即判定為回歸；per_item_ms 另外容許整個案例 slack_seconds 的調度抖動
+# （換算成每項 slack_seconds × 1000 / 項目數），總時間只有幾十毫秒的小案例不會因抖動誤報
+DEFAULT_THRESHOLDS = {
+    'per_item_ms': {'ratio': 1.5, 'slack': 0.002, 'slack_seconds': 0.05},
+    'rss_growth_mb': {'ratio': 1.5, 'slack': 20},
+}
+
+
+def case_key(name, size, workers):
+    return f"{name}/{size}/w{workers}"
+
+
+def _load_runner(engine):
+    """按路徑載入工具目錄下的 demo.py"""
+    sys.path.insert(0, str(TOOLS_DIR / engine))
+    spec = importlib.util.spec_from_file_location(f"{engine}_demo", TOOLS_DIR / engine / "demo.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - start
+
+
+# ---------- 案例 ----------
+
+def bench_markdown_render(size, workers, tmp):
+    unstructured = _load_runner('unstructured')
+    elements = stubs.synthetic_elements(size)
+    _, seconds = _timed(unstructured.elements_to_markdown, elements)
+    _, render_seconds = _timed(unstructured.render_elements, elements)
+    return {'items': size, 'seconds': seconds, 'render_seconds': render_seconds}
+
+
+def bench_discovery(size, workers, tmp):
+    from common.discovery import Manifest
+
+    stubs.build_corpus(tmp / 'corpus', size)
+    with Manifest(tmp / 'manifest.db') as manifest:
+        _, seconds = _timed(lambda: sum(1 for _ in manifest.walk(tmp / 'corpus')))
+        _, warm_seconds = _timed(lambda: sum(1 for _ in manifest.walk(tmp / 'corpus')))
+    return {'items': size, 'seconds': seconds, 'warm_seconds': warm_seconds}
+
+
+def bench_unstructured_convert(size, workers, tmp):
+    unstructured = _load_runner('unstructured')
+    unstructured.partition_pdf = stubs.stub_partition
+    paths = stubs.build_corpus(tmp / 'corpus', size)
+    start = time.perf_counter()
+    for path in paths:
+        unstructured.convert_pdf(path, tmp / 'out')
+    return {'items': size, 'seconds': time.perf_counter() - start}
+
+
+def bench_unstructured_pipeline(size, workers, tmp):
+    from common.discovery import Manifest
+    from common.result_index import ResultIndex
+
+    unstructured = _load_runner('unstructured')
+    unstructured.partition_pdf = stubs.stub_partition
+    stubs.build_corpus(tmp / 'corpus', size)
+    with ResultIndex(tmp / 'results.db') as index, Manifest(tmp / 'manifest.db') as manifest:
+        results, seconds = _timed(
+            unstructured.process_pdfs, output_dir=tmp / 'out', index=index, manifest=manifest,
+            workers={'engine': workers, 'postprocess': workers}, input_dir=tmp / 'corpus')
+    _, json_seconds = _timed(unstructured.analyze_results, results, output_dir=tmp / 'out')
+    return {'items': size, 'seconds': seconds, 'json_seconds': json_seconds,
+            'failed': sum(1 for r in results if not r['success'])}
+
+
+def bench_mineru_convert(size, workers, tmp):
+    stubs.prepend_env_path('PATH', stubs.install_mineru_stub(tmp / 'bin'))
+    mineru = _load_runner('mineru')
+    mineru.OUTPUT_DIR = tmp / 'out'
+    paths = stubs.build_corpus(tmp / 'corpus', size)
+    start = time.perf_counter()
+    failed = sum(1 for path in paths if not mineru.convert_pdf(path)['success'])
+    return {'items': size, 'seconds': time.perf_counter() - start, 'failed': failed}
+
+
+def bench_mineru_pipeline(size, workers, tmp):
+    from common.discovery import Manifest
+    from common.result_index import ResultIndex
+
+    stubs.prepend_env_path('PATH', stubs.install_mineru_stub(tmp / 'bin'))
+    mineru = _load_runner('mineru')
+    mineru.OUTPUT_DIR = tmp / 'out'
+    stubs.build_corpus(tmp / 'corpus', size)
+    with ResultIndex(tmp / 'results.db') as index, Manifest(tmp / 'manifest.db') as manifest:
+        results, seconds = _timed(
+            mineru.process_pdfs, index=index, manifest=manifest,
+            workers={'engine': workers, 'postprocess': workers}, input_dir=tmp / 'corpus')
+    return {'items': size, 'seconds': seconds, 'failed': sum(1 for r in results if not r['success'])}
+
+
+def bench_olmocr_wrapper(size, workers, tmp):
+    stubs.prepend_env_path('PYTHONPATH', stubs.install_olmocr_stub(tmp / 'pkg'))
+    olmocr = _load_runner('olmocr')
+    paths = stubs.build_corpus(tmp / 'corpus', size)
+    start = time.perf_counter()
+    # 共用一個 workspace：結果分片逐漸累積，檢查輸出讀取不會隨殘留文件變慢
+    failed = sum(1 for path in paths
+                 if not olmocr.run_pipeline_v046(path, workspace_dir=tmp / 'workspace', gpu_device=None)['success'])
+    return {'items': size, 'seconds': time.perf_counter() - start, 'failed': failed}
+
+
+def bench_olmocr_workspace_read(size, workers, tmp):
+    sys.path.insert(0, str(TOOLS_DIR / 'olmocr'))
+    from workspace_reader import Workspace, summarize_output
+
+    pdfs = [tmp / 'corpus' / f"doc_{i:06d}.pdf" for i in range(size)]
+    stubs.write_workspace(tmp / 'workspace', pdfs)
+    lookups = pdfs[::max(1, size // 50)]
+    start = time.perf_counter()
+    for pdf in lookups:
+        summarize_output(tmp / 'workspace', pdf)
+    seconds = time.perf_counter() - start
+    _, pending_seconds = _timed(Workspace(tmp / 'workspace').pending_pdfs, pdfs)
+    return {'items': len(lookups), 'seconds': seconds, 'pending_seconds': pending_seconds}
+
+
+def bench_olmocr_server_pool(size, workers, tmp):
+    # 分派 / 故障切換 / 下線 / acquire 有界的行為檢查，未通過的項目計為 failed；
+    # 模擬推理耗時與等待上限設為 0，只計分派階段的時間（服務池自身的開銷，含故障切換的健康檢查）
+    sys.path.insert(0, str(TOOLS_DIR / 'olmocr'))
+    from server_pool import self_check
+
+    stats = {}
+    problems = self_check(count=workers, docs=size, delay=0, acquire_timeout=0, stats=stats)
+    return {'items': size, 'seconds': stats['dispatch_seconds'], 'failed': len(problems)}
+
+
+CASES = {
+    'markdown_render': bench_markdown_render,
+    'discovery': bench_discovery,
+    'unstructured_convert': bench_unstructured_convert,
+    'unstructured_pipeline': bench_unstructured_pipeline,
+    'mineru_convert': bench_mineru_convert,
+    'mineru_pipeline': bench_mineru_pipeline,
+    'olmocr_wrapper': bench_olmocr_wrapper,
+    'olmocr_workspace_read': bench_olmocr_workspace_read,
+    'olmocr_server_pool': bench_olmocr_server_pool,
+}
+
+
+# ---------- 子進程執行 ----------
+
+def _current_rss_mb():
+    """當前常駐記憶體（Linux 讀 /proc，其他平台退回峰值）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以位元組為單位，Linux 以 KB 為單位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(name, size, workers):
+    """在子進程中運行單一案例，把結果以 JSON 印到標準輸出"""
+    tmp = Path(tempfile.mkdtemp(prefix='ocr-bench-'))
+    rss_before = _current_rss_mb()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = CASES[name](size, workers, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    result['per_item_ms'] = result['seconds'] / max(result['items'], 1) * 1000
+    result['rss_growth_mb'] = max(0.0, _peak_rss_mb() - rss_before)
+    print(json.dumps(result))
+
+
+def run_case(name, size, workers, repeat):
+    """運行 repeat 次取每項耗時居中的一次（記憶體取最大值）；中位數比最小值更不受偶發的快/慢運行影響"""
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, __file__, '--child', name, str(size), str(workers)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{case_key(name, size, workers)} 失敗:\n{proc.stderr[-2000:]}")
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    runs.sort(key=lambda r: r['per_item_ms'])
+    median = runs[len(runs) // 2]
+    median['rss_growth_mb'] = max(r['rss_growth_mb'] for r in runs)
+    return median
+
+
+# ---------- 基線比較 ----------
+
+def load_baseline():
+    if not BASELINE_FILE.exists():
+        return {'thresholds': DEFAULT_THRESHOLDS, 'cases': {}}
+    with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(key, result, baseline):
+    """返回超過閾值的指標說明列表"""
+    base = baseline['cases'].get(key)
+    if not base:
+        return []
+    regressions = []
+    for metric, limit in baseline.get('thresholds', DEFAULT_THRESHOLDS).items():
+        if metric not in base:
+            continue
+        allowed = base[metric] * limit['ratio'] + limit['slack']
+        if limit.get('slack_seconds'):
+            allowed += limit['slack_seconds'] * 1000 / max(result['items'], 1)
+        if result[metric] > allowed:
+            regressions.append(f"{metric} {result[metric]:.4f} > {allowed:.4f}（基線 {base[metric]:.4f}）")
+    return regressions
+
+
+def print_scaling(results):
+    """同一案例、同一規模下不同線程數的加速比"""
+    groups = {}
+    for (name, size, workers), r in results.items():
+        groups.setdefault((name, size), {})[workers] = r['seconds']
+    for (name, size), by_workers in sorted(groups.items()):
+        if len(by_workers) < 2 or 1 not in by_workers:
+            continue
+        speedups = ', '.join(f"w{w}: {by_workers[1] / t:.2f}x" for w, t in sorted(by_workers.items()) if w != 1 and t)
+        print(f"   📈 {name}/{size} 擴展: {speedups}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="包裝層基準測試（確定性替身 + 合成語料）")
+    parser.add_argument("--full", action="store_true", help="加入 1 萬～10 萬文件的大語料案例")
+    parser.add_argument("--only", help="只運行名稱包含此字串的案例")
+    parser.add_argument("--repeat", type=int, default=5, help="每個案例重複次數（取中位數）")
+    parser.add_argument("--update-baseline", action="store_true", help="以本次結果覆寫基線")
+    parser.add_argument("--child", nargs=3, metavar=("CASE", "SIZE", "WORKERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), int(args.child[2]))
+        return 0
+
+    suite = FULL_SUITE if args.full else DEFAULT_SUITE
+    if args.only:
+        suite = [case for case in suite if args.only in case[0]]
+    baseline = load_baseline()
+
+    print(f"🏁 包裝層基準測試：{len(suite)} 個案例，每個重複 {args.repeat} 次")
+    print(f"   {'案例':<40}{'每項':>12}{'總時間':>10}{'記憶體增長':>12}")
+    results, failures = {}, []
+    for name, size, workers in suite:
+        key = case_key(name, size, workers)
+        result = run_case(name, size, workers, args.repeat)
+        results[(name, size, workers)] = result
+        regressions = compare(key, result, baseline)
+        status = '❌' if regressions or result.get('failed') else ('✅' if key in baseline['cases'] else '🆕')
+        print(f"   {key:<40}{result['per_item_ms']:>10.3f}ms{result['seconds']:>9.2f}s"
+              f"{result['rss_growth_mb']:>10.1f}MB  {status}")
+        if result.get('failed'):
+            regressions.append(f"{result['failed']} 個文件處理失敗")
+        for message in regressions:
+            print(f"      ↳ {message}")
+            failures.append(f"{key}: {message}")
+    print_scaling(results)
+
+    if args.update_baseline:
+        baseline.setdefault('thresholds', DEFAULT_THRESHOLDS)
+        baseline['environment'] = {'python': platform.python_version(), 'machine': platform.machine(),
+                                   'system': platform.system(), 'updated_at': time.strftime('%Y-%m-%d')}
+        for (name, size, workers), r in results.items():
+            baseline['cases'][case_key(name, size, workers)] = {
+                'per_item_ms': round(r['per_item_ms'], 4), 'rss_growth_mb': round(r['rss_growth_mb'], 1)}
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\n💾 基線已更新: {BASELINE_FILE}")
+        return 0
+
+    if failures:
+        print(f"\n❌ {len(failures)} 項超過閾值")
+        return 1
+    print("\n✅ 全部在閾值內")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
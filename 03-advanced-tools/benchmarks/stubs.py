@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+基準測試用的確定性替身：合成 PDF 語料、mineru 替身命令、olmocr.pipeline 替身模組、unstructured 元素
+
+替身只做最少的工作並產生與真實引擎相同結構的輸出，
+讓基準測試量到的是我們自己的包裝層（子進程處理、輸出掃描、Markdown 渲染、JSON/索引寫入）。
+"""
+
+import hashlib
+import os
+import stat
+from pathlib import Path
+
+# 每個子目錄放多少個文件（10 萬個文件時約 1000 個目錄）
+FILES_PER_DIR = 100
+
+
+def make_pdf(page_texts):
+    """生成一份最小但結構完整（xref 偏移正確）的 PDF"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    page_ids = [4 + 2 * i for i in range(len(page_texts))]
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_texts)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, text in enumerate(page_texts):
+        content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_ids[i] + 1} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def build_corpus(root, count):
+    """在 root 下生成 count 份合成 PDF（1～3 頁，分散在子目錄中），返回路徑列表"""
+    root = Path(root)
+    templates = {pages: make_pdf([f"Synthetic page {n + 1}" for n in range(pages)]) for pages in (1, 2, 3)}
+    paths = []
+    for i in range(count):
+        directory = root / f"d{i // FILES_PER_DIR:04d}"
+        if i % FILES_PER_DIR == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"doc_{i:06d}.pdf"
+        path.write_bytes(templates[1 + i % 3])
+        paths.append(path)
+    return paths
+
+
+# ---------- mineru 替身 ----------
+
+MINERU_STUB = """#!/bin/sh
+# mineru 替身：解析 -p / -o，寫出與 mineru 相同結構的 markdown 與 content_list
+in=""; out=""
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -p) in="$2"; shift 2 ;;
+        -o) out="$2"; shift 2 ;;
+        --version) echo "mineru-stub 0.0"; exit 0 ;;
+        *) shift ;;
+    esac
+done
+name=$(basename "$in" .pdf)
+mkdir -p "$out/$name/auto"
+printf '# %s\\n\\nstub text\\n' "$name" > "$out/$name/auto/$name.md"
+printf '[{"type": "text", "text": "stub text", "page_idx": 0}]' > "$out/$name/auto/${name}_content_list.json"
+"""
+
+
+def install_mineru_stub(bin_dir):
+    """寫出 mineru 替身命令，返回應加到 PATH 最前面的目錄"""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = bin_dir / "mineru"
+    script.write_text(MINERU_STUB)
+    script.chmod(script.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+# ---------- olmocr.pipeline 替身 ----------
+
+OLMOCR_PIPELINE_STUB = '''"""olmocr.pipeline 替身：為每個 PDF 寫出 Dolma 結果分片與 markdown"""
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+parser = argparse.ArgumentParser()
+parser.add_argument("workspace")
+parser.add_argument("--pdfs", nargs="+", default=[])
+parser.add_argument("--markdown", action="store_true")
+args, _ = parser.parse_known_args()
+
+workspace = Path(args.workspace)
+(workspace / "results").mkdir(parents=True, exist_ok=True)
+for pdf in args.pdfs:
+    digest = hashlib.sha1(pdf.encode()).hexdigest()
+    text = f"stub text for {Path(pdf).stem}"
+    record = {
+        "id": digest, "text": text, "source": "olmocr",
+        "metadata": {"Source-File": pdf, "pdf-total-pages": 1, "total-fallback-pages": 0},
+        "attributes": {"pdf_page_numbers": [[0, len(text), 1]]},
+    }
+    with open(workspace / "results" / f"output_{digest}.jsonl", "w") as f:
+        f.write(json.dumps(record) + "\\n")
+    if args.markdown:
+        # 與 olmocr 相同：保留 --pdfs 路徑的目錄結構
+        relative = Path(pdf.lstrip("/"))
+        markdown_dir = workspace / "markdown" / relative.parent
+        markdown_dir.mkdir(parents=True, exist_ok=True)
+        (markdown_dir / f"{relative.stem}.md").write_text(text)
+'''
+
+
+def install_olmocr_stub(package_root):
+    """寫出 olmocr 套件替身，返回應加到 PYTHONPATH 的目錄"""
+    package = Path(package_root) / "olmocr"
+    package.mkdir(parents=True, exist_ok=True)
+    (package / "__init__.py").write_text("")
+    (package / "pipeline.py").write_text(OLMOCR_PIPELINE_STUB)
+    return Path(package_root)
+
+
+def write_workspace(workspace, pdf_paths):
+    """直接生成含 len(pdf_paths) 個結果分片的 olmOCR workspace（用於讀取器基準）"""
+    results = Path(workspace) / "results"
+    results.mkdir(parents=True, exist_ok=True)
+    for pdf in map(str, pdf_paths):
+        digest = hashlib.sha1(pdf.encode()).hexdigest()
+        text = f"stub text for {Path(pdf).stem} " * 200
+        record = ('{"id": "%s", "text": "%s", "metadata": {"Source-File": "%s", "pdf-total-pages": 1}, '
+                  '"attributes": {"pdf_page_numbers": [[0, %d, 1]]}}\n' % (digest, text, pdf, len(text)))
+        (results / f"output_{digest}.jsonl").write_text(record)
+
+
+def prepend_env_path(name, directory):
+    os.environ[name] = os.pathsep.join(p for p in (str(directory), os.environ.get(name)) if p)
+
+
+# ---------- unstructured 元素替身 ----------
+
+class _Metadata:
+    __slots__ = ('page_number',)
+
+    def __init__(self, page_number):
+        self.page_number = page_number
+
+
+class _Element:
+    category = None
+
+    def __init__(self, text, page_number):
+        self.text = text
+        self.metadata = _Metadata(page_number)
+
+    def __str__(self):
+        return self.text
+
+
+# elements_to_markdown 按類名判斷元素類型
+class Title(_Element):
+    category = 'Title'
+
+
+class NarrativeText(_Element):
+    category = 'NarrativeText'
+
+
+class ListItem(_Element):
+    category = 'ListItem'
+
+
+class Table(_Element):
+    category = 'Table'
+
+
+_PATTERN = (Title, NarrativeText, NarrativeText, ListItem, ListItem, NarrativeText, Table, NarrativeText)
+
+
+def synthetic_elements(count, pages=3):
+    """確定性的元素序列：標題、段落、列表、表格交替出現"""
+    sentence = "Deterministic synthetic paragraph text used for wrapper benchmarks. "
+    return [
+        _PATTERN[i % len(_PATTERN)](f"{sentence * (1 + i % 4)}#{i}", 1 + (i * pages) // max(count, 1))
+        for i in range(count)
+    ]
+
+
+def stub_partition(pdf_path, elements_per_page=20):
+    """unstructured partition 替身：按文件頁數（由文件名決定）返回固定數量的元素"""
+    pages = 1 + int(Path(pdf_path).stem.rsplit('_', 1)[-1] or 0) % 3
+    return synthetic_elements(elements_per_page * pages, pages)
@@ -0,0 +1,3 @@
+"""
+03-advanced-tools 各工具共用的模組
+"""
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+增量 RAG 切塊：把各引擎輸出的 markdown 串流切成依標題分段、詞元數有上限的 chunk，輸出 JSONL
+
+- 每個 chunk 帶有所屬章節路徑與頁碼範圍（頁碼來自結果索引的 pages 表）
+- chunk_id 是 章節路徑 + 正規化文字 的雜湊，與位置無關；
+  切塊在每個標題處重新開始，修改一個章節只會影響該章節內的 chunk
+- 重新切塊時與上一次的 <文件>.chunks.jsonl 比較，新增/刪除的 chunk 寫入 <文件>.delta.jsonl，
+  下游只需為差異部分重新計算 embedding；<文件> 是來源路徑的 output_key，不同目錄的同名文件各自獨立
+
+用法：
+    python -m common.chunking index --engine mineru      # 從結果索引讀取各文件最新的 markdown 與頁面
+    python -m common.chunking files output/*.md --engine unstructured --max-tokens 384
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+from .discovery import output_key
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent.parent / "chunks"
+DEFAULT_MAX_TOKENS = 512
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+FENCE = '```'
+# 近似詞元：CJK 每字一個、英數連續串一個、其他符號各一個
+TOKEN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[A-Za-z0-9]+|[^\sA-Za-z0-9]')
+SENTENCE_RE = re.compile(r'(?<=[.!?。！？])\s+|(?<=[。！？])')
+# 頁碼定位時忽略的 markdown 符號與空白
+_NORMALIZE_RE = re.compile(r'[\s#*_`>|\-\[\]()]+')
+
+
+def count_tokens(text):
+    """近似詞元數（未使用特定 tokenizer，約等於 BPE 詞元數的 0.8～1 倍）"""
+    return sum(1 for _ in TOKEN_RE.finditer(text))
+
+
+def _normalize(text):
+    return _NORMALIZE_RE.sub('', text).lower()
+
+
+def iter_blocks(lines):
+    """
+    把 markdown 行串流切成區塊，產出 (類型, 標題層級, 文字)
+
+    類型為 'heading' 或 'text'；空行分隔段落，``` 圍起的代碼塊整塊保留（其中的 # 不視為標題）。
+    """
+    buf = []
+    in_fence = False
+    for line in lines:
+        line = line.rstrip('\r\n')
+        stripped = line.strip()
+        if in_fence:
+            buf.append(line)
+            if stripped.startswith(FENCE):
+                in_fence = False
+                yield ('text', 0, '\n'.join(buf))
+                buf = []
+            continue
+        if stripped.startswith(FENCE):
+            if buf:
+                yield ('text', 0, '\n'.join(buf))
+                buf = []
+            in_fence = True
+            buf.append(line)
+            continue
+        match = HEADING_RE.match(line)
+        if match:
+            if buf:
+                yield ('text', 0, '\n'.join(buf))
+                buf = []
+            yield ('heading', len(match.group(1)), match.group(2))
+            continue
+        if not stripped:
+            if buf:
+                yield ('text', 0, '\n'.join(buf))
+                buf = []
+            continue
+        buf.append(line)
+    if buf:
+        yield ('text', 0, '\n'.join(buf))
+
+
+class PageLocator:
+    """按頁文字定位段落所在頁碼；段落大致按頁序出現，從上一次命中的頁開始往後找"""
+
+    # 先用較長的片段定位，找不到時（例如段落跨頁）退回較短的開頭片段
+    PROBE_CHARS = (60, 20)
+
+    def __init__(self, pages):
+        items = pages.items() if isinstance(pages, dict) else pages
+        self.pages = sorted((int(n), _normalize(text or '')) for n, text in items)
+        self.position = 0
+
+    def locate(self, text):
+        normalized = _normalize(text)
+        if not normalized:
+            return None
+        order = list(range(self.position, len(self.pages))) + list(range(self.position))
+        for length in self.PROBE_CHARS:
+            probe = normalized[:length]
+            for i in order:
+                if probe in self.pages[i][1]:
+                    self.position = i
+                    return self.pages[i][0]
+        return None
+
+
+def _split_oversized(text, max_tokens, count=count_tokens):
+    """單一段落超過上限時先按句子、再按詞元邊界切開"""
+    pieces, current, current_tokens = [], [], 0
+    for sentence in (s for s in SENTENCE_RE.split(text) if s.strip()):
+        tokens = count(sentence)
+        if tokens > max_tokens:
+            if current:
+                pieces.append(' '.join(current))
+                current, current_tokens = [], 0
+            spans = list(TOKEN_RE.finditer(sentence))
+            for start in range(0, len(spans), max_tokens):
+                window = spans[start:start + max_tokens]
+                pieces.append(sentence[window[0].start():window[-1].end()])
+            continue
+        if current_tokens + tokens > max_tokens and current:
+            pieces.append(' '.join(current))
+            current, current_tokens = [], 0
+        current.append(sentence.strip())
+        current_tokens += tokens
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+
+def chunk_id(section, text):
+    """與位置無關的穩定雜湊：章節路徑 + 空白正規化後的文字"""
+    normalized = ' '.join(text.split())
+    payload = ' > '.join(section) + '\n' + normalized
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def chunk_markdown(lines, max_tokens=DEFAULT_MAX_TOKENS, pages=None, count=count_tokens):
+    """
+    從 markdown 行串流產出 chunk 字典：
+    {'chunk_id', 'index', 'section', 'pages', 'tokens', 'text'}
+
+    遇到標題即結束當前 chunk；段落累積到 max_tokens 為止，單段超限時再切開。
+    pages 為 {頁碼: 文字} 時為每個 chunk 標記頁碼範圍。
+    """
+    locator = PageLocator(pages) if pages else None
+    section = []      # [(層級, 標題)]
+    parts, part_pages, tokens = [], [], 0
+    index = 0
+    seen = {}
+
+    def make_chunk():
+        nonlocal index
+        titles = [title for _, title in section]
+        text = '\n\n'.join(parts)
+        cid = chunk_id(titles, text)
+        # 同一文件中完全相同的 chunk（例如重複的頁眉）加上序號區分
+        seen[cid] = seen.get(cid, 0) + 1
+        if seen[cid] > 1:
+            cid = f"{cid}-{seen[cid]}"
+        located = [p for p in part_pages if p is not None]
+        chunk = {
+            'chunk_id': cid,
+            'index': index,
+            'section': titles,
+            'pages': [min(located), max(located)] if located else None,
+            'tokens': tokens,
+            'text': text,
+        }
+        index += 1
+        return chunk
+
+    for kind, level, text in iter_blocks(lines):
+        if kind == 'heading':
+            if parts:
+                yield make_chunk()
+                parts, part_pages, tokens = [], [], 0
+            section = [h for h in section if h[0] < level] + [(level, text)]
+            continue
+
+        page = locator.locate(text) if locator else None
+        block_tokens = count(text)
+        pieces = [text] if block_tokens <= max_tokens else _split_oversized(text, max_tokens, count)
+        for piece in pieces:
+            piece_tokens = block_tokens if len(pieces) == 1 else count(piece)
+            if parts and tokens + piece_tokens > max_tokens:
+                yield make_chunk()
+                parts, part_pages, tokens = [], [], 0
+            parts.append(piece)
+            part_pages.append(page)
+            tokens += piece_tokens
+
+    if parts:
+        yield make_chunk()
+
+
+# ---------- 增量輸出 ----------
+
+def _previous_ids(path):
+    """讀取上一次輸出的 chunk_id（逐行，不保留文字）"""
+    ids = set()
+    if not path.exists():
+        return ids
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)['chunk_id'])
+            except (ValueError, KeyError):
+                continue
+    return ids
+
+
+def write_chunks(chunks, doc, engine, output_dir=None):
+    """
+    把 chunk 串流寫入 <output>/<engine>/<文件>.chunks.jsonl，並輸出與上次相比的差異
+
+    doc 是來源文件的完整路徑（結果索引中的 path 或 markdown 文件路徑），
+    <文件> 為 output_key(doc)，只用文件名做鍵時不同目錄的同名文件會互相覆蓋、產生錯誤的刪除差異。
+
+    差異寫入 <文件>.delta.jsonl：{'op': 'add', ...chunk} / {'op': 'remove', 'chunk_id'}；
+    沒有差異時刪除舊的 delta 文件。返回 {'chunks', 'added', 'removed', 'unchanged'}。
+    """
+    output_dir = Path(output_dir or DEFAULT_OUTPUT) / engine
+    output_dir.mkdir(parents=True, exist_ok=True)
+    doc = str(doc)
+    stem = output_key(doc)
+    chunks_path = output_dir / f"{stem}.chunks.jsonl"
+    delta_path = output_dir / f"{stem}.delta.jsonl"
+    previous = _previous_ids(chunks_path)
+
+    current = set()
+    added = 0
+    tmp_chunks = chunks_path.with_suffix('.jsonl.tmp')
+    tmp_delta = delta_path.with_suffix('.jsonl.tmp')
+    with open(tmp_chunks, 'w', encoding='utf-8') as out, open(tmp_delta, 'w', encoding='utf-8') as delta:
+        for chunk in chunks:
+            record = dict(chunk, doc=doc, file=Path(doc).name, engine=engine)
+            line = json.dumps(record, ensure_ascii=False)
+            out.write(line + '\n')
+            current.add(chunk['chunk_id'])
+            if chunk['chunk_id'] not in previous:
+                delta.write(json.dumps(dict(record, op='add'), ensure_ascii=False) + '\n')
+                added += 1
+        removed = previous - current
+        for cid in sorted(removed):
+            delta.write(json.dumps({'op': 'remove', 'chunk_id': cid, 'doc': doc, 'engine': engine}) + '\n')
+
+    os.replace(tmp_chunks, chunks_path)
+    if added or removed:
+        os.replace(tmp_delta, delta_path)
+    else:
+        os.remove(tmp_delta)
+        if delta_path.exists():
+            delta_path.unlink()
+    return {'chunks': len(current), 'added': added, 'removed': len(removed),
+            'unchanged': len(current) - added}
+
+
+def chunk_file(md_path, engine, output_dir=None, max_tokens=DEFAULT_MAX_TOKENS, pages=None):
+    """串流讀取一個 markdown 文件並增量寫出 chunk"""
+    md_path = Path(md_path)
+    with open(md_path, 'r', encoding='utf-8') as f:
+        return write_chunks(chunk_markdown(f, max_tokens, pages), md_path.resolve(), engine, output_dir)
+
+
+def _print_stats(name, engine, stats):
+    print(f"  🧩 {name} [{engine}]: {stats['chunks']} 個 chunk，"
+          f"新增 {stats['added']}，刪除 {stats['removed']}，未變 {stats['unchanged']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把引擎輸出的 markdown 增量切成 RAG chunk（JSONL）")
+    parser.add_argument("--output", help=f"輸出目錄（預設 {DEFAULT_OUTPUT}）")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="每個 chunk 的近似詞元上限")
+    sub = parser.add_subparsers(dest="source", required=True)
+    p_index = sub.add_parser("index", help="從結果索引讀取各文件最新一次成功運行的輸出（含頁碼）")
+    p_index.add_argument("--engine")
+    p_index.add_argument("--db", help="結果索引路徑")
+    p_files = sub.add_parser("files", help="直接切 markdown 文件（無頁碼）")
+    p_files.add_argument("paths", nargs="+")
+    p_files.add_argument("--engine", required=True)
+    args = parser.parse_args(argv)
+
+    totals = {'chunks': 0, 'added': 0, 'removed': 0}
+    if args.source == "files":
+        for path in args.paths:
+            stats = chunk_file(path, args.engine, args.output, args.max_tokens)
+            _print_stats(Path(path).name, args.engine, stats)
+            for key in totals:
+                totals[key] += stats[key]
+    else:
+        from .result_index import ResultIndex
+
+        with ResultIndex(args.db) as index:
+            for output in index.latest_outputs(engine=args.engine):
+                chunks = chunk_markdown(output['markdown'].splitlines(), args.max_tokens, output['pages'])
+                stats = write_chunks(chunks, output['path'], output['engine'], args.output)
+                _print_stats(output['file'], output['engine'], stats)
+                for key in totals:
+                    totals[key] += stats[key]
+
+    print(f"✅ 共 {totals['chunks']} 個 chunk，需重新 embedding {totals['added']} 個，移除 {totals['removed']} 個")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+語料發現：用 os.scandir 惰性遞迴遍歷目錄，邊走邊產出 PDF 工作項
+並把 路徑 / 大小 / mtime / 內容雜湊 持久化到 manifest（SQLite），
+下次運行時目錄 mtime 未變的目錄直接從 manifest 讀取，不再 scandir / stat 其中的文件
+
+注意：目錄 mtime 只在目錄內新增、刪除、重命名條目時改變；
+原地覆寫文件內容不會被察覺，需要時以 verify=True 重新 stat 所有文件。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_MANIFEST = Path(__file__).resolve().parent.parent / "manifest.db"
+HASH_CHUNK = 1024 * 1024
+# 每寫入這麼多條記錄提交一次
+COMMIT_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir);
+"""
+
+
+def output_key(path):
+    """
+    輸出文件 / 目錄的鍵：<文件名主幹>-<絕對路徑雜湊前 8 位>
+
+    遞迴發現時不同子目錄中的同名 PDF 很常見，只用文件名做鍵會讓輸出互相覆蓋；
+    同一路徑每次運行得到相同的鍵，續跑時仍能找到上次的輸出。
+    """
+    path = Path(path)
+    digest = hashlib.sha1(os.fsencode(path.resolve())).hexdigest()[:8]
+    stem = re.sub(r'[^\w.-]+', '_', path.stem) or 'document'
+    return f"{stem}-{digest}"
+
+
+def file_sha256(path):
+    """串流計算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """持久化的文件清單"""
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path or os.environ.get('OCR_MANIFEST_DB') or DEFAULT_MANIFEST)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        self._pending = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+        self.stats = {'dirs_scanned': 0, 'dirs_reused': 0, 'files': 0, 'changed': 0}
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _maybe_commit(self, n=1):
+        self._pending += n
+        if self._pending >= COMMIT_EVERY:
+            self._conn.commit()
+            self._pending = 0
+
+    # ---------- 遍歷 ----------
+
+    def walk(self, root, suffix='.pdf', verify=False):
+        """
+        惰性遍歷 root 下所有以 suffix 結尾的文件，逐個產出工作項字典：
+        {'path', 'size', 'mtime_ns', 'sha256', 'changed'}
+
+        'changed' 表示與上次 manifest 記錄相比為新增或已修改；
+        sha256 只在未變更且之前已計算過時才有值，其餘由 ensure_hash 按需計算。
+        """
+        suffix = suffix.lower()
+        stack = [os.fspath(root)]
+        self.stats = {'dirs_scanned': 0, 'dirs_reused': 0, 'files': 0, 'changed': 0}
+
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT mtime_ns, subdirs FROM dirs WHERE path = ?", (directory,)).fetchone()
+
+            if row is not None and row[0] == dir_mtime and not verify:
+                # 目錄未變：直接從 manifest 讀取文件與子目錄
+                self.stats['dirs_reused'] += 1
+                subdirs = [d for d in row[1].split('\0') if d]
+                stack.extend(reversed(subdirs))
+                with self._lock:
+                    cached = self._conn.execute(
+                        "SELECT path, size, mtime_ns, sha256 FROM files WHERE dir = ? ORDER BY path",
+                        (directory,)).fetchall()
+                for path, size, mtime_ns, sha256 in cached:
+                    self.stats['files'] += 1
+                    yield {'path': Path(path), 'size': size, 'mtime_ns': mtime_ns,
+                           'sha256': sha256, 'changed': False}
+                continue
+
+            self.stats['dirs_scanned'] += 1
+            yield from self._scan_dir(directory, dir_mtime, suffix, stack)
+
+    def _scan_dir(self, directory, dir_mtime, suffix, stack):
+        """scandir 一個已變更（或首次見到）的目錄，並更新 manifest"""
+        subdirs, entries = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            # 跳過隱藏目錄（例如預檢修復副本的 .repaired）
+                            if not entry.name.startswith('.'):
+                                subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(suffix) and entry.is_file():
+                            entries.append(entry)
+                    except OSError:
+                        continue
+        except OSError:
+            return
+
+        subdirs.sort()
+        entries.sort(key=lambda e: e.name)
+        stack.extend(reversed(subdirs))
+
+        with self._lock:
+            known = {path: (size, mtime_ns, sha256) for path, size, mtime_ns, sha256 in self._conn.execute(
+                "SELECT path, size, mtime_ns, sha256 FROM files WHERE dir = ?", (directory,))}
+
+        seen = set()
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            seen.add(entry.path)
+            previous = known.get(entry.path)
+            changed = previous is None or previous[:2] != (st.st_size, st.st_mtime_ns)
+            sha256 = None if changed else previous[2]
+            if changed:
+                with self._lock:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, NULL)",
+                        (entry.path, directory, st.st_size, st.st_mtime_ns))
+                    self._maybe_commit()
+                self.stats['changed'] += 1
+            self.stats['files'] += 1
+            yield {'path': Path(entry.path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                   'sha256': sha256, 'changed': changed}
+
+        removed = [path for path in known if path not in seen]
+        with self._lock:
+            if removed:
+                self._conn.executemany("DELETE FROM files WHERE path = ?", ((p,) for p in removed))
+            # 目錄記錄在文件全部寫入後才更新，遍歷中途中斷時下次會重新掃描該目錄
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+                (directory, dir_mtime, '\0'.join(subdirs)))
+            self._maybe_commit(len(removed) + 1)
+
+    # ---------- 雜湊 ----------
+
+    def ensure_hash(self, item):
+        """返回工作項的內容雜湊，尚未計算時現場計算並寫回 manifest"""
+        if item.get('sha256'):
+            return item['sha256']
+        sha256 = file_sha256(item['path'])
+        item['sha256'] = sha256
+        with self._lock:
+            self._conn.execute(
+                "UPDATE files SET sha256 = ? WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (sha256, os.fspath(item['path']), item['size'], item['mtime_ns']))
+            self._maybe_commit()
+        return sha256
+
+    def print_stats(self):
+        s = self.stats
+        print(f"🗂️  發現 {s['files']} 個PDF（{s['changed']} 個新增/變更），"
+              f"掃描 {s['dirs_scanned']} 個目錄，沿用 manifest {s['dirs_reused']} 個目錄")
+
+
+def discover_pdfs(root, manifest=None, verify=False):
+    """便捷函數：遍歷 root 並產出工作項；未提供 manifest 時使用預設位置"""
+    own = manifest is None
+    manifest = manifest or Manifest()
+    try:
+        yield from manifest.walk(root, verify=verify)
+    finally:
+        if own:
+            manifest.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    root = sys.argv[1] if len(sys.argv) > 1 else Path(__file__).resolve().parent.parent / "test_pdfs"
+    start = time.time()
+    first = None
+    with Manifest() as manifest:
+        for n, item in enumerate(manifest.walk(root), 1):
+            if first is None:
+                first = time.time() - start
+        manifest.print_stats()
+    if first is not None:
+        print(f"⏱️  首個工作項: {first * 1000:.1f}ms，總耗時: {time.time() - start:.2f}秒")
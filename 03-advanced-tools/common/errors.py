@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+引擎輸出錯誤分類與重試策略
+將 mineru / olmOCR 等子進程的返回碼與輸出映射為錯誤代碼，並按代碼決定是否重試
+"""
+
+import re
+import time
+
+# 錯誤代碼
+OK = 'ok'
+BENIGN_WARNING = 'benign_warning'
+OOM = 'oom'
+TIMEOUT = 'timeout'
+MISSING_BINARY = 'missing_binary'
+CORRUPT_PDF = 'corrupt_pdf'
+SERVER_CRASH = 'server_crash'
+COMPAT = 'compat'
+UNKNOWN = 'unknown'
+
+# 各代碼的說明（用於結果中的 error 欄位）
+ERROR_MESSAGES = {
+    OOM: 'GPU 記憶體不足',
+    TIMEOUT: '處理超時',
+    MISSING_BINARY: '命令或模組未找到，請確認已安裝',
+    CORRUPT_PDF: 'PDF 文件損壞或無法解析',
+    SERVER_CRASH: '推理服務崩潰或無法連接',
+    COMPAT: '依賴版本不兼容（vLLM / torch 內部錯誤）',
+    UNKNOWN: '未知錯誤',
+}
+
+# 按優先順序排列的致命錯誤特徵（預編譯，逐行匹配前先整段搜索）
+_FATAL_PATTERNS = [
+    (OOM, re.compile(
+        r'out of memory|CUDA error: out of memory|OutOfMemoryError'
+        r'|kv cache is larger|not enough (?:gpu )?memory|insufficient gpu memory',
+        re.IGNORECASE)),
+    (COMPAT, re.compile(
+        r"AttributeError:.*_inductor.*config|undefined symbol|_ARRAY_API not found"
+        r"|compiled using NumPy 1\.x cannot be run in NumPy 2",
+        re.IGNORECASE)),
+    (MISSING_BINARY, re.compile(
+        r'command not found|No such file or directory: .?(?:mineru|vllm|sglang)'
+        r"|ModuleNotFoundError: No module named|No module named '?olmocr",
+        re.IGNORECASE)),
+    (CORRUPT_PDF, re.compile(
+        r'PdfReadError|PDFSyntaxError|EOF marker not found|startxref not found'
+        r'|xref table (?:is )?(?:broken|corrupt)|FileDataError|cannot open broken document'
+        r'|PDF is encrypted|password required|not a PDF file|Invalid PDF',
+        re.IGNORECASE)),
+    (SERVER_CRASH, re.compile(
+        r'vllm server task ended|server (?:process )?(?:died|crashed|exited)'
+        r'|Connection refused|ConnectionResetError|RemoteDisconnected'
+        r'|Engine core (?:proc|process).*died|SIGKILL',
+        re.IGNORECASE)),
+]
+
+# 只出現這類字樣不代表失敗（例如 mineru 成功時也會記錄 "error" 字眼）
+_GENERIC_ERROR = re.compile(r'\berror\b|traceback|not found', re.IGNORECASE)
+# Python 異常堆疊的開頭，最後一行通常是 "XxxError: ..."
+_TRACEBACK = re.compile(r'Traceback \(most recent call last\):', re.IGNORECASE)
+
+# 每種錯誤代碼的重試策略
+# adjust 中的數值為乘數，只作用於調用方傳入且存在的參數；
+# requires_adjust 為 True 時，若沒有任何參數可調整則不重試（原樣重跑必然再次失敗）
+RETRY_POLICIES = {
+    OOM: {'max_retries': 2, 'backoff': 5.0, 'requires_adjust': True,
+          'adjust': {'concurrency': 0.5, 'max_model_len': 0.5, 'vram': 0.5}},
+    TIMEOUT: {'max_retries': 1, 'backoff': 0.0, 'adjust': {'timeout': 1.5}},
+    SERVER_CRASH: {'max_retries': 2, 'backoff': 10.0, 'adjust': {}},
+    UNKNOWN: {'max_retries': 1, 'backoff': 2.0, 'adjust': {}},
+    MISSING_BINARY: {'max_retries': 0},
+    CORRUPT_PDF: {'max_retries': 0},
+    COMPAT: {'max_retries': 0},
+}
+
+
+def classify_output(returncode, output, has_output=True):
+    """
+    根據返回碼與輸出文本判斷錯誤代碼
+
+    返回碼為 0 且已產生輸出時，日誌中的致命特徵只是可恢復的警告
+    （如 pypdf 修復 xref 時的 "EOF marker not found"、OOM 後回退到 CPU 的日誌），歸為 BENIGN_WARNING；
+    返回碼為 0 但沒有輸出（has_output=False）時，命中致命特徵才視為失敗（服務器關閉日誌除外）。
+    僅包含 "error" / "traceback" 等泛用字眼時歸為 BENIGN_WARNING。
+    """
+    output = output or ''
+    for code, pattern in _FATAL_PATTERNS:
+        if pattern.search(output):
+            if returncode == 0 and has_output:
+                return BENIGN_WARNING
+            # 返回碼 0 時，服務器相關字眼通常只是關閉時的日誌
+            if returncode == 0 and code == SERVER_CRASH:
+                continue
+            return code
+
+    if returncode == 0:
+        return BENIGN_WARNING if _GENERIC_ERROR.search(output) else OK
+    if returncode in (-9, 137):
+        return OOM
+    if returncode == 127:
+        return MISSING_BINARY
+    return UNKNOWN
+
+
+def classify_exception(exc):
+    """將子進程調用拋出的異常映射為錯誤代碼"""
+    name = type(exc).__name__
+    if name == 'TimeoutExpired':
+        return TIMEOUT
+    if isinstance(exc, FileNotFoundError):
+        return MISSING_BINARY
+    if isinstance(exc, MemoryError):
+        return OOM
+    return classify_output(1, f"{name}: {exc}")
+
+
+def is_failure(code):
+    return code not in (OK, BENIGN_WARNING)
+
+
+def extract_error_line(output, code=None, limit=300):
+    """從輸出中挑出最能說明錯誤的一行"""
+    output = output or ''
+    lines = output.strip().split('\n')
+    if code is not None:
+        pattern = dict(_FATAL_PATTERNS).get(code)
+        if pattern is not None:
+            for line in lines:
+                if pattern.search(line):
+                    return line.strip()[:limit]
+    # 取 Traceback 後的最後一行（通常是異常類型與信息）
+    if _TRACEBACK.search(output):
+        return lines[-1].strip()[:limit]
+    for line in lines:
+        if _GENERIC_ERROR.search(line):
+            return line.strip()[:limit]
+    return output.strip()[:limit]
+
+
+def error_result(code, output='', detail=None):
+    """組合統一格式的失敗結果字典"""
+    message = ERROR_MESSAGES.get(code, ERROR_MESSAGES[UNKNOWN])
+    detail = detail if detail is not None else extract_error_line(output, code)
+    return {
+        'success': False,
+        'error_code': code,
+        'error': f"{message}: {detail}" if detail else message,
+    }
+
+
+def adjust_params(code, params, policies=None):
+    """按重試策略調整參數（只調整 params 中已存在的數值參數）"""
+    adjust = (policies or RETRY_POLICIES).get(code, {}).get('adjust', {})
+    new_params = dict(params)
+    for key, factor in adjust.items():
+        value = new_params.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            scaled = value * factor
+            new_params[key] = max(1, int(scaled)) if isinstance(value, int) else scaled
+    return new_params
+
+
+def run_with_retry(run_fn, params=None, policies=None, sleep=time.sleep):
+    """
+    執行 run_fn(params) 並按錯誤代碼重試
+
+    run_fn 返回結果字典，失敗時帶 'error_code'；每次重試前按策略調整參數。
+    最終結果中記錄 'attempts' 與每次失敗的代碼 'retry_codes'。
+    """
+    policies = policies or RETRY_POLICIES
+    params = dict(params or {})
+    retries = {}
+    retry_codes = []
+
+    while True:
+        result = run_fn(params)
+        code = result.get('error_code')
+        if result.get('success') or code is None:
+            break
+
+        policy = policies.get(code, {})
+        used = retries.get(code, 0)
+        if used >= policy.get('max_retries', 0):
+            break
+
+        new_params = adjust_params(code, params, policies)
+        if policy.get('requires_adjust') and new_params == params:
+            break
+
+        retries[code] = used + 1
+        retry_codes.append(code)
+        params = new_params
+        backoff = policy.get('backoff', 0.0) * (used + 1)
+        print(f"  🔁 {ERROR_MESSAGES.get(code, code)}，第 {used + 1} 次重試 (參數: {params})")
+        if backoff:
+            sleep(backoff)
+
+    result['attempts'] = len(retry_codes) + 1
+    if retry_codes:
+        result['retry_codes'] = retry_codes
+    return result
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+批量處理指標（Prometheus 文本格式）
+提供計數器、儀表與直方圖，可透過本地 HTTP 端點或定期重寫的 textfile 導出
+
+環境變量：
+    OCR_METRICS_PORT      設定後在該端口啟動 /metrics HTTP 端點
+    OCR_METRICS_TEXTFILE  設定後定期把指標寫入該文件（供 node_exporter textfile collector 讀取）
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 引擎延遲的預設分桶（秒）：單頁幾秒到整份文件 45 分鐘
+DEFAULT_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 2700)
+
+_textfile_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指標基類：按標籤值保存子序列"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = list(self._children.items())
+        for key, child in items:
+            lines.extend(self._render(key, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _render(self, key, child):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set(self, value):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def _render(self, key, child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """指標註冊表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+        return metric
+
+    def exposition(self):
+        """輸出 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# OCR 批量處理的標準指標
+FILES_PROCESSED = REGISTRY.register(Counter(
+    'ocr_files_processed_total', '已處理的 PDF 文件數', ('engine', 'status')))
+PAGES_PROCESSED = REGISTRY.register(Counter(
+    'ocr_pages_processed_total', '已處理的頁數', ('engine',)))
+ENGINE_LATENCY = REGISTRY.register(Histogram(
+    'ocr_engine_latency_seconds', '單份文件的引擎處理時間（秒）', ('engine',)))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'ocr_queue_depth', '等待處理的文件數', ('engine',)))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    'ocr_in_flight_jobs', '正在處理的文件數', ('engine',)))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    'ocr_queue_wait_seconds', '單份文件在各階段隊列中等待的總時間（秒）', ('engine', 'priority')))
+PREEMPTIONS = REGISTRY.register(Counter(
+    'ocr_preemptions_total', '為 interactive 文件讓出位置而被搶佔的 bulk 文件數', ('engine',)))
+OUTPUT_BYTES = REGISTRY.register(Counter(
+    'ocr_output_bytes_total', '輸出內容的總位元組數', ('engine',)))
+FAILURES = REGISTRY.register(Counter(
+    'ocr_failures_total', '按原因分類的失敗次數', ('engine', 'cause')))
+LAST_PROGRESS = REGISTRY.register(Gauge(
+    'ocr_last_progress_timestamp_seconds', '最近一次完成文件的時間戳（用於停滯告警）', ('engine',)))
+
+
+@contextmanager
+def track_engine(engine):
+    """只記錄在途數與引擎延遲；結果稍後由調用方用 observe_result 記錄（分階段流水線使用）"""
+    in_flight = IN_FLIGHT.labels(engine)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        in_flight.dec()
+        ENGINE_LATENCY.labels(engine).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def track_job(engine):
+    """
+    記錄一份文件的在途數與延遲
+
+    yield 一個字典，調用方填入 'result'（含 success / output_size / error_code）
+    以及可選的 'pages'，退出時自動更新計數器。
+    """
+    record = {}
+    try:
+        with track_engine(engine):
+            yield record
+    except Exception as e:
+        record['result'] = {'success': False, 'error_code': type(e).__name__}
+        raise
+    finally:
+        observe_result(engine, record.get('result') or {}, pages=record.get('pages'))
+
+
+def observe_result(engine, result, pages=None):
+    """根據單份文件的結果字典更新計數器"""
+    success = bool(result.get('success'))
+    FILES_PROCESSED.labels(engine, 'success' if success else 'failed').inc()
+    if success:
+        OUTPUT_BYTES.labels(engine).inc(result.get('output_size', 0) or 0)
+    else:
+        FAILURES.labels(engine, result.get('error_code') or 'unknown').inc()
+    if pages:
+        PAGES_PROCESSED.labels(engine).inc(pages)
+    LAST_PROGRESS.labels(engine).set(time.time())
+
+
+def write_textfile(path, registry=REGISTRY):
+    """原子地重寫 textfile（先寫臨時文件再 rename）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with _textfile_lock:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(registry.exposition())
+        os.replace(tmp_path, path)
+
+
+def start_textfile_writer(path, interval=15.0, registry=REGISTRY):
+    """啟動後台線程，每 interval 秒重寫一次 textfile"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            write_textfile(path, registry)
+
+    write_textfile(path, registry)
+    threading.Thread(target=loop, daemon=True, name='metrics-textfile').start()
+    return stop
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """在後台線程啟動 /metrics HTTP 端點"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics-http').start()
+    return server
+
+
+def start_from_env():
+    """按環境變量啟動導出（未設定時不做任何事）"""
+    exporters = {}
+    port = os.environ.get('OCR_METRICS_PORT')
+    if port:
+        exporters['http'] = start_http_server(int(port))
+        print(f"📈 指標端點: http://127.0.0.1:{port}/metrics")
+    textfile = os.environ.get('OCR_METRICS_TEXTFILE')
+    if textfile:
+        exporters['textfile'] = start_textfile_writer(textfile)
+        print(f"📈 指標文件: {textfile}")
+    return exporters
+
+
+def stop_exporters(exporters):
+    """停止導出並寫出最終的 textfile"""
+    if 'textfile' in exporters:
+        exporters['textfile'].set()
+        write_textfile(os.environ['OCR_METRICS_TEXTFILE'])
+    if 'http' in exporters:
+        exporters['http'].shutdown()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+分階段處理流水線
+discover → preflight → engine → post-process → write/index，各階段之間用有界隊列連接，
+每個階段有獨立大小的線程池；下游變慢時上游自動阻塞（背壓），記憶體佔用有上限。
+結束後輸出各階段的忙碌 / 等待輸入 / 等待下游 比例，找出瓶頸階段。
+
+每項帶優先級（common.priority）：source 產出的是 bulk，submit / inbox 送入的是 interactive；
+各階段隊列總是先取 interactive，可保留部分引擎線程只處理 interactive，
+並可搶佔剛開始不久的 bulk 工作（放回隊首稍後重跑）。
+"""
+
+import threading
+import time
+
+from common.priority import (
+    BULK, CLASSES, INTERACTIVE, MAX_PREEMPTIONS, CancelToken, ClassQueue, Preempted, cancellable, percentile,
+)
+
+_DONE = object()
+
+
+class Stage:
+    """
+    流水線中的一個階段
+
+    fn(ctx) 接收並返回上下文字典（返回 None 表示丟棄該項）。
+    fn 拋出異常時上下文被標記為失敗（ctx['failed']），後續 always=False 的階段會跳過它，
+    always=True 的階段（通常是最後的寫入/索引）仍會處理，以便記錄失敗結果。
+
+    reserved：保留給 interactive 的線程數（至少留一個線程處理 bulk）。
+    preempt_grace：設定時 bulk 工作可被搶佔——fn 內經 priority.run_command 啟動的子進程被終止，
+    只搶佔已運行不超過 preempt_grace 秒的工作；None 表示不搶佔（例如進程內執行的引擎）。
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=None, always=False, queue_gauge=None,
+                 reserved=0, preempt_grace=None, preempt_counter=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        # 預設隊列容量為工作線程數的兩倍
+        self.queue_size = queue_size or self.workers * 2
+        self.always = always
+        self.queue_gauge = queue_gauge
+        self.reserved = max(0, min(reserved, self.workers - 1))
+        self.preempt_grace = preempt_grace
+        self.preempt_counter = preempt_counter
+        self.input = None
+        self._lock = threading.Lock()
+        self.items = 0
+        self.failures = 0
+        self.preempted = 0
+        self.idle = 0         # 正在等待輸入的線程數
+        self.running = {}     # 可搶佔的 bulk 工作：CancelToken → 開始時間
+        self.busy = 0.0       # 執行 fn 的時間
+        self.starved = 0.0    # 等待上游輸入的時間
+        self.blocked = 0.0    # 等待下游隊列空位的時間
+
+    def _account(self, busy=0.0, starved=0.0, blocked=0.0, items=0, failures=0):
+        with self._lock:
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.items += items
+            self.failures += failures
+
+    def preempt_youngest(self):
+        """取消運行時間最短且未超過 preempt_grace 的 bulk 工作，返回是否取消了一個"""
+        if self.preempt_grace is None:
+            return False
+        now = time.perf_counter()
+        with self._lock:
+            # 已取消但尚未退出的工作也會讓出線程，不重複搶佔
+            waiting = self.input.count(INTERACTIVE) - self.idle
+            waiting -= sum(1 for token in self.running if token.cancelled)
+            if waiting <= 0:
+                return False
+            candidates = [(start, token) for token, start in self.running.items()
+                          if not token.cancelled and now - start <= self.preempt_grace]
+            if not candidates:
+                return False
+            _, token = max(candidates, key=lambda c: c[0])
+            token.cancel(f"{self.name}: 為 interactive 文件讓出位置")
+        return True
+
+
+class Pipeline:
+    """
+    由多個 Stage 組成的流水線
+
+    wait_metric(priority) 返回一個直方圖子項，用來記錄每份文件在各隊列中的等待總時間。
+    """
+
+    def __init__(self, stages, wait_metric=None):
+        if not stages:
+            raise ValueError("流水線至少需要一個階段")
+        self.stages = list(stages)
+        for stage in self.stages:
+            stage.input = ClassQueue(stage.queue_size, closed_marker=_DONE)
+        self.wait_metric = wait_metric
+        self.waits = {cls: [] for cls in CLASSES}
+        self.wall_time = 0.0
+        self._pending = 0     # 已送入但尚未離開流水線的項目數
+        self._source_done = False
+        self._drained = threading.Condition()
+
+    def run(self, source, inbox=None, poll_interval=1.0):
+        """
+        從 source（可迭代的上下文字典，例如 discover 的生成器）逐項送入流水線
+
+        source 本身在調用線程中惰性迭代，受第一個階段的隊列容量限制，其中各項為 bulk；
+        inbox（帶 poll() 方法、返回上下文字典）每 poll_interval 秒輪詢一次，產出的項以 interactive 送入，
+        直到 source 結束且所有已送入的項都離開流水線。
+        返回最後一個階段輸出的上下文列表（順序不保證與輸入一致）。
+        """
+        outputs = []
+        outputs_lock = threading.Lock()
+        threads = []
+        start = time.perf_counter()
+
+        for index, stage in enumerate(self.stages):
+            downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            remaining = [stage.workers]
+            for n in range(stage.workers):
+                classes = (INTERACTIVE,) if n < stage.reserved else CLASSES
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(stage, downstream, remaining, outputs, outputs_lock, classes),
+                    name=f"{stage.name}-{n}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        self._source_done = False
+        watcher = None
+        if inbox is not None:
+            watcher = threading.Thread(target=self._watch, args=(inbox, poll_interval), name="inbox", daemon=True)
+            watcher.start()
+
+        try:
+            for ctx in source:
+                ctx.setdefault('priority', BULK)
+                self._enter(ctx)
+        finally:
+            with self._drained:
+                self._source_done = True
+                self._drained.notify_all()
+            if watcher is not None:
+                watcher.join()
+            self.stages[0].input.close()
+
+        for t in threads:
+            t.join()
+        self.wall_time = time.perf_counter() - start
+        return outputs
+
+    def submit(self, ctx, priority=INTERACTIVE):
+        """在運行期間插入一項（預設為 interactive），必須在第一個階段的隊列關閉前調用"""
+        ctx['priority'] = priority
+        self._enter(ctx)
+
+    def _enter(self, ctx):
+        with self._drained:
+            self._pending += 1
+        self._put(self.stages[0], ctx, None)
+
+    def _leave(self):
+        with self._drained:
+            self._pending -= 1
+            if self._pending == 0:
+                self._drained.notify_all()
+
+    def _watch(self, inbox, poll_interval):
+        """輪詢 inbox，直到 source 結束、流水線排空且收件目錄沒有新文件"""
+        while True:
+            with self._drained:
+                if not (self._source_done and self._pending == 0):
+                    self._drained.wait(poll_interval)
+                drained = self._source_done and self._pending == 0
+            contexts = inbox.poll()
+            for ctx in contexts:
+                self.submit(ctx)
+            if drained and not contexts:
+                return
+
+    @staticmethod
+    def _put(target, ctx, stage, front=False):
+        """放入 target 階段的隊列並記錄阻塞時間；interactive 項沒有空閒線程時嘗試搶佔 bulk 工作"""
+        t0 = time.perf_counter()
+        ctx['_enqueued'] = t0
+        target.input.put(ctx, ctx['priority'], front=front)
+        if stage is not None:
+            stage._account(blocked=time.perf_counter() - t0)
+        if target.queue_gauge is not None:
+            target.queue_gauge.set(target.input.qsize())
+        if ctx['priority'] == INTERACTIVE:
+            target.preempt_youngest()
+
+    def _run_fn(self, stage, ctx):
+        """執行 stage.fn；可搶佔的 bulk 工作在取消標記下運行"""
+        preemptible = (stage.preempt_grace is not None and ctx['priority'] == BULK
+                       and ctx.get('preemptions', 0) < MAX_PREEMPTIONS)
+        if not preemptible:
+            return stage.fn(ctx)
+        token = CancelToken()
+        with stage._lock:
+            stage.running[token] = time.perf_counter()
+        try:
+            with cancellable(token):
+                return stage.fn(ctx)
+        finally:
+            with stage._lock:
+                del stage.running[token]
+
+    def _worker(self, stage, downstream, remaining, outputs, outputs_lock, classes):
+        while True:
+            t0 = time.perf_counter()
+            with stage._lock:
+                stage.idle += 1
+            ctx = stage.input.get(classes)
+            with stage._lock:
+                stage.idle -= 1
+            now = time.perf_counter()
+            stage._account(starved=now - t0)
+            if stage.queue_gauge is not None:
+                stage.queue_gauge.set(stage.input.qsize())
+
+            if ctx is _DONE:
+                # 隊列關閉後其他線程也會取到結束標記；最後一個線程負責通知下游
+                with stage._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and downstream is not None:
+                    downstream.input.close()
+                return
+
+            ctx['queue_wait'] = ctx.get('queue_wait', 0.0) + now - ctx.pop('_enqueued', now)
+            if not ctx.get('failed') or stage.always:
+                t0 = time.perf_counter()
+                try:
+                    ctx = self._run_fn(stage, ctx)
+                    stage._account(busy=time.perf_counter() - t0, items=1)
+                except Preempted as e:
+                    # 引擎子進程已終止：放回 bulk 隊首，等 interactive 文件處理完再重跑
+                    stage._account(busy=time.perf_counter() - t0)
+                    with stage._lock:
+                        stage.preempted += 1
+                    if stage.preempt_counter is not None:
+                        stage.preempt_counter.inc()
+                    ctx['preemptions'] = ctx.get('preemptions', 0) + 1
+                    print(f"  ⏸️  {e}，bulk 文件重新排隊（第 {ctx['preemptions']} 次）")
+                    self._put(stage, ctx, None, front=True)
+                    continue
+                except Exception as e:
+                    stage._account(busy=time.perf_counter() - t0, items=1, failures=1)
+                    ctx['failed'] = True
+                    ctx.setdefault('errors', []).append(f"{stage.name}: {type(e).__name__}: {e}")
+            if ctx is None:
+                self._leave()
+                continue
+
+            if downstream is not None:
+                self._put(downstream, ctx, stage)
+            else:
+                with outputs_lock:
+                    outputs.append(ctx)
+                    self.waits[ctx['priority']].append(ctx['queue_wait'])
+                if self.wait_metric is not None:
+                    self.wait_metric(ctx['priority']).observe(ctx['queue_wait'])
+                self._leave()
+
+    def stats(self):
+        """各階段的利用率統計（比例以 工作線程數 × 總時長 為分母）"""
+        rows = []
+        for stage in self.stages:
+            capacity = stage.workers * self.wall_time or 1.0
+            rows.append({
+                'stage': stage.name,
+                'workers': stage.workers,
+                'items': stage.items,
+                'failures': stage.failures,
+                'preempted': stage.preempted,
+                'busy': stage.busy / capacity,
+                'starved': stage.starved / capacity,
+                'blocked': stage.blocked / capacity,
+                'avg_time': stage.busy / stage.items if stage.items else 0.0,
+            })
+        return rows
+
+    def bottleneck(self):
+        """忙碌比例最高的階段即瓶頸"""
+        rows = self.stats()
+        return max(rows, key=lambda r: r['busy'])['stage'] if rows else None
+
+    def wait_stats(self):
+        """按優先級統計每份文件的隊列等待總時間（秒）"""
+        rows = []
+        for cls in CLASSES:
+            waits = sorted(self.waits[cls])
+            if waits:
+                rows.append({'priority': cls, 'count': len(waits), 'p50': percentile(waits, 0.5),
+                             'p95': percentile(waits, 0.95), 'max': waits[-1]})
+        return rows
+
+    def print_stats(self):
+        print(f"\n⚙️  流水線階段統計（總時長 {self.wall_time:.2f}秒）:")
+        print(f"   {'階段':<14}{'線程':>4}{'項目':>6}{'忙碌':>8}{'等輸入':>8}{'等下游':>8}{'平均':>9}")
+        for r in self.stats():
+            print(f"   {r['stage']:<14}{r['workers']:>4}{r['items']:>6}"
+                  f"{r['busy']:>8.0%}{r['starved']:>8.0%}{r['blocked']:>8.0%}{r['avg_time']:>8.2f}s")
+        print(f"   瓶頸階段: {self.bottleneck()}")
+        preempted = sum(stage.preempted for stage in self.stages)
+        if preempted:
+            print(f"   被搶佔的 bulk 工作: {preempted}")
+        rows = self.wait_stats()
+        if any(r['priority'] == INTERACTIVE for r in rows):
+            print(f"   {'隊列等待':<14}{'文件':>6}{'p50':>9}{'p95':>9}{'最長':>9}")
+            for r in rows:
+                print(f"   {r['priority']:<14}{r['count']:>6}{r['p50']:>8.2f}s{r['p95']:>8.2f}s{r['max']:>8.2f}s")
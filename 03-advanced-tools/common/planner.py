@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+"""
+期限驅動的引擎規劃：在給定的截止時間內處理完整個語料，並讓每份文件用上品質最高的引擎
+
+- 吞吐量剖面：結果索引中各引擎按文字層（文字版 / 掃描版）的歷史每頁耗時與頁面成功率，
+  沒有歷史時用 common.sampling 的 estimate.json 補上
+- 品質剖面：各引擎在文字版 / 掃描版上的品質分數（0～1，可用 --quality 覆蓋），
+  期望品質 = 品質分數 × 頁面成功率
+- 規劃：每份文件先分配給期望品質最高的引擎；某個引擎的隊列超出剩餘時間時，
+  把「每省一秒損失品質最少」的文件降級到其他引擎，直到所有引擎都能在期限前完成
+- 執行：各引擎按各自的並發數從規劃中取文件（大文件優先），實際吞吐量偏離剖面時重新規劃尚未開始的文件
+
+用法：
+    python -m common.planner plan /data/papers --deadline 06:00                 # 只看規劃
+    python -m common.planner run /data/papers --deadline +8h --slots unstructured=8
+    python -m common.planner plan /data/papers --deadline 2026-10-20T06:00 --estimate sample_runs/<時間戳>/estimate.json
+"""
+
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from .discovery import Manifest
+from .preflight import preflight_pdf, summarize
+from .sampling import ENGINES, TOOLS_DIR, _load_runner
+
+# 預設品質分數：MinerU 複雜版面最強，olmOCR 掃描件最準，Unstructured 不適合掃描件
+DEFAULT_QUALITY = {
+    'mineru': {'text': 0.90, 'scan': 0.85},
+    'olmocr': {'text': 0.85, 'scan': 0.95},
+    'unstructured': {'text': 0.70, 'scan': 0.20},
+}
+# 各引擎同時處理的文件數（mineru / olmOCR 受 GPU 限制）
+DEFAULT_SLOTS = {'mineru': 1, 'unstructured': 4, 'olmocr': 1}
+# 只規劃剩餘時間的這個比例，留出估計誤差
+DEFAULT_SAFETY = 0.9
+# 融合觀測值時，剖面的權重相當於多少頁的觀測
+PRIOR_PAGES = 50
+# 觀測到的每頁耗時偏離規劃時所用的值超過此比例時重新規劃
+DRIFT_THRESHOLD = 0.15
+# 兩次重新規劃之間至少完成的文件數
+REPLAN_EVERY = 5
+
+LAYERS = ('text', 'scan')
+
+
+def layer_of(report):
+    return 'text' if report.get('has_text_layer') else 'scan'
+
+
+# ---------- 剖面 ----------
+
+def profiles_from_index(index):
+    """從結果索引的歷史運行得到 {(引擎, 文字層): {'sec_per_page', 'success_rate', 'pages'}}"""
+    profiles = {}
+    for row in index.throughput():
+        if row['has_text_layer'] is None:
+            continue
+        key = (row['engine'], 'text' if row['has_text_layer'] else 'scan')
+        profiles[key] = {
+            'sec_per_page': row['seconds'] / row['pages'],
+            'success_rate': row['success_pages'] / row['pages'],
+            'pages': row['pages'],
+            'source': 'history',
+        }
+    return profiles
+
+
+def profiles_from_estimate(path):
+    """從 common.sampling 的 estimate.json 得到剖面（各層按抽樣頁數加權合併到文字層）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        estimates = json.load(f)['estimates']
+    profiles = {}
+    for engine, est in estimates.items():
+        merged = {}
+        for stratum in est['strata']:
+            layer = stratum['stratum'].split('/')[1]
+            pages, seconds, ok = merged.get(layer, (0, 0.0, 0.0))
+            n = stratum['sample_pages']
+            merged[layer] = (pages + n, seconds + n * stratum['sec_per_page'], ok + n * stratum['success_rate'])
+        for layer, (pages, seconds, ok) in merged.items():
+            if pages:
+                profiles[(engine, layer)] = {'sec_per_page': seconds / pages, 'success_rate': ok / pages,
+                                             'pages': pages, 'source': 'sample'}
+    return profiles
+
+
+def merge_profiles(*sources):
+    """前面的來源優先；某引擎只有一個文字層的剖面時，另一層沿用同一個值"""
+    profiles = {}
+    for source in sources:
+        for key, profile in source.items():
+            profiles.setdefault(key, profile)
+    for engine in {engine for engine, _ in profiles}:
+        known = [layer for layer in LAYERS if (engine, layer) in profiles]
+        for layer in LAYERS:
+            if (engine, layer) not in profiles and known:
+                profiles[(engine, layer)] = dict(profiles[(engine, known[0])], source='borrowed')
+    return profiles
+
+
+# ---------- 規劃 ----------
+
+class Planner:
+    """
+    把文件分配給引擎，並在執行過程中根據觀測到的吞吐量重新規劃
+
+    docs: [{'path', 'pages', 'layer', 'report'}]；deadline: 截止時間（time.time() 時間戳）
+    """
+
+    def __init__(self, docs, profiles, deadline, engines=ENGINES, slots=None, quality=None,
+                 safety=DEFAULT_SAFETY, clock=time.time):
+        self.docs = docs
+        self.deadline = deadline
+        self.safety = safety
+        self.clock = clock
+        self.slots = dict(DEFAULT_SLOTS, **(slots or {}))
+        self.quality = {e: dict(DEFAULT_QUALITY.get(e, {}), **(quality or {}).get(e, {})) for e in engines}
+        self.profiles = profiles
+        self.engines = [e for e in engines if any((e, layer) in profiles for layer in LAYERS)]
+        self.observed = {}            # (引擎, 層) -> [頁數, 秒]
+        self.planned_rates = {}       # 上次規劃時使用的每頁耗時
+        self.queues = {}              # 引擎 -> [(頁數, 文件序號)]，升序，從尾部取
+        self.assignment = {}          # 文件序號 -> 引擎（尚未開始的文件）
+        self.running = {}             # 文件序號 -> (引擎, 開始時間)
+        self.done = {}                # 文件序號 -> (引擎, 是否成功)
+        self.replans = 0
+        self.feasible = None
+        self._since_plan = 0
+        self._cond = threading.Condition()
+
+    # ----- 剖面 -----
+
+    def rate(self, engine, layer):
+        """每頁耗時：剖面與本次觀測值按頁數加權融合"""
+        profile = self.profiles[(engine, layer)]
+        pages, seconds = self.observed.get((engine, layer), (0, 0.0))
+        return (profile['sec_per_page'] * PRIOR_PAGES + seconds) / (PRIOR_PAGES + pages)
+
+    def value(self, engine, layer):
+        """期望品質：品質分數 × 頁面成功率"""
+        profile = self.profiles[(engine, layer)]
+        return self.quality[engine].get(layer, 0.0) * profile['success_rate']
+
+    def _candidates(self, layer):
+        """按期望品質從高到低（相同時快的優先）排列的可用引擎"""
+        usable = [e for e in self.engines if (e, layer) in self.profiles and self.value(e, layer) > 0]
+        return sorted(usable, key=lambda e: (-self.value(e, layer), self.rate(e, layer) / self.slots[e]))
+
+    # ----- 規劃 -----
+
+    def _lane_time(self, engine, queue_pages_time, now):
+        """引擎完成隊列與在途文件所需的時間（秒，已按並發數攤分）"""
+        inflight = 0.0
+        for i, (running_engine, started) in self.running.items():
+            if running_engine == engine:
+                doc = self.docs[i]
+                inflight += max(0.0, doc['pages'] * self.rate(engine, doc['layer']) - (now - started))
+        return (inflight + queue_pages_time) / self.slots[engine]
+
+    def plan(self):
+        """重新分配所有尚未開始的文件，返回規劃摘要"""
+        with self._cond:
+            summary = self._plan()
+            self._cond.notify_all()
+        return summary
+
+    def _plan(self):
+        now = self.clock()
+        budget = max(0.0, self.deadline - now) * self.safety
+        pending = [i for i in range(len(self.docs)) if i not in self.running and i not in self.done]
+
+        # 1. 全部分配給期望品質最高的引擎
+        buckets = {}                 # (引擎, 層) -> [(頁數, 文件序號)] 升序
+        unassignable = []
+        for i in pending:
+            doc = self.docs[i]
+            candidates = self._candidates(doc['layer'])
+            if not candidates:
+                unassignable.append(i)
+                continue
+            buckets.setdefault((candidates[0], doc['layer']), []).append((doc['pages'], i))
+        for bucket in buckets.values():
+            bucket.sort()
+        work = {e: sum(p * self.rate(e, layer) for (engine, layer), b in buckets.items() if engine == e
+                       for p, _ in b) for e in self.engines}
+        lane = {e: self._lane_time(e, work[e], now) for e in self.engines}
+
+        # 2. 超出期限的引擎把文件降級，直到全部引擎都在期限內或無法再改善
+        while True:
+            overloaded = [e for e in self.engines if lane[e] > budget]
+            if not overloaded:
+                self.feasible = True
+                break
+            source = max(overloaded, key=lambda e: lane[e])
+            move = self._best_move(source, buckets, lane, budget, strict=True) or \
+                self._best_move(source, buckets, lane, budget, strict=False)
+            if move is None:
+                self.feasible = False
+                break
+            layer, target, index = move
+            pages, doc_id = buckets[(source, layer)].pop(index)
+            target_bucket = buckets.setdefault((target, layer), [])
+            target_bucket.insert(bisect_left(target_bucket, (pages, doc_id)), (pages, doc_id))
+            lane[source] -= pages * self.rate(source, layer) / self.slots[source]
+            lane[target] += pages * self.rate(target, layer) / self.slots[target]
+
+        self.queues = {e: [] for e in self.engines}
+        self.assignment = {}
+        for (engine, layer), bucket in buckets.items():
+            self.queues[engine].extend(bucket)
+            for _, i in bucket:
+                self.assignment[i] = engine
+        for queue in self.queues.values():
+            queue.sort()
+        self.planned_rates = {key: self.rate(*key) for key in self.profiles if key[0] in self.engines}
+        self._since_plan = 0
+
+        quality = sum(self.docs[i]['pages'] * self.value(e, self.docs[i]['layer']) for i, e in self.assignment.items())
+        pages = sum(self.docs[i]['pages'] for i in self.assignment)
+        return {
+            'feasible': self.feasible,
+            'budget': budget,
+            'projected_finish': now + max(lane.values(), default=0.0),
+            'lanes': lane,
+            'engines': {e: {'documents': len(q), 'pages': sum(p for p, _ in q)} for e, q in self.queues.items()},
+            'expected_quality': quality / pages if pages else None,
+            'unassignable': [self.docs[i]['path'] for i in unassignable],
+        }
+
+    def _best_move(self, source, buckets, lane, budget, strict):
+        """
+        從 source 移走一份文件的最佳選擇：每省一秒損失期望品質最少的 (層, 目標引擎)，
+        優先選剛好能消除超時的最小文件，否則選目標引擎放得下的最大文件
+
+        strict=False 時（已無法在期限內完成）只要求移動後目標引擎不成為新的最慢引擎。
+        """
+        options = []
+        for layer in LAYERS:
+            bucket = buckets.get((source, layer))
+            if not bucket:
+                continue
+            candidates = self._candidates(layer)
+            if source not in candidates:
+                continue
+            # 只往期望品質更低（或相同但更快）的引擎移，保證規劃會結束
+            for target in candidates[candidates.index(source) + 1:]:
+                loss = self.value(source, layer) - self.value(target, layer)
+                gain = self.rate(source, layer) / self.slots[source]
+                options.append((loss / gain, layer, target))
+        options.sort()
+
+        excess = lane[source] - budget
+        for _, layer, target in options:
+            bucket = buckets[(source, layer)]
+            gain_per_page = self.rate(source, layer) / self.slots[source]
+            cost_per_page = self.rate(target, layer) / self.slots[target]
+            limit = budget if strict else lane[source]
+            room = limit - lane[target]
+            if room <= 0:
+                continue
+            # 目標引擎放得下的最大頁數（非嚴格模式要求移動後嚴格小於原來的最慢時間）
+            max_pages = room / cost_per_page
+            fit = bisect_right(bucket, (max_pages, float('inf'))) - 1
+            if not strict:
+                while fit >= 0 and lane[target] + bucket[fit][0] * cost_per_page >= lane[source]:
+                    fit -= 1
+            if fit < 0:
+                continue
+            needed = bisect_left(bucket, (excess / gain_per_page, -1))
+            return (layer, target, needed if needed <= fit else fit)
+        return None
+
+    # ----- 執行 -----
+
+    def next_for(self, engine):
+        """取出分配給 engine 的下一份文件（大文件優先）；暫時沒有時等待，全部分配完畢時返回 None"""
+        with self._cond:
+            while True:
+                queue = self.queues.get(engine)
+                if queue:
+                    _, i = queue.pop()
+                    del self.assignment[i]
+                    self.running[i] = (engine, self.clock())
+                    return i
+                if not self.assignment:
+                    return None
+                self._cond.wait()
+
+    def observe(self, i, seconds, success):
+        """記錄一份文件的實際耗時；偏離超過閾值時重新規劃，返回新的規劃摘要或 None"""
+        with self._cond:
+            engine, _ = self.running.pop(i)
+            doc = self.docs[i]
+            key = (engine, doc['layer'])
+            pages, total = self.observed.get(key, (0, 0.0))
+            self.observed[key] = (pages + doc['pages'], total + seconds)
+            self.done[i] = (engine, success)
+            self._since_plan += 1
+            summary = None
+            if self.assignment and self._since_plan >= REPLAN_EVERY and self.drift() > DRIFT_THRESHOLD:
+                summary = self._plan()
+                self.replans += 1
+            self._cond.notify_all()
+            return summary
+
+    def drift(self):
+        """目前融合後的每頁耗時與上次規劃所用值的最大相對偏差"""
+        deviations = [abs(self.rate(*key) - rate) / rate for key, rate in self.planned_rates.items() if rate > 0]
+        return max(deviations, default=0.0)
+
+
+# ---------- 語料與執行 ----------
+
+def collect_documents(root, repair_dir=None):
+    """遍歷語料並預檢，返回可規劃的文件列表與被拒絕的文件數"""
+    docs, rejected = [], 0
+    with Manifest() as manifest:
+        for item in manifest.walk(root):
+            report = preflight_pdf(item['path'], repair_dir=repair_dir)
+            if report['ok'] and report['page_count']:
+                docs.append({'path': report['input_path'], 'pages': report['page_count'],
+                             'layer': layer_of(report), 'report': report})
+            else:
+                rejected += 1
+    return docs, rejected
+
+
+def convert(engine, pdf_path):
+    """
+    用各工具的單文件轉換函數處理一份文件（正式運行），輸出到各工具的預設目錄：
+        mineru        mineru/output/<文件名>-<路徑雜湊>/
+        unstructured  unstructured/output/<文件名>-<路徑雜湊>.md 與 elements/ 下的元素存儲
+        olmocr        olmocr/output/workspace/（共用 workspace 的結果分片與 markdown/）
+    """
+    runner = _load_runner(engine)
+    if engine == 'mineru':
+        return runner.convert_pdf(pdf_path)
+    if engine == 'unstructured':
+        return runner.convert_pdf(pdf_path, TOOLS_DIR / 'unstructured' / 'output')
+    return runner.convert_pdf_v046(pdf_path)
+
+
+def execute(planner, index=None, convert_fn=convert):
+    """各引擎按並發數啟動工作線程執行規劃，返回結果列表"""
+    results = []
+    lock = threading.Lock()
+
+    def lane(engine):
+        while True:
+            i = planner.next_for(engine)
+            if i is None:
+                return
+            doc = planner.docs[i]
+            start = time.time()
+            result = {'success': False}
+            try:
+                result = convert_fn(engine, Path(doc['path']))
+                elapsed = time.time() - start
+                result_data = dict(result, file=doc['report']['file'], engine=engine, process_time=elapsed,
+                                   preflight=summarize(doc['report']))
+                if index is not None:
+                    index.record_run(doc['report']['path'], engine, result_data)
+            except Exception as e:
+                elapsed = time.time() - start
+                result = {'success': False, 'error': f"{type(e).__name__}: {e}"}
+                result_data = dict(result, file=doc['report']['file'], engine=engine, process_time=elapsed)
+            finally:
+                # 無論如何都要回報完成，否則其他引擎線程會一直等待這份文件
+                summary = planner.observe(i, time.time() - start, bool(result.get('success')))
+            with lock:
+                results.append(result_data)
+            mark = '✅' if result.get('success') else '❌'
+            print(f"  {mark} [{engine}] {doc['report']['file']}（{doc['pages']} 頁，{elapsed:.1f}秒）")
+            if summary is not None:
+                print(f"  🔄 吞吐量偏離剖面，重新規劃（第 {planner.replans} 次）")
+                print_plan(summary)
+
+    threads = [threading.Thread(target=lane, args=(engine,), name=f"{engine}-{n}", daemon=True)
+               for engine in planner.engines for n in range(planner.slots[engine])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def parse_deadline(text, now=None):
+    """截止時間：+8h / +90m 相對時間、HH:MM（下一個該時刻）或 ISO 日期時間"""
+    now = datetime.fromtimestamp(now or time.time())
+    match = re.fullmatch(r'\+(\d+(?:\.\d+)?)([hm])', text.strip())
+    if match:
+        amount = float(match.group(1))
+        return (now + timedelta(hours=amount) if match.group(2) == 'h' else now + timedelta(minutes=amount)).timestamp()
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', text.strip())
+    if match:
+        target = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        if target <= now:
+            target += timedelta(days=1)
+        return target.timestamp()
+    return datetime.fromisoformat(text.strip()).timestamp()
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%m-%d %H:%M')
+
+
+def print_profiles(planner):
+    print("📈 引擎剖面:")
+    for (engine, layer), profile in sorted(planner.profiles.items()):
+        if engine in planner.engines:
+            print(f"   {engine:<13} {layer:<5} {planner.rate(engine, layer):6.2f}秒/頁  "
+                  f"成功 {profile['success_rate']:.0%}  期望品質 {planner.value(engine, layer):.2f}  "
+                  f"（{profile['source']}，{profile['pages']} 頁）")
+
+
+def print_plan(summary):
+    status = '✅ 可在期限內完成' if summary['feasible'] else '⚠️  無法在期限內完成，已盡量縮短'
+    print(f"   {status}，預計完成 {_format_time(summary['projected_finish'])}")
+    for engine, info in summary['engines'].items():
+        print(f"   - {engine:<13} {info['documents']:>6} 份 {info['pages']:>8} 頁  "
+              f"隊列 {summary['lanes'][engine] / 60:.1f} 分鐘")
+    if summary['expected_quality'] is not None:
+        print(f"   期望品質（按頁加權）: {summary['expected_quality']:.3f}")
+    if summary['unassignable']:
+        print(f"   ❌ {len(summary['unassignable'])} 份文件沒有可用引擎的剖面")
+
+
+def _parse_pairs(values, cast):
+    pairs = {}
+    for value in values or []:
+        name, _, number = value.partition('=')
+        pairs[name] = cast(number)
+    return pairs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="期限驅動的引擎規劃：在截止時間前以最高品質處理完語料")
+    parser.add_argument("mode", choices=("plan", "run"), help="plan 只輸出規劃；run 規劃並執行")
+    parser.add_argument("root", help="語料目錄（遞迴）")
+    parser.add_argument("--deadline", required=True, help="+8h、06:00 或 2026-10-20T06:00")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--slots", nargs="*", metavar="引擎=數量", help="各引擎並發數，例如 unstructured=8")
+    parser.add_argument("--quality", help="品質分數 JSON：{引擎: {'text': 分數, 'scan': 分數}}")
+    parser.add_argument("--estimate", help="common.sampling 輸出的 estimate.json（補充沒有歷史的引擎）")
+    parser.add_argument("--safety", type=float, default=DEFAULT_SAFETY, help="只規劃剩餘時間的這個比例")
+    parser.add_argument("--db", help="結果索引路徑")
+    parser.add_argument("--output", help="把規劃（每份文件的引擎）寫成 JSON")
+    args = parser.parse_args(argv)
+
+    from .result_index import ResultIndex
+
+    quality = None
+    if args.quality:
+        with open(args.quality, 'r', encoding='utf-8') as f:
+            quality = json.load(f)
+
+    with ResultIndex(args.db) as index:
+        sources = [profiles_from_index(index)]
+        if args.estimate:
+            sources.append(profiles_from_estimate(args.estimate))
+        profiles = merge_profiles(*sources)
+        missing = [e for e in args.engines if not any((e, layer) in profiles for layer in LAYERS)]
+        if missing:
+            print(f"⚠️  沒有剖面的引擎不參與規劃: {', '.join(missing)}（先跑一次或用 --estimate 提供抽樣估計）")
+
+        docs, rejected = collect_documents(args.root)
+        if not docs:
+            print("❌ 沒有可規劃的PDF")
+            return 1
+        planner = Planner(docs, profiles, parse_deadline(args.deadline), engines=args.engines,
+                          slots=_parse_pairs(args.slots, int), quality=quality, safety=args.safety)
+        if not planner.engines:
+            print("❌ 沒有任何引擎的剖面")
+            return 1
+
+        print(f"🗓️  {len(docs)} 份文件（{sum(d['pages'] for d in docs)} 頁），預檢拒絕 {rejected} 份，"
+              f"期限 {_format_time(planner.deadline)}")
+        print_profiles(planner)
+        summary = planner.plan()
+        print("📋 規劃:")
+        print_plan(summary)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(dict(summary, assignment={planner.docs[i]['path']: e for i, e in planner.assignment.items()}),
+                          f, ensure_ascii=False, indent=2)
+            print(f"規劃已保存到: {args.output}")
+        if args.mode == 'plan':
+            return 0
+
+        started = time.time()
+        results = execute(planner, index)
+        ok = sum(1 for r in results if r.get('success'))
+        late = time.time() - planner.deadline
+        print(f"\n📊 完成 {ok}/{len(results)} 份，用時 {(time.time() - started) / 60:.1f} 分鐘，"
+              f"重新規劃 {planner.replans} 次，" + (f"超出期限 {late / 60:.1f} 分鐘" if late > 0 else "在期限內完成"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
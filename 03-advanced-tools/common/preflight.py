@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+PDF 預檢：在昂貴的 OCR 之前快速檢查輸入
+讀取頁數、加密狀態、頁面尺寸與文字層，嘗試修復損壞的 xref 表，並拒絕無法處理的文件
+
+依賴 pypdf（unstructured[pdf] 會一併安裝）；未安裝時只做位元組層面的檢查
+"""
+
+import logging
+import time
+from pathlib import Path
+
+from .discovery import output_key
+from .errors import CORRUPT_PDF
+
+# 只讀文件頭尾的位元組數
+HEAD_BYTES = 1024
+TAIL_BYTES = 2048
+# 檢查文字層時最多抽取的頁數
+TEXT_SAMPLE_PAGES = 3
+# 平均每頁少於這麼多字元視為沒有文字層（掃描版）
+MIN_TEXT_CHARS_PER_PAGE = 50
+
+OK = 'ok'
+REPAIRED = 'repaired'
+REJECTED = 'rejected'
+
+
+class _LogCapture(logging.Handler):
+    """收集 pypdf 在非嚴格模式下修復 xref 時發出的警告"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def _byte_checks(pdf_path):
+    """只讀文件頭尾，判斷是否為 PDF、是否截斷"""
+    size = pdf_path.stat().st_size
+    if size == 0:
+        return {'header_ok': False, 'eof_ok': False, 'size': 0}
+    with open(pdf_path, 'rb') as f:
+        head = f.read(HEAD_BYTES)
+        f.seek(max(0, size - TAIL_BYTES))
+        tail = f.read()
+    return {
+        'header_ok': b'%PDF-' in head,
+        'eof_ok': b'%%EOF' in tail,
+        'encrypt_marker': b'/Encrypt' in tail,
+        'size': size,
+    }
+
+
+def _reject(report, reason):
+    report.update({'ok': False, 'status': REJECTED, 'reason': reason, 'error_code': CORRUPT_PDF})
+    return report
+
+
+def preflight_pdf(pdf_path, repair_dir=None):
+    """
+    對單一 PDF 做預檢，返回元數據字典
+
+    status 為 'ok' / 'repaired' / 'rejected'；修復成功時 'input_path' 指向修復後的副本，
+    調用方應以 'input_path' 作為引擎輸入。
+    """
+    pdf_path = Path(pdf_path)
+    start_time = time.time()
+    report = {
+        'file': pdf_path.name,
+        'path': str(pdf_path),
+        'input_path': str(pdf_path),
+        'ok': True,
+        'status': OK,
+        'reason': None,
+        'page_count': None,
+        'encrypted': False,
+        'page_sizes': [],
+        'has_text_layer': None,
+        'text_chars': None,
+    }
+
+    try:
+        checks = _byte_checks(pdf_path)
+    except OSError as e:
+        return _finish(_reject(report, f'無法讀取文件: {e}'), start_time)
+    report['size_mb'] = checks['size'] / (1024 * 1024)
+
+    if not checks['header_ok']:
+        return _finish(_reject(report, '缺少 %PDF- 文件頭，不是 PDF 文件'), start_time)
+
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        # 沒有 pypdf 時只能做位元組檢查
+        report['encrypted'] = checks['encrypt_marker']
+        if not checks['eof_ok']:
+            report['reason'] = '缺少 %%EOF，文件可能被截斷（未安裝 pypdf，無法進一步檢查）'
+        return _finish(report, start_time)
+
+    capture = _LogCapture()
+    pypdf_logger = logging.getLogger('pypdf')
+    pypdf_logger.addHandler(capture)
+    try:
+        reader = PdfReader(str(pdf_path), strict=False)
+
+        if reader.is_encrypted:
+            report['encrypted'] = True
+            # 空密碼可打開的加密文件（僅限制權限）引擎仍能處理
+            try:
+                if not reader.decrypt(''):
+                    return _finish(_reject(report, 'PDF 已加密且需要密碼'), start_time)
+            except Exception as e:
+                return _finish(_reject(report, f'PDF 已加密且無法解密: {e}'), start_time)
+
+        page_count = len(reader.pages)
+        if page_count == 0:
+            return _finish(_reject(report, 'PDF 沒有任何頁面'), start_time)
+        report['page_count'] = page_count
+
+        sizes = set()
+        for page in reader.pages:
+            box = page.mediabox
+            sizes.add((round(float(box.width)), round(float(box.height))))
+        report['page_sizes'] = sorted(sizes)
+
+        sample = min(page_count, TEXT_SAMPLE_PAGES)
+        chars = 0
+        for i in range(sample):
+            try:
+                chars += len((reader.pages[i].extract_text() or '').strip())
+            except Exception:
+                pass
+        report['text_chars'] = chars
+        report['has_text_layer'] = chars >= MIN_TEXT_CHARS_PER_PAGE * sample
+
+        needs_repair = not checks['eof_ok'] or any('xref' in m.lower() for m in capture.messages)
+        if needs_repair:
+            repaired_path = _repair(reader, pdf_path, repair_dir)
+            if repaired_path is None:
+                report['reason'] = 'xref 表損壞，修復失敗，仍嘗試以原文件處理'
+            else:
+                report['status'] = REPAIRED
+                report['input_path'] = str(repaired_path)
+                report['reason'] = '已重建 xref 表' if checks['eof_ok'] else '文件被截斷，已重建可讀部分'
+    except Exception as e:
+        return _finish(_reject(report, f'{type(e).__name__}: {e}'), start_time)
+    finally:
+        pypdf_logger.removeHandler(capture)
+
+    return _finish(report, start_time)
+
+
+def _repair(reader, pdf_path, repair_dir):
+    """把非嚴格模式讀到的頁面重新寫出，得到 xref 表完整的副本"""
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        return None
+
+    repair_dir = Path(repair_dir) if repair_dir else pdf_path.parent / '.repaired'
+    repair_dir.mkdir(parents=True, exist_ok=True)
+    # 以原路徑為鍵：不同子目錄中的同名 PDF 修復後不互相覆蓋
+    repaired_path = repair_dir / f"{output_key(pdf_path)}.pdf"
+    try:
+        writer = PdfWriter()
+        for page in reader.pages:
+            writer.add_page(page)
+        with open(repaired_path, 'wb') as f:
+            writer.write(f)
+    except Exception:
+        return None
+    return repaired_path
+
+
+def _finish(report, start_time):
+    report['preflight_time'] = time.time() - start_time
+    return report
+
+
+def preflight_all(pdf_files, repair_dir=None):
+    """
+    批量預檢，返回 (可處理的報告列表, 被拒絕的報告列表)
+
+    可處理的文件按頁數由少到多排序，讓小文件先完成、盡早暴露問題。
+    """
+    accepted, rejected = [], []
+    for pdf in pdf_files:
+        report = preflight_pdf(pdf, repair_dir=repair_dir)
+        if report['ok']:
+            accepted.append(report)
+        else:
+            rejected.append(report)
+            print(f"  ⛔ 預檢拒絕: {report['file']} - {report['reason']}")
+    accepted.sort(key=lambda r: (r['page_count'] or 0, r.get('size_mb', 0)))
+
+    repaired = sum(1 for r in accepted if r['status'] == REPAIRED)
+    print(f"🩺 預檢完成: {len(accepted)} 個可處理（{repaired} 個已修復），{len(rejected)} 個拒絕")
+    return accepted, rejected
+
+
+def rejected_result(report):
+    """把被拒絕的預檢報告轉成與引擎結果相同格式的記錄"""
+    return {
+        'file': report['file'],
+        'size_mb': report.get('size_mb', 0),
+        'process_time': report.get('preflight_time', 0),
+        'success': False,
+        'output_size': 0,
+        'error': f"預檢拒絕: {report['reason']}",
+        'error_code': report.get('error_code', CORRUPT_PDF),
+        'preflight': summarize(report),
+    }
+
+
+def summarize(report):
+    """結果 JSON 中保存的精簡預檢信息"""
+    return {
+        'status': report['status'],
+        'page_count': report['page_count'],
+        'encrypted': report['encrypted'],
+        'has_text_layer': report['has_text_layer'],
+        'page_sizes': report['page_sizes'][:5],
+        'reason': report['reason'],
+    }
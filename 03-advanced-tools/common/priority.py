@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+優先級：interactive（使用者上傳、急件）與 bulk（批量回填）兩個等級
+
+- ClassQueue：流水線各階段的輸入隊列，總是先取 interactive；兩類各自有容量，bulk 塞滿不會擋住 interactive
+- 搶佔：引擎子進程經 run_command 啟動時可被取消，interactive 文件沒有空閒工作線程可用時，
+  流水線取消剛開始不久的 bulk 文件（損失的工作少），把它放回 bulk 隊列最前面稍後重跑；
+  已運行較久的 bulk 文件不搶佔，interactive 文件排在隊首等下一個空位（延後而不是丟棄工作）
+- Inbox：批量運行期間放進收件目錄的 PDF 以 interactive 優先級插隊
+
+環境變量：
+    OCR_INBOX_DIR           interactive 收件目錄（未設定時不監看）
+    OCR_RESERVED_WORKERS    引擎階段保留給 interactive 的工作線程數（預設 0）
+"""
+
+import math
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+CLASSES = (INTERACTIVE, BULK)
+
+# 同一份 bulk 文件最多被搶佔的次數，避免在持續的 interactive 流量下永遠做不完
+MAX_PREEMPTIONS = 2
+# 收件目錄中的文件修改後至少靜置這麼久才收取（避免讀到寫了一半的上傳）
+INBOX_SETTLE = 1.0
+
+_local = threading.local()
+
+
+class Preempted(Exception):
+    """bulk 工作被搶佔（引擎子進程已終止），應重新排隊"""
+
+
+class CancelToken:
+    """一個正在運行的工作的取消標記"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason=None):
+        self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+@contextmanager
+def cancellable(token):
+    """在當前線程中設定取消標記，期間經 run_command 啟動的子進程可被取消"""
+    previous = getattr(_local, 'token', None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current_token():
+    return getattr(_local, 'token', None)
+
+
+def run_command(cmd, timeout=None, env=None, poll_interval=0.5):
+    """
+    等同 subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)，
+    當前線程的取消標記被觸發時終止子進程並拋出 Preempted
+    """
+    token = current_token()
+    if token is None:
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env) as proc:
+        while True:
+            wait = poll_interval if deadline is None else max(0.0, min(poll_interval, deadline - time.monotonic()))
+            try:
+                stdout, stderr = proc.communicate(timeout=wait)
+                return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+            except subprocess.TimeoutExpired:
+                # communicate 超時後再次調用不會丟失輸出
+                if token.cancelled:
+                    proc.kill()
+                    proc.communicate()
+                    raise Preempted(token.reason or 'preempted')
+                if deadline is not None and time.monotonic() >= deadline:
+                    proc.kill()
+                    stdout, stderr = proc.communicate()
+                    raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+
+
+class ClassQueue:
+    """
+    按優先級取出的有界隊列
+
+    put 在該等級已滿時阻塞（背壓），front=True（被搶佔的工作放回）不受容量限制；
+    close 之後，get 在所請求的等級都取空時返回 closed_marker。
+    """
+
+    def __init__(self, maxsize, closed_marker=None):
+        self.maxsize = maxsize
+        self.closed_marker = closed_marker
+        self._queues = {cls: deque() for cls in CLASSES}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item, priority=BULK, front=False):
+        with self._cond:
+            q = self._queues[priority]
+            if front:
+                q.appendleft(item)
+            else:
+                while len(q) >= self.maxsize:
+                    self._cond.wait()
+                q.append(item)
+            self._cond.notify_all()
+
+    def get(self, classes=CLASSES):
+        with self._cond:
+            while True:
+                for cls in classes:
+                    if self._queues[cls]:
+                        item = self._queues[cls].popleft()
+                        self._cond.notify_all()
+                        return item
+                if self._closed:
+                    return self.closed_marker
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def count(self, priority):
+        with self._cond:
+            return len(self._queues[priority])
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+
+class Inbox:
+    """
+    收件目錄：每次 poll 返回新出現且已靜置的 PDF
+
+    工作項格式與 discovery 的 manifest.walk 相同，to_context 把它轉成流水線上下文（預設原樣返回）。
+    """
+
+    def __init__(self, path, to_context=None, suffix='.pdf'):
+        self.path = Path(path)
+        self.to_context = to_context or (lambda item: item)
+        self.suffix = suffix
+        self._seen = set()
+
+    def poll(self):
+        items = []
+        if not self.path.is_dir():
+            return items
+        now = time.time()
+        for entry in sorted(os.scandir(self.path), key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.lower().endswith(self.suffix) or entry.path in self._seen:
+                continue
+            st = entry.stat()
+            if now - st.st_mtime < INBOX_SETTLE:
+                continue
+            self._seen.add(entry.path)
+            print(f"  📥 interactive: {entry.name}")
+            items.append(self.to_context({'path': Path(entry.path), 'size': st.st_size,
+                                          'mtime_ns': st.st_mtime_ns, 'sha256': None, 'changed': True}))
+        return items
+
+
+def from_env():
+    """讀取 OCR_INBOX_DIR 與 OCR_RESERVED_WORKERS，返回 (收件目錄或 None, 保留工作線程數)"""
+    return os.environ.get('OCR_INBOX_DIR') or None, int(os.environ.get('OCR_RESERVED_WORKERS') or 0)
+
+
+def percentile(values, q):
+    """最近秩百分位數（values 需已排序）"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
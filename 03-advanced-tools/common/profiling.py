@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+進程內轉換路徑的剖析（預設關閉）
+設定 OCR_PROFILE_DIR 後，每份文件的每個階段都會輸出：
+    <文件名>-<路徑雜湊>.<階段>.prof        cProfile 原始數據（可用 snakeviz / pstats 查看）
+    <文件名>-<路徑雜湊>.<階段>.collapsed   取樣線程收集的摺疊堆疊（flamegraph.pl、speedscope 可直接讀取）
+    <文件名>-<路徑雜湊>.<階段>.json        文件名、路徑、耗時、最耗時函數與 top-N 記憶體分配位置
+（按 PDF 完整路徑命名，不同目錄中的同名 PDF 不互相覆蓋）
+
+剖析是診斷用途：cProfile 與 tracemalloc 都是進程級資源，開啟後各文件的剖析階段依次執行
+（多個 engine / postprocess 線程時會排隊，吞吐量下降，但每份文件的每個階段都有輸出）。
+tracemalloc 無法區分線程，剖析期間其他線程在非剖析代碼中（讀文件、寫輸出）的分配也會計入，
+記憶體數字應視為上限；需要精確歸屬時以單線程（workers 全為 1）重跑該文件。
+
+環境變量：
+    OCR_PROFILE_DIR       輸出目錄，未設定時 profile_document 直接返回空的上下文管理器，無額外開銷
+    OCR_PROFILE_INTERVAL  堆疊取樣間隔（秒，預設 0.005）
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+from .discovery import output_key
+
+TOP_N = 25
+TRACE_FRAMES = 10
+DEFAULT_INTERVAL = 0.005
+
+_output_dir = Path(os.environ['OCR_PROFILE_DIR']) if os.environ.get('OCR_PROFILE_DIR') else None
+_interval = float(os.environ.get('OCR_PROFILE_INTERVAL') or DEFAULT_INTERVAL)
+# cProfile 與 tracemalloc 都是進程級資源，同一時間只剖析一個階段（其他線程排隊等候，不可嵌套）
+_active = threading.Lock()
+_NULL = contextlib.nullcontext()
+
+
+def configure(output_dir, interval=None):
+    """以程式方式開啟（output_dir 為 None 時關閉）剖析"""
+    global _output_dir, _interval
+    _output_dir = Path(output_dir) if output_dir else None
+    if interval:
+        _interval = interval
+
+
+def enabled():
+    return _output_dir is not None
+
+
+def profile_document(label, phase='convert'):
+    """
+    剖析一份文件的某個階段，label 為 PDF 路徑（輸出按完整路徑命名），用法：
+
+        with profiling.profile_document(pdf_path, 'partition'):
+            elements = partition(...)
+
+    未開啟時返回共用的 nullcontext，只多一次屬性判斷。
+    """
+    if _output_dir is None:
+        return _NULL
+    return _profile(label, phase, _output_dir)
+
+
+class _StackSampler(threading.Thread):
+    """定期取樣目標線程的 Python 堆疊，累計摺疊堆疊次數"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _top_functions(profiler):
+    """按累計時間排序的最耗時函數"""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:TOP_N]
+    return [{
+        'function': f"{func} ({Path(filename).name}:{line})",
+        'calls': nc,
+        'self_time': tt,
+        'cumulative_time': ct,
+    } for (filename, line, func), (cc, nc, tt, ct, callers) in rows]
+
+
+def _top_allocations(before, after):
+    """兩次快照之間新增記憶體最多的分配位置"""
+    diffs = after.compare_to(before, 'traceback')
+    diffs = [d for d in diffs if d.size_diff > 0][:TOP_N]
+    return [{
+        'size_kb': d.size_diff / 1024,
+        'count': d.count_diff,
+        'traceback': [f"{Path(frame.filename).name}:{frame.lineno}" for frame in d.traceback],
+    } for d in diffs]
+
+
+@contextlib.contextmanager
+def _profile(label, phase, output_dir):
+    # 等候而不是跳過，否則流水線中與 partition 重疊的 render 階段幾乎從不被剖析
+    _active.acquire()
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start(TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler = _StackSampler(threading.get_ident(), _interval)
+        profiler = cProfile.Profile()
+
+        sampler.start()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.thread_time() - cpu_start
+            sampler.stop()
+            peak = tracemalloc.get_traced_memory()[1]
+            after = tracemalloc.take_snapshot()
+            _write_profile(output_dir, label, phase, profiler, sampler, before, after,
+                           wall_time, cpu_time, peak)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _active.release()
+
+
+def _write_profile(output_dir, label, phase, profiler, sampler, before, after, wall_time, cpu_time, peak):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    base = output_dir / f"{output_key(label)}.{phase}"
+
+    profiler.dump_stats(f"{base}.prof")
+    with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+        for stack, count in sampler.counts.most_common():
+            f.write(f"{stack} {count}\n")
+
+    summary = {
+        'file': Path(label).name,
+        'path': str(label),
+        'phase': phase,
+        'started_at': time.time() - wall_time,
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'samples': sum(sampler.counts.values()),
+        'sample_interval': sampler.interval,
+        'peak_traced_mb': peak / (1024 * 1024),
+        # 剖析期間存活的其他線程數（不含取樣線程）；大於 0 時記憶體數字可能含其他線程的分配
+        'other_threads': max(0, threading.active_count() - 1),
+        'top_functions': _top_functions(profiler),
+        'top_allocations': _top_allocations(before, after),
+    }
+    with open(f"{base}.json", 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"  🔬 剖析 {Path(label).name} [{phase}]: {wall_time:.2f}秒（CPU {cpu_time:.2f}秒），"
+          f"峰值 {summary['peak_traced_mb']:.1f}MB → {base}.*")
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+SQLite 結果索引（WAL 模式 + FTS5 全文檢索）
+各工具每處理完一份文件就寫入一筆記錄，取代分散的 *_results.json 與輸出目錄掃描
+
+用法：
+    python -m common.result_index file 2015_ResNet.pdf     # 查看某文件在各引擎的結果
+    python -m common.result_index search "residual learning"
+    python -m common.result_index stats
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_DB = Path(__file__).resolve().parent.parent / "results.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    file TEXT NOT NULL,
+    size_bytes INTEGER,
+    page_count INTEGER,
+    has_text_layer INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_file ON documents(file);
+
+CREATE TABLE IF NOT EXISTS engine_runs (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    engine TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    process_time REAL,
+    success INTEGER NOT NULL,
+    error_code TEXT,
+    error TEXT,
+    output_path TEXT,
+    output_size INTEGER,
+    attempts INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_document ON engine_runs(document_id, engine, finished_at);
+CREATE INDEX IF NOT EXISTS idx_runs_engine ON engine_runs(engine, success);
+
+CREATE TABLE IF NOT EXISTS pages (
+    run_id INTEGER NOT NULL REFERENCES engine_runs(id),
+    page_number INTEGER NOT NULL,
+    text TEXT,
+    PRIMARY KEY (run_id, page_number)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS markdown_fts USING fts5(markdown, tokenize='unicode61');
+"""
+
+# 結果字典中已有專門欄位的鍵，其餘鍵放入 extra
+_RUN_FIELDS = {'file', 'success', 'process_time', 'error', 'error_code', 'output_size', 'attempts'}
+
+
+class ResultIndex:
+    """結果索引：documents / engine_runs / pages 三張表 + markdown 全文索引"""
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path or os.environ.get('OCR_RESULT_DB') or DEFAULT_DB)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 寫入 ----------
+
+    def upsert_document(self, path, size_bytes=None, page_count=None, has_text_layer=None):
+        """新增或更新文件記錄，返回 document_id（未提供的欄位保留舊值）"""
+        path = str(Path(path).resolve())
+        with self._lock:
+            return self._upsert_document(path, size_bytes, page_count, has_text_layer)
+
+    def _upsert_document(self, path, size_bytes, page_count, has_text_layer):
+        if has_text_layer is not None:
+            has_text_layer = int(bool(has_text_layer))
+        row = self._conn.execute(
+            """INSERT INTO documents (path, file, size_bytes, page_count, has_text_layer, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   size_bytes = COALESCE(excluded.size_bytes, size_bytes),
+                   page_count = COALESCE(excluded.page_count, page_count),
+                   has_text_layer = COALESCE(excluded.has_text_layer, has_text_layer),
+                   updated_at = excluded.updated_at
+               RETURNING id""",
+            (path, Path(path).name, size_bytes, page_count, has_text_layer, time.time()),
+        ).fetchone()
+        return row[0]
+
+    def record_run(self, pdf_path, engine, result, markdown=None, pages=None, output_path=None, preflight=None):
+        """
+        記錄一次引擎運行，單一事務內寫入文件、運行、頁面與全文索引
+
+        result 為各工具的結果字典；pages 為 {頁碼: 文字} 或 [(頁碼, 文字)]
+        """
+        pdf_path = Path(pdf_path)
+        preflight = preflight or result.get('preflight') or {}
+        try:
+            size_bytes = pdf_path.stat().st_size
+        except OSError:
+            size_bytes = None
+        extra = {k: v for k, v in result.items() if k not in _RUN_FIELDS and k != 'preflight'}
+        if isinstance(pages, dict):
+            pages = pages.items()
+
+        with self._lock:
+            try:
+                document_id = self._upsert_document(
+                    str(pdf_path.resolve()), size_bytes,
+                    preflight.get('page_count'), preflight.get('has_text_layer'))
+                cursor = self._conn.execute(
+                    """INSERT INTO engine_runs (document_id, engine, finished_at, process_time, success,
+                           error_code, error, output_path, output_size, attempts, extra)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (document_id, engine, time.time(), result.get('process_time'),
+                     int(bool(result.get('success'))), result.get('error_code'), result.get('error'),
+                     str(output_path) if output_path else None, result.get('output_size'),
+                     result.get('attempts', 1), json.dumps(extra, ensure_ascii=False, default=str)),
+                )
+                run_id = cursor.lastrowid
+                if pages:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO pages (run_id, page_number, text) VALUES (?, ?, ?)",
+                        ((run_id, int(n), text) for n, text in pages),
+                    )
+                if markdown:
+                    # 全文索引只保留每個 (文件, 引擎) 最新一次的 markdown，重跑後 search 不會返回重複的舊文字
+                    self._conn.execute(
+                        """DELETE FROM markdown_fts WHERE rowid IN (
+                               SELECT id FROM engine_runs WHERE document_id = ? AND engine = ? AND id != ?)""",
+                        (document_id, engine, run_id))
+                    self._conn.execute("INSERT INTO markdown_fts (rowid, markdown) VALUES (?, ?)", (run_id, markdown))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return run_id
+
+    # ---------- 查詢 ----------
+
+    def runs_for_file(self, file, engine=None, latest_only=True):
+        """查詢某文件（文件名或路徑）在各引擎的運行記錄"""
+        column = 'd.path' if os.sep in str(file) else 'd.file'
+        if column == 'd.path':
+            file = str(Path(file).resolve())
+        sql = f"""SELECT d.file, d.path, d.page_count, r.* FROM engine_runs r
+                  JOIN documents d ON d.id = r.document_id
+                  WHERE {column} = ?"""
+        params = [file]
+        if engine:
+            sql += " AND r.engine = ?"
+            params.append(engine)
+        sql += " ORDER BY r.engine, r.finished_at DESC"
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(sql, params)]
+        if latest_only:
+            seen, latest = set(), []
+            for row in rows:
+                key = (row['path'], row['engine'])
+                if key not in seen:
+                    seen.add(key)
+                    latest.append(row)
+            rows = latest
+        return rows
+
+    def latest_outputs(self, engine=None):
+        """
+        逐個產出各文件在各引擎最新一次成功運行的輸出：
+        {'file', 'path', 'engine', 'run_id', 'markdown', 'pages'}
+
+        先取得運行 id 列表，再逐筆讀取 markdown 與頁面，不會一次載入所有文字。
+        """
+        sql = """SELECT d.file, d.path, r.engine, MAX(r.id) AS run_id FROM engine_runs r
+                 JOIN documents d ON d.id = r.document_id
+                 WHERE r.success = 1"""
+        params = []
+        if engine:
+            sql += " AND r.engine = ?"
+            params.append(engine)
+        sql += " GROUP BY r.document_id, r.engine ORDER BY d.file, r.engine"
+        with self._lock:
+            runs = [dict(row) for row in self._conn.execute(sql, params)]
+        for run in runs:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT markdown FROM markdown_fts WHERE rowid = ?", (run['run_id'],)).fetchone()
+                pages = {n: text for n, text in self._conn.execute(
+                    "SELECT page_number, text FROM pages WHERE run_id = ?", (run['run_id'],))}
+            if row is None or not row[0]:
+                continue
+            yield dict(run, markdown=row[0], pages=pages)
+
+    def page_text(self, run_id, page_number):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE run_id = ? AND page_number = ?", (run_id, page_number)).fetchone()
+        return row[0] if row else None
+
+    def search(self, query, engine=None, limit=20):
+        """
+        全文檢索 markdown，返回命中的文件、引擎與摘要片段
+
+        query 按空白拆成詞，各詞加引號後以 AND 組合，"residual-learning"、"C++" 等
+        含 FTS5 運算符的文字按字面匹配，不會被解析為查詢語法。
+        """
+        query = fts_query(query)
+        if not query:
+            return []
+        sql = """SELECT d.file, r.engine, r.id AS run_id,
+                        snippet(markdown_fts, 0, '[', ']', '…', 12) AS snippet
+                 FROM markdown_fts
+                 JOIN engine_runs r ON r.id = markdown_fts.rowid
+                 JOIN documents d ON d.id = r.document_id
+                 WHERE markdown_fts MATCH ?"""
+        params = [query]
+        if engine:
+            sql += " AND r.engine = ?"
+            params.append(engine)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def throughput(self, engine=None):
+        """
+        各引擎按文字層（1 文字版 / 0 掃描版 / None 未知）分組的歷史耗時、頁數與頁面成功率，
+        失敗的運行同樣佔用時間，一併計入
+        """
+        sql = """SELECT r.engine, d.has_text_layer, COUNT(*) AS runs,
+                        SUM(r.process_time) AS seconds, SUM(d.page_count) AS pages,
+                        SUM(CASE WHEN r.success = 1 THEN d.page_count ELSE 0 END) AS success_pages
+                 FROM engine_runs r JOIN documents d ON d.id = r.document_id
+                 WHERE r.process_time > 0 AND d.page_count > 0"""
+        params = []
+        if engine:
+            sql += " AND r.engine = ?"
+            params.append(engine)
+        sql += " GROUP BY r.engine, d.has_text_layer ORDER BY r.engine"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def stats(self):
+        """各引擎的運行次數、成功率與平均耗時"""
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            engines = [dict(row) for row in self._conn.execute(
+                """SELECT engine, COUNT(*) AS runs, SUM(success) AS success,
+                          AVG(process_time) AS avg_time, SUM(output_size) AS output_bytes
+                   FROM engine_runs GROUP BY engine ORDER BY engine""")]
+        return {'documents': documents, 'engines': engines}
+
+
+def read_markdown(paths):
+    """讀取並合併多個 markdown 文件（用於 mineru / olmOCR 的輸出目錄）"""
+    parts = []
+    for path in paths:
+        try:
+            parts.append(Path(path).read_text(encoding='utf-8'))
+        except (OSError, UnicodeDecodeError):
+            continue
+    return "\n\n".join(parts)
+
+
+def fts_query(text):
+    """把使用者輸入轉成 FTS5 查詢：每個詞用雙引號包起來（內部的雙引號加倍）"""
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in (text or '').split())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢 OCR 結果索引")
+    parser.add_argument("--db", help=f"資料庫路徑（預設 {DEFAULT_DB}）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_file = sub.add_parser("file", help="查看某文件在各引擎的結果")
+    p_file.add_argument("file")
+    p_file.add_argument("--engine")
+    p_file.add_argument("--all", action="store_true", help="顯示歷次運行而非僅最新一次")
+    p_search = sub.add_parser("search", help="全文檢索 markdown 輸出")
+    p_search.add_argument("query")
+    p_search.add_argument("--engine")
+    p_search.add_argument("--limit", type=int, default=20)
+    sub.add_parser("stats", help="各引擎統計")
+    args = parser.parse_args(argv)
+
+    with ResultIndex(args.db) as index:
+        if args.command == "file":
+            rows = index.runs_for_file(args.file, engine=args.engine, latest_only=not args.all)
+            if not rows:
+                print(f"❌ 索引中沒有 {args.file}")
+                return 1
+            for r in rows:
+                status = "✅" if r['success'] else f"❌ {r['error_code'] or ''} {r['error'] or ''}"
+                when = time.strftime('%Y-%m-%d %H:%M', time.localtime(r['finished_at']))
+                print(f"{r['engine']:<14} {when}  {r['process_time'] or 0:8.2f}s  {r['output_size'] or 0:>10} B  {status}")
+                if r['output_path']:
+                    print(f"{'':<14} → {r['output_path']}")
+        elif args.command == "search":
+            try:
+                rows = index.search(args.query, engine=args.engine, limit=args.limit)
+            except sqlite3.OperationalError as e:
+                print(f"❌ 無法檢索 {args.query!r}: {e}")
+                return 1
+            for r in rows:
+                print(f"{r['file']} [{r['engine']}]: {r['snippet']}")
+        else:
+            stats = index.stats()
+            print(f"📚 文件數: {stats['documents']}")
+            for e in stats['engines']:
+                print(f"   {e['engine']:<14} 運行 {e['runs']} 次，成功 {e['success']}，平均 {e['avg_time'] or 0:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+分層頁面抽樣：在新語料上快速估算各引擎的處理時間、成本與成功率
+
+按 文件長度 × 文字層有無 × 版面密度 分層，按各層總頁數比例分配樣本頁，
+把每份文件被抽中的頁面抽成一個小 PDF 交給各引擎處理，
+再以比率估計量外推整個語料的總時間、成本與頁面成功率，並給出置信區間。
+
+用法：
+    python -m common.sampling                          # 預設 test_pdfs/，抽 30 頁，跑 mineru
+    python -m common.sampling /data/papers --pages 60 --engines mineru unstructured olmocr
+    python -m common.sampling /data/papers --cost-per-hour 1.2 --seed 7
+
+注意：抽出的小 PDF 每份都要重新啟動引擎（載入模型），單頁時間偏高，估計值偏保守。
+"""
+
+import argparse
+import importlib.util
+import json
+import math
+import random
+import sys
+import time
+from bisect import bisect_right
+from itertools import accumulate
+from pathlib import Path
+
+from .discovery import Manifest, output_key
+from .preflight import TEXT_SAMPLE_PAGES, preflight_pdf
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_OUTPUT = TOOLS_DIR / "sample_runs"
+ENGINES = ('mineru', 'unstructured', 'olmocr')
+
+# 文件長度分層（頁數上限）
+SIZE_CLASSES = ((10, 'short'), (50, 'medium'), (float('inf'), 'long'))
+# 平均每頁字元數達到此值視為密集版面（雙欄論文約 3000～4000 字元/頁）
+DENSE_CHARS_PER_PAGE = 2500
+# 95% 置信區間
+Z_95 = 1.96
+
+
+def stratum_of(report):
+    """根據預檢報告決定文件所屬的層：(長度, 文字層, 密度)"""
+    pages = report['page_count'] or 0
+    size = next(name for limit, name in SIZE_CLASSES if pages <= limit)
+    if not report['has_text_layer']:
+        # 掃描版沒有文字層，無法從文字量判斷密度
+        return (size, 'scan', 'unknown')
+    chars_per_page = (report['text_chars'] or 0) / max(1, min(pages, TEXT_SAMPLE_PAGES))
+    return (size, 'text', 'dense' if chars_per_page >= DENSE_CHARS_PER_PAGE else 'sparse')
+
+
+def build_strata(reports):
+    """把預檢通過的文件分層，返回 {層: [報告, ...]}"""
+    strata = {}
+    for report in reports:
+        strata.setdefault(stratum_of(report), []).append(report)
+    return strata
+
+
+def allocate(strata, sample_pages, min_per_stratum=2):
+    """
+    按各層總頁數比例分配樣本頁數（最大餘數法）
+
+    每層至少分配 min_per_stratum 頁（不超過該層頁數），否則無法估計層內變異。
+    """
+    totals = {key: sum(r['page_count'] for r in reports) for key, reports in strata.items()}
+    population = sum(totals.values())
+    if population == 0:
+        return {}
+    sample_pages = min(sample_pages, population)
+
+    quotas = {key: sample_pages * total / population for key, total in totals.items()}
+    allocation = {key: int(q) for key, q in quotas.items()}
+    remaining = sample_pages - sum(allocation.values())
+    for key in sorted(quotas, key=lambda k: quotas[k] - allocation[k], reverse=True)[:remaining]:
+        allocation[key] += 1
+    for key, total in totals.items():
+        allocation[key] = min(total, max(allocation[key], min_per_stratum))
+    return allocation
+
+
+def draw_sample(strata, allocation, rng):
+    """
+    在每層內從所有頁面中等概率無放回抽樣，並按文件分組
+
+    返回抽樣單元列表，每個單元是同一文件被抽中的頁面：
+    {'stratum', 'report', 'pages': [0 起算頁碼, ...]}
+    """
+    units = []
+    for key, reports in strata.items():
+        n = allocation.get(key, 0)
+        if n <= 0:
+            continue
+        offsets = list(accumulate(r['page_count'] for r in reports))
+        by_doc = {}
+        # range 上的 sample 不會展開整層的頁面列表
+        for flat in rng.sample(range(offsets[-1]), n):
+            doc = bisect_right(offsets, flat)
+            start = offsets[doc - 1] if doc else 0
+            by_doc.setdefault(doc, []).append(flat - start)
+        for doc, pages in sorted(by_doc.items()):
+            units.append({'stratum': key, 'report': reports[doc], 'pages': sorted(pages)})
+    return units
+
+
+def extract_pages(unit, output_dir):
+    """把抽中的頁面寫成一個小 PDF，返回路徑"""
+    from pypdf import PdfReader, PdfWriter
+
+    report = unit['report']
+    source = Path(report['input_path'])
+    reader = PdfReader(str(source), strict=False)
+    if reader.is_encrypted:
+        reader.decrypt('')
+    writer = PdfWriter()
+    for page in unit['pages']:
+        writer.add_page(reader.pages[page])
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pages_tag = '-'.join(str(p + 1) for p in unit['pages'][:5])
+    sample_path = output_dir / f"{output_key(source)}__p{pages_tag}.pdf"
+    with open(sample_path, 'wb') as f:
+        writer.write(f)
+    return sample_path
+
+
+# ---------- 引擎調用 ----------
+
+_runners = {}
+
+
+def _load_runner(engine):
+    """按路徑載入各工具目錄下的 demo.py（三個工具的模組都叫 demo，不能直接 import）"""
+    if engine not in _runners:
+        # 與直接執行腳本時一樣，讓 demo.py 能導入同目錄的輔助模組
+        tool_dir = str(TOOLS_DIR / engine)
+        if tool_dir not in sys.path:
+            sys.path.insert(0, tool_dir)
+        spec = importlib.util.spec_from_file_location(f"{engine}_demo", TOOLS_DIR / engine / "demo.py")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _runners[engine] = module
+    return _runners[engine]
+
+
+def run_engine(engine, pdf_path, work_dir):
+    """用各工具的單文件轉換函數處理一個抽樣 PDF，返回結果字典（輸出全部寫到 work_dir，不進入各工具的正式輸出目錄）"""
+    runner = _load_runner(engine)
+    if engine == 'mineru':
+        return runner.convert_pdf(pdf_path, output_dir=work_dir / 'mineru')
+    if engine == 'unstructured':
+        return runner.convert_pdf(pdf_path, work_dir / 'unstructured')
+    if engine == 'olmocr':
+        return runner.convert_pdf_v046(pdf_path, workspace_dir=work_dir / 'olmocr' / pdf_path.stem)
+    raise ValueError(f"未知引擎: {engine}")
+
+
+# ---------- 估計 ----------
+
+def _ratio_estimate(ys, xs, population, fallback_cv2=None):
+    """
+    比率估計量 R = Σy / Σx 及其方差（含有限總體校正）
+
+    樣本單元少於 2 個時無法估計層內方差，改用 fallback_cv2（全體樣本的相對方差）。
+    """
+    n = len(xs)
+    sum_x = sum(xs)
+    ratio = sum(ys) / sum_x if sum_x else 0.0
+    if n >= 2:
+        mean_x = sum_x / n
+        residual = sum((y - ratio * x) ** 2 for y, x in zip(ys, xs)) / (n - 1)
+        variance = residual / (n * mean_x ** 2)
+    elif fallback_cv2 is not None:
+        variance = fallback_cv2 * ratio ** 2
+    else:
+        variance = float('nan')
+    fpc = max(0.0, 1 - sum_x / population) if population else 1.0
+    return ratio, variance * fpc
+
+
+def _relative_variance(ys, xs):
+    """全體樣本的單頁比率相對方差，用於樣本不足的層"""
+    rates = [y / x for y, x in zip(ys, xs) if x]
+    if len(rates) < 2:
+        return None
+    mean = sum(rates) / len(rates)
+    if mean == 0:
+        return 0.0
+    var = sum((r - mean) ** 2 for r in rates) / (len(rates) - 1)
+    return var / mean ** 2 / len(rates)
+
+
+def _interval(value, variance, low=0.0, high=float('inf')):
+    if math.isnan(variance):
+        return [None, None]
+    half = Z_95 * math.sqrt(max(variance, 0.0))
+    return [max(low, value - half), min(high, value + half)]
+
+
+def estimate(measurements, population_pages, cost_per_hour=None):
+    """
+    從抽樣單元的測量值外推整個語料
+
+    measurements: [{'stratum', 'pages', 'time', 'success'}]
+    population_pages: {層: 總頁數}
+    """
+    all_times = [m['time'] for m in measurements]
+    all_pages = [m['pages'] for m in measurements]
+    all_ok = [m['pages'] if m['success'] else 0 for m in measurements]
+    time_cv2 = _relative_variance(all_times, all_pages)
+    ok_cv2 = _relative_variance(all_ok, all_pages)
+
+    total_pages = sum(population_pages.values())
+    total_time = total_time_var = 0.0
+    success_pages = success_var = 0.0
+    strata = []
+    for key, population in population_pages.items():
+        units = [m for m in measurements if m['stratum'] == key]
+        if not units:
+            continue
+        xs = [m['pages'] for m in units]
+        rate, rate_var = _ratio_estimate([m['time'] for m in units], xs, population, time_cv2)
+        ok_rate, ok_var = _ratio_estimate([m['pages'] if m['success'] else 0 for m in units], xs, population, ok_cv2)
+        total_time += population * rate
+        total_time_var += population ** 2 * rate_var
+        success_pages += population * ok_rate
+        success_var += population ** 2 * ok_var
+        strata.append({
+            'stratum': '/'.join(key),
+            'population_pages': population,
+            'sample_pages': sum(xs),
+            'sec_per_page': rate,
+            'success_rate': ok_rate,
+        })
+
+    covered = sum(s['population_pages'] for s in strata)
+    success_rate = success_pages / covered if covered else 0.0
+    result = {
+        'population_pages': total_pages,
+        'covered_pages': covered,
+        'sample_pages': sum(all_pages),
+        'total_time': total_time,
+        'total_time_ci': _interval(total_time, total_time_var),
+        'pages_per_sec': covered / total_time if total_time else None,
+        'success_rate': success_rate,
+        'success_rate_ci': _interval(success_rate, success_var / covered ** 2 if covered else float('nan'), high=1.0),
+        'strata': strata,
+    }
+    if cost_per_hour is not None:
+        result['cost'] = total_time / 3600 * cost_per_hour
+        result['cost_ci'] = [None if t is None else t / 3600 * cost_per_hour for t in result['total_time_ci']]
+    return result
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return '?'
+    if seconds >= 3600:
+        return f"{seconds / 3600:.2f}h"
+    return f"{seconds / 60:.1f}min" if seconds >= 60 else f"{seconds:.1f}s"
+
+
+def print_estimate(engine, est):
+    low, high = est['total_time_ci']
+    print(f"\n📐 {engine}: 抽樣 {est['sample_pages']} / {est['population_pages']} 頁")
+    print(f"   預估總時間: {_format_duration(est['total_time'])}（95% CI {_format_duration(low)} ~ {_format_duration(high)}）")
+    if est['pages_per_sec']:
+        print(f"   預估吞吐量: {est['pages_per_sec']:.2f} 頁/秒")
+    s_low, s_high = est['success_rate_ci']
+    ci = f"{s_low:.1%} ~ {s_high:.1%}" if s_low is not None else "樣本不足"
+    print(f"   預估頁面成功率: {est['success_rate']:.1%}（95% CI {ci}）")
+    if 'cost' in est:
+        c_low, c_high = est['cost_ci']
+        ci = f"{c_low:.2f} ~ {c_high:.2f}" if c_low is not None else "樣本不足"
+        print(f"   預估成本: {est['cost']:.2f}（95% CI {ci}）")
+    for s in est['strata']:
+        print(f"   - {s['stratum']:<22} {s['sample_pages']:>4}/{s['population_pages']:<7} "
+              f"{s['sec_per_page']:.2f}s/頁  成功 {s['success_rate']:.0%}")
+
+
+def run_sample(root, engines, sample_pages=30, seed=None, cost_per_hour=None, output_dir=None):
+    """抽樣並讓每個引擎處理樣本，返回 {引擎: 估計結果}"""
+    rng = random.Random(seed)
+    run_dir = Path(output_dir or DEFAULT_OUTPUT) / time.strftime('%Y%m%d-%H%M%S')
+
+    reports, rejected = [], 0
+    with Manifest() as manifest:
+        for item in manifest.walk(root):
+            report = preflight_pdf(item['path'], repair_dir=run_dir / '_repaired')
+            if report['ok'] and report['page_count']:
+                reports.append(report)
+            else:
+                rejected += 1
+        manifest.print_stats()
+    if not reports:
+        print("❌ 沒有可抽樣的PDF")
+        return {}
+
+    strata = build_strata(reports)
+    allocation = allocate(strata, sample_pages)
+    population_pages = {key: sum(r['page_count'] for r in rs) for key, rs in strata.items()}
+    units = draw_sample(strata, allocation, rng)
+    print(f"🎯 {len(reports)} 個文件分為 {len(strata)} 層，抽取 {sum(len(u['pages']) for u in units)} 頁"
+          f"（{len(units)} 個抽樣 PDF），預檢拒絕 {rejected} 個")
+
+    for unit in units:
+        unit['sample_path'] = extract_pages(unit, run_dir / 'pages')
+
+    estimates = {}
+    for engine in engines:
+        measurements = []
+        for unit in units:
+            start = time.time()
+            try:
+                result = run_engine(engine, unit['sample_path'], run_dir)
+            except Exception as e:
+                result = {'success': False, 'error': f"{type(e).__name__}: {e}"}
+            measurements.append({
+                'stratum': unit['stratum'],
+                'file': unit['report']['file'],
+                'pages': len(unit['pages']),
+                'time': time.time() - start,
+                'success': bool(result.get('success')),
+                'error_code': result.get('error_code'),
+            })
+        est = estimate(measurements, population_pages, cost_per_hour)
+        est['measurements'] = measurements
+        estimates[engine] = est
+        print_estimate(engine, est)
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    output_file = run_dir / 'estimate.json'
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({'seed': seed, 'sample_pages': sample_pages, 'rejected_files': rejected,
+                   'estimates': estimates}, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\n估計結果已保存到: {output_file}")
+    return estimates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分層頁面抽樣，估算各引擎在整個語料上的時間、成本與成功率")
+    parser.add_argument("root", nargs="?", default=str(TOOLS_DIR / "test_pdfs"), help="語料目錄（遞迴）")
+    parser.add_argument("--pages", type=int, default=30, help="總抽樣頁數")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=['mineru'])
+    parser.add_argument("--seed", type=int, help="隨機種子（固定後可重現同一份樣本）")
+    parser.add_argument("--cost-per-hour", type=float, help="每小時機器成本，用於估算總成本")
+    parser.add_argument("--output", help=f"抽樣輸出目錄（預設 {DEFAULT_OUTPUT}）")
+    args = parser.parse_args(argv)
+
+    estimates = run_sample(args.root, args.engines, args.pages, args.seed, args.cost_per_hour, args.output)
+    return 0 if estimates else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
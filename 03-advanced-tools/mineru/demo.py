@@ -4,82 +4,259 @@ MinerU PDF數據處理實現
 """
 
 import subprocess
+import sys
 import tempfile
 import time
 import json
 from pathlib import Path
 
-def process_pdfs():
-    """處理test_pdfs目錄下的PDF文件"""
-    # 指向父目錄的 test_pdfs
-    test_dir = Path(__file__).parent.parent / "test_pdfs"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.discovery import Manifest, output_key
+from common.errors import (
+    BENIGN_WARNING, MISSING_BINARY, TIMEOUT,
+    classify_exception, classify_output, error_result, extract_error_line, is_failure, run_with_retry,
+)
+from common import metrics
+from common.pipeline import Pipeline, Stage
+from common.priority import Inbox, Preempted, from_env, run_command
+from common.preflight import preflight_pdf, rejected_result, summarize
+from common.result_index import ResultIndex, read_markdown
+
+# 各階段的預設線程數：engine 對應同時運行的 mineru 進程數（多 GPU 時可調大）
+DEFAULT_WORKERS = {'preflight': 2, 'engine': 1, 'postprocess': 2, 'write': 1}
+# mineru 輸出目錄（在 mineru 目錄下）
+OUTPUT_DIR = Path(__file__).parent / "output"
+# interactive 文件到達時，只搶佔運行不超過這麼久的 mineru 進程（更久的讓它跑完，interactive 排隊首）
+PREEMPT_GRACE = 120
+
+def process_pdfs(index=None, workers=None, manifest=None, input_dir=None, inbox_dir=None, reserved=0):
+    """
+    遞迴處理 input_dir（預設 test_pdfs）目錄下的PDF文件，index 為 ResultIndex 時逐份寫入結果索引
+
+    以分階段流水線執行：preflight → engine(mineru) → postprocess(掃描輸出) → write/index，
+    mineru 處理下一份文件的同時，上一份的輸出掃描與索引寫入在其他線程完成。
+    文件由 manifest（common.discovery）邊遍歷邊產出，未變更的目錄不再重新 stat。
+
+    inbox_dir 中新放入的 PDF 以 interactive 優先級插隊（common.priority），
+    reserved 個 engine 線程只處理 interactive 文件；剛啟動的 bulk mineru 進程會被搶佔後重跑。
+    """
+    # 預設指向父目錄的 test_pdfs
+    test_dir = Path(input_dir) if input_dir else Path(__file__).parent.parent / "test_pdfs"
     if not test_dir.exists():
         print("❌ test_pdfs目錄不存在")
         print(f"   預期路徑: {test_dir.absolute()}")
         return []
 
-    pdf_files = list(test_dir.glob("*.pdf"))
-    if not pdf_files:
-        print("❌ 無PDF文件")
-        return []
-
-    print(f"📁 發現 {len(pdf_files)} 個PDF")
+    workers = dict(DEFAULT_WORKERS, **(workers or {}))
+    repair_dir = OUTPUT_DIR / "_repaired"
     results = []
+    own_manifest = manifest is None
+    manifest = manifest or Manifest()
 
-    for pdf in pdf_files:
-        size_mb = pdf.stat().st_size / (1024*1024)
-        print(f"處理: {pdf.name} ({size_mb:.1f}MB)")
+    def preflight_stage(ctx):
+        # 預檢：拒絕損壞/加密的文件，修復 xref 損壞的文件，避免在 mineru 中耗滿超時
+        report = preflight_pdf(ctx['pdf'], repair_dir=repair_dir)
+        ctx['report'] = report
+        if not report['ok']:
+            print(f"  ⛔ 預檢拒絕: {report['file']} - {report['reason']}")
+            ctx['failed'] = True
+            ctx['result_data'] = rejected_result(report)
+        else:
+            report['sha256'] = manifest.ensure_hash(ctx['item'])
+        return ctx
 
+    def engine_stage(ctx):
+        report = ctx['report']
+        pdf = Path(report['input_path'])
+        print(f"處理: {pdf.name} ({report['size_mb']:.1f}MB, {report['page_count'] or '?'} 頁)")
         start_time = time.time()
-        result = convert_pdf(pdf)
-        process_time = time.time() - start_time
-
-        result_data = {
-            'file': pdf.name,
-            'size_mb': size_mb,
-            'process_time': process_time,
-            'success': result['success'],
-            'output_size': result.get('output_size', 0),
-            'error': result.get('error', None)
-        }
-        
-        # 添加成功時的額外信息
-        if result['success']:
-            result_data['md_count'] = result.get('md_count', 0)
-            result_data['json_count'] = result.get('json_count', 0)
-            result_data['output_dir'] = result.get('output_dir', '')
-            result_data['warning'] = result.get('warning', None)
-            
-            if result_data['md_count'] > 0:
-                print(f"  ✅ 成功！生成 {result_data['md_count']} 個 Markdown 文件")
-            elif result_data['json_count'] > 0:
-                print(f"  ✅ 成功！生成 {result_data['json_count']} 個 JSON 文件")
-            else:
-                warning = result_data.get('warning', '')
-                if warning:
-                    print(f"  ⚠️  {warning}")
-                else:
-                    print(f"  ⚠️  處理完成，但未找到輸出文件")
-        else:
-            error_msg = result.get('error', '未知錯誤')
-            # 截斷過長的錯誤信息
-            if len(error_msg) > 200:
-                error_msg = error_msg[:200] + "..."
-            print(f"  ❌ 失敗: {error_msg}")
-        
+        with metrics.track_engine('mineru'):
+            ctx['result'] = run_engine(pdf, source=report['path'])
+        ctx['process_time'] = time.time() - start_time
+        if not ctx['result']['success']:
+            ctx['failed'] = True
+        return ctx
+
+    def postprocess_stage(ctx):
+        start_time = time.time()
+        result = ctx['result']
+        result.update(scan_output(result['output_dir'], result.pop('engine_note', None)))
+        if index is not None:
+            ctx['markdown'], ctx['pages'] = collect_output_text(result['output_dir'])
+        ctx['process_time'] += time.time() - start_time
+        return ctx
+
+    def write_stage(ctx):
+        report = ctx['report']
+        if 'result_data' not in ctx:
+            ctx['result_data'] = build_result_data(report, ctx.get('result'), ctx.get('process_time', 0), ctx.get('errors'))
+        result_data = ctx['result_data']
+        metrics.observe_result('mineru', result_data, pages=report['page_count'])
         results.append(result_data)
 
+        if index is not None:
+            index.record_run(report['path'], 'mineru', result_data, markdown=ctx.get('markdown'),
+                             pages=ctx.get('pages'), output_path=result_data.get('output_dir'))
+        return ctx
+
+    pipeline = Pipeline([
+        Stage('preflight', preflight_stage, workers['preflight']),
+        Stage('engine', engine_stage, workers['engine'], queue_gauge=metrics.QUEUE_DEPTH.labels('mineru'),
+              reserved=reserved, preempt_grace=PREEMPT_GRACE, preempt_counter=metrics.PREEMPTIONS.labels('mineru')),
+        Stage('postprocess', postprocess_stage, workers['postprocess']),
+        Stage('write', write_stage, workers['write'], always=True),
+    ], wait_metric=lambda priority: metrics.QUEUE_WAIT.labels('mineru', priority))
+    inbox = Inbox(inbox_dir, lambda item: {'pdf': item['path'], 'item': item}) if inbox_dir else None
+    # 邊遍歷邊送入流水線：第一份文件不必等整個語料掃描完畢即開始預檢
+    try:
+        pipeline.run(({'pdf': item['path'], 'item': item} for item in manifest.walk(test_dir)), inbox=inbox)
+        manifest.print_stats()
+    finally:
+        if own_manifest:
+            manifest.close()
+    if not results:
+        print("❌ 無PDF文件")
+        return []
+    pipeline.print_stats()
+
     return results
 
-def convert_pdf(pdf_path):
-    """使用mineru轉換PDF"""
+def build_result_data(report, result, process_time, errors=None):
+    """組合單一文件的結果記錄並輸出處理狀態"""
+    if result is None:
+        result = {'success': False, 'error': '; '.join(errors or []) or '未知錯誤'}
+    result_data = {
+        'file': report['file'],
+        'size_mb': report['size_mb'],
+        'process_time': process_time,
+        'success': result['success'],
+        'output_size': result.get('output_size', 0),
+        'error': result.get('error', None),
+        'error_code': result.get('error_code', None),
+        'attempts': result.get('attempts', 1),
+        'sha256': report.get('sha256'),
+        'preflight': summarize(report)
+    }
+    
+    # 添加成功時的額外信息
+    if result['success']:
+        result_data['md_count'] = result.get('md_count', 0)
+        result_data['json_count'] = result.get('json_count', 0)
+        result_data['output_dir'] = result.get('output_dir', '')
+        result_data['warning'] = result.get('warning', None)
+        
+        if result_data['md_count'] > 0:
+            print(f"  ✅ {report['file']} 成功！生成 {result_data['md_count']} 個 Markdown 文件")
+        elif result_data['json_count'] > 0:
+            print(f"  ✅ {report['file']} 成功！生成 {result_data['json_count']} 個 JSON 文件")
+        else:
+            warning = result_data.get('warning', '')
+            if warning:
+                print(f"  ⚠️  {report['file']}: {warning}")
+            else:
+                print(f"  ⚠️  {report['file']} 處理完成，但未找到輸出文件")
+    else:
+        error_msg = result.get('error') or '未知錯誤'
+        # 截斷過長的錯誤信息
+        if len(error_msg) > 200:
+            error_msg = error_msg[:200] + "..."
+        print(f"  ❌ {report['file']} 失敗: {error_msg}")
+    return result_data
+
+def collect_output_text(output_dir):
+    """讀取 mineru 輸出目錄的 markdown，並從 *_content_list.json 按頁整理文字"""
+    if not output_dir:
+        return None, None
+    output_dir = Path(output_dir)
+    markdown = read_markdown(sorted(output_dir.rglob('*.md')))
+
+    pages = {}
+    for content_list in output_dir.rglob('*_content_list.json'):
+        try:
+            with open(content_list, 'r', encoding='utf-8') as f:
+                blocks = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for block in blocks:
+            text = block.get('text') or block.get('table_body') or ''
+            if text.strip() and 'page_idx' in block:
+                pages.setdefault(block['page_idx'] + 1, []).append(text)
+    return markdown, {n: "\n".join(texts) for n, texts in pages.items()}
+
+def convert_pdf(pdf_path, timeout=600, vram=None, output_dir=None):
+    """使用mineru轉換PDF，按錯誤類型自動重試，成功後掃描輸出（output_dir 預設為 OUTPUT_DIR）"""
+    result = run_engine(pdf_path, timeout=timeout, vram=vram, output_dir=output_dir)
+    if result['success']:
+        result.update(scan_output(result['output_dir'], result.pop('engine_note', None)))
+    return result
+
+def run_engine(pdf_path, timeout=600, vram=None, source=None, output_dir=None):
+    """執行 mineru（按錯誤類型自動重試）"""
+    params = {'timeout': timeout}
+    if vram is not None:
+        params['vram'] = vram
+    return run_with_retry(lambda p: run_mineru(pdf_path, source=source, output_dir=output_dir, **p), params)
+
+def output_dir_for(pdf_path, output_dir=None):
+    """某份 PDF 的 mineru 輸出目錄：output/<文件名>-<路徑雜湊>（不同子目錄的同名 PDF 不互相覆蓋）"""
+    return Path(output_dir or OUTPUT_DIR) / output_key(pdf_path)
+
+def markdown_snapshot(output_dir):
+    """輸出目錄中各 Markdown 文件的修改時間（新增或被改寫的文件即本次運行的輸出）"""
+    return {str(f): f.stat().st_mtime_ns for f in Path(output_dir).rglob('*.md')}
+
+def scan_output(output_dir, engine_note=None):
+    """掃描 mineru 輸出目錄，統計生成的 markdown / JSON 文件"""
+    pdf_output_dir = Path(output_dir)
+    # 查找生成的 markdown 文件
+    md_files = list(pdf_output_dir.rglob('*.md'))
+    if md_files:
+        output_size = sum(f.stat().st_size for f in md_files)
+        return {'success': True, 'output_size': output_size, 'md_count': len(md_files), 'output_dir': str(pdf_output_dir)}
+
+    # 也檢查其他可能的輸出格式
+    json_files = list(pdf_output_dir.rglob('*.json'))
+    if json_files:
+        output_size = sum(f.stat().st_size for f in json_files)
+        return {'success': True, 'output_size': output_size, 'json_count': len(json_files), 'output_dir': str(pdf_output_dir)}
+    
+    # 檢查是否有任何文件生成
+    all_files = list(pdf_output_dir.rglob('*'))
+    if all_files:
+        # 有文件但格式不對，返回信息
+        file_types = set(f.suffix for f in all_files if f.is_file())
+        return {
+            'success': True, 
+            'output_size': 0, 
+            'md_count': 0, 
+            'output_dir': str(pdf_output_dir),
+            'warning': f'生成了文件但未找到 .md 或 .json 格式，發現的文件類型: {file_types}'
+        }
+    
+    warning = '命令執行成功但未找到輸出文件'
+    if engine_note:
+        warning += f"，輸出: {engine_note}"
+    return {
+        'success': True, 
+        'output_size': 0, 
+        'md_count': 0, 
+        'output_dir': str(pdf_output_dir),
+        'warning': warning
+    }
+
+def run_mineru(pdf_path, timeout=600, vram=None, source=None, output_dir=None):
+    """
+    執行一次 mineru 命令並按返回碼與輸出分類結果（不掃描輸出目錄）
+
+    source 為原始路徑（預檢修復後 pdf_path 是修復副本），輸出目錄按它命名；
+    output_dir 為輸出根目錄（預設 OUTPUT_DIR，抽樣等試跑傳入自己的工作目錄）
+    """
     try:
-        # 創建輸出目錄（在 mineru 目錄下）
-        output_dir = Path(__file__).parent / "output"
-        output_dir.mkdir(exist_ok=True)
+        # 創建輸出目錄
+        Path(output_dir or OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
         
         # 為每個PDF創建單獨的輸出子目錄
-        pdf_output_dir = output_dir / pdf_path.stem
+        pdf_output_dir = output_dir_for(source or pdf_path, output_dir)
         pdf_output_dir.mkdir(exist_ok=True)
 
         # 正確的命令格式：mineru -p <input_path> -o <output_path>
@@ -90,76 +267,37 @@ def convert_pdf(pdf_path):
             "-o", str(pdf_output_dir),  # 輸出目錄
             "-m", "auto"  # 自動選擇最佳方法
         ]
+        if vram is not None:
+            cmd += ["--vram", str(vram)]  # 限制單進程 GPU 記憶體（GB）
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        # 運行前已有的 Markdown（上次嘗試留下的），用來判斷本次是否真的寫出了輸出
+        before = markdown_snapshot(pdf_output_dir)
+        # 經 run_command 啟動：bulk 文件被 interactive 文件搶佔時終止 mineru 進程
+        result = run_command(cmd, timeout=timeout)
 
-        # 檢查 stderr 中是否有錯誤（即使返回碼為 0，也可能有錯誤）
-        error_output = result.stderr.strip() or result.stdout.strip()
-        has_error = error_output and ('error' in error_output.lower() or 'not found' in error_output.lower() or 'traceback' in error_output.lower())
-        
-        # 檢查返回碼和輸出
-        if result.returncode == 0 and not has_error:
-            # 查找生成的 markdown 文件
-            md_files = list(pdf_output_dir.rglob('*.md'))
-            if md_files:
-                output_size = sum(f.stat().st_size for f in md_files)
-                return {'success': True, 'output_size': output_size, 'md_count': len(md_files), 'output_dir': str(pdf_output_dir)}
-            else:
-                # 也檢查其他可能的輸出格式
-                json_files = list(pdf_output_dir.rglob('*.json'))
-                if json_files:
-                    output_size = sum(f.stat().st_size for f in json_files)
-                    return {'success': True, 'output_size': output_size, 'json_count': len(json_files), 'output_dir': str(pdf_output_dir)}
-                
-                # 檢查是否有任何文件生成
-                all_files = list(pdf_output_dir.rglob('*'))
-                if all_files:
-                    # 有文件但格式不對，返回信息
-                    file_types = set(f.suffix for f in all_files if f.is_file())
-                    return {
-                        'success': True, 
-                        'output_size': 0, 
-                        'md_count': 0, 
-                        'output_dir': str(pdf_output_dir),
-                        'warning': f'生成了文件但未找到 .md 或 .json 格式，發現的文件類型: {file_types}'
-                    }
-                
-                # 沒有生成任何文件，檢查錯誤輸出
-                if error_output and ('error' in error_output.lower() or 'not found' in error_output.lower() or 'traceback' in error_output.lower()):
-                    # 提取關鍵錯誤信息
-                    error_lines = [line for line in error_output.split('\n') if 'error' in line.lower() or 'not found' in line.lower()]
-                    if error_lines:
-                        error_msg = error_lines[0][:300]  # 取第一行錯誤信息
-                    else:
-                        error_msg = error_output[:300]
-                    return {'success': False, 'error': error_msg}
-                
-                return {
-                    'success': True, 
-                    'output_size': 0, 
-                    'md_count': 0, 
-                    'output_dir': str(pdf_output_dir),
-                    'warning': '命令執行成功但未找到輸出文件'
-                }
-        else:
-            # 命令失敗，組合錯誤信息
+        # 按返回碼與輸出特徵分類（mineru 成功時也可能輸出 "error" 字樣；
+        # 已生成 Markdown 時，日誌中的 PDF 修復 / OOM 回退字樣只算警告）
+        error_output = "\n".join(part for part in (result.stderr.strip(), result.stdout.strip()) if part)
+        has_output = bool(markdown_snapshot(pdf_output_dir).items() - before.items())
+        code = classify_output(result.returncode, error_output, has_output=has_output)
+        if is_failure(code):
             if not error_output:
-                error_msg = f"命令執行失敗，返回碼: {result.returncode}"
-            else:
-                # 提取關鍵錯誤信息
-                error_lines = [line for line in error_output.split('\n') if 'error' in line.lower() or 'not found' in line.lower()]
-                if error_lines:
-                    error_msg = error_lines[0][:300]  # 取第一行錯誤信息
-                else:
-                    error_msg = error_output[:300]
-            return {'success': False, 'error': error_msg}
+                return error_result(code, detail=f"命令執行失敗，返回碼: {result.returncode}")
+            return error_result(code, error_output)
+
+        result_data = {'success': True, 'output_dir': str(pdf_output_dir)}
+        if code == BENIGN_WARNING:
+            result_data['engine_note'] = extract_error_line(error_output)
+        return result_data
 
     except FileNotFoundError:
-        return {'success': False, 'error': 'mineru命令未找到，請確認已安裝 mineru'}
+        return error_result(MISSING_BINARY, detail='mineru')
     except subprocess.TimeoutExpired:
-        return {'success': False, 'error': '處理超時（超過600秒）'}
+        return error_result(TIMEOUT, detail=f'超過{timeout}秒')
+    except Preempted:
+        raise
     except Exception as e:
-        return {'success': False, 'error': str(e)}
+        return error_result(classify_exception(e), detail=str(e))
 
 def analyze_results(results):
     """分析處理結果"""
@@ -178,6 +316,17 @@ def analyze_results(results):
     if total_time > 0:
         print(f"平均速度: {total_size/total_time:.2f}MB/秒")
 
+    # 預檢統計：頁數與文字層（掃描版）分佈
+    preflight = [r['preflight'] for r in results if r.get('preflight')]
+    total_pages = sum(p['page_count'] or 0 for p in preflight)
+    if total_pages:
+        print(f"總頁數: {total_pages}")
+        if total_time > 0:
+            print(f"平均速度: {total_pages/total_time:.2f}頁/秒")
+    scanned = sum(1 for p in preflight if p['has_text_layer'] is False)
+    if scanned:
+        print(f"無文字層（掃描版）: {scanned} 個")
+
     # 顯示錯誤
     for r in results:
         if not r['success']:
@@ -225,8 +374,16 @@ def main():
         print("   請先安裝 mineru: uv pip install -U 'mineru[core]'")
         return
     
-    results = process_pdfs()
-    analyze_results(results)
+    exporters = metrics.start_from_env()
+    index = ResultIndex()
+    inbox_dir, reserved = from_env()
+    try:
+        results = process_pdfs(index=index, inbox_dir=inbox_dir, reserved=reserved)
+        analyze_results(results)
+        print(f"結果索引: {index.db_path}")
+    finally:
+        index.close()
+        metrics.stop_exporters(exporters)
 
 if __name__ == "__main__":
     main()
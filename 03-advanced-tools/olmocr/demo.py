@@ -7,21 +7,58 @@ olmOCR v0.4.6 PDF 處理工具 - 單一檔案輸入版本
 import subprocess
 import sys
 import os
+import time
+import argparse
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import metrics
+from common.discovery import output_key
+from common.errors import TIMEOUT, UNKNOWN, classify_exception, classify_output, error_result, run_with_retry
+from common.pipeline import Pipeline, Stage
+from common.priority import Inbox, Preempted, from_env, run_command
+from common.preflight import preflight_all, preflight_pdf, rejected_result, summarize
+from common.result_index import ResultIndex
+from workspace_reader import Workspace, resumable_output, summarize_output
+
 # 配置：指定使用的 GPU 設備
 GPU_DEVICE = 1
+# 服務池模式下 interactive 文件到達時，只搶佔運行不超過這麼久的 bulk pipeline
+PREEMPT_GRACE = 300
+
+def convert_pdf_v046(pdf_path, server_url=None, workspace_dir=None, gpu_device=GPU_DEVICE,
+                     timeout=2700, max_model_len=8192, source=None):
+    """使用 olmOCR v0.4.6 轉換PDF，新版本使用 vLLM 替代 SGLang
+
+    指定 server_url 時連接外部推理服務，不在本進程內啟動 vLLM；
+    失敗時按錯誤類型重試（例如 OOM 時減半 max_model_len）；
+    source 為原始路徑（預檢修復後 pdf_path 是修復副本），用於判斷 workspace 中的舊結果是否過時
+    """
+    params = {'timeout': timeout}
+    if not server_url:
+        params['max_model_len'] = max_model_len
+    return run_with_retry(
+        lambda p: run_pipeline_v046(pdf_path, server_url, workspace_dir, gpu_device, source=source, **p), params)
 
-def convert_pdf_v046(pdf_path):
-    """使用 olmOCR v0.4.6 轉換PDF，新版本使用 vLLM 替代 SGLang"""
+def run_pipeline_v046(pdf_path, server_url=None, workspace_dir=None, gpu_device=GPU_DEVICE,
+                      timeout=2700, max_model_len=8192, source=None):
+    """執行一次 olmocr.pipeline 並掃描 workspace 輸出"""
     try:
         # 創建輸出目錄（workspace）
         output_dir = Path(__file__).parent / "output"
         output_dir.mkdir(exist_ok=True)
 
         # olmOCR 使用 workspace 目錄
-        workspace_dir = output_dir / "workspace"
-        workspace_dir.mkdir(exist_ok=True)
+        if workspace_dir is None:
+            workspace_dir = output_dir / "workspace"
+        workspace_dir = Path(workspace_dir)
+        workspace_dir.mkdir(parents=True, exist_ok=True)
+
+        # PDF 在原路徑被修改後，舊結果分片會讓 pipeline 直接跳過該文件：先作廢舊結果，再記錄本次的來源大小與 mtime
+        workspace = Workspace(workspace_dir)
+        if not workspace.stamp_matches(pdf_path, source):
+            workspace.invalidate(pdf_path)
+        workspace.write_stamp(pdf_path, source)
 
         print(f"📁 工作目錄: {workspace_dir}")
         print(f"📄 處理文件: {pdf_path}")
@@ -34,27 +71,30 @@ def convert_pdf_v046(pdf_path):
             "--pdfs", str(pdf_path),
             "--markdown",  # 生成 markdown 輸出
             "--max_page_error_rate", "0.3",  # 允許30%頁面錯誤率
-            "--gpu_memory_utilization", "0.7",  # vLLM GPU 記憶體使用率
-            "--max_model_len", "8192",  # 增加 context 長度以支持 8000 token 輸出
-            "--tensor_parallel_size", "1",  # 單 GPU
-            "--data_parallel_size", "1",  # 無 data parallelism
         ]
+        if server_url:
+            # 使用外部推理服務（服務池中的實例）
+            cmd += ["--server", f"{server_url.rstrip('/')}/v1"]
+        else:
+            cmd += [
+                "--gpu_memory_utilization", "0.7",  # vLLM GPU 記憶體使用率
+                "--max_model_len", str(max_model_len),  # 增加 context 長度以支持 8000 token 輸出
+                "--tensor_parallel_size", "1",  # 單 GPU
+                "--data_parallel_size", "1",  # 無 data parallelism
+            ]
 
         print(f"🚀 執行命令: olmocr.pipeline {' '.join(cmd[3:])}")
 
         # 設置環境變量
         env = os.environ.copy()
-        if GPU_DEVICE is not None:
-            env['CUDA_VISIBLE_DEVICES'] = str(GPU_DEVICE)
-            print(f"🎯 使用 GPU: {GPU_DEVICE}")
+        if gpu_device is not None and not server_url:
+            env['CUDA_VISIBLE_DEVICES'] = str(gpu_device)
+            print(f"🎯 使用 GPU: {gpu_device}")
 
-        # 執行命令，設定45分鐘超時（增加超時時間）
+        # 執行命令，預設45分鐘超時（增加超時時間）
         print("⏳ 開始處理...")
-        result = subprocess.run(cmd,
-                              capture_output=True,
-                              text=True,
-                              timeout=2700,  # 45分鐘
-                              env=env)
+        # 經 run_command 啟動：服務池模式下 bulk 文件被 interactive 文件搶佔時終止 pipeline
+        result = run_command(cmd, timeout=timeout, env=env)
 
         print(f"📊 返回碼: {result.returncode}")
 
@@ -64,85 +104,189 @@ def convert_pdf_v046(pdf_path):
         if result.stderr:
             print(f"🔍 錯誤輸出 (最後500字符):\n{result.stderr[-500:]}")
 
-        # 檢查結果
+        # 檢查結果：只讀取屬於此 PDF 的結果（workspace 可能殘留其他文件的輸出）
         if result.returncode == 0:
-            # 查找生成的文件
-            all_files = list(workspace_dir.rglob('*'))
-            output_files = [f for f in all_files if f.is_file()]
-
-            # 分類文件類型
-            md_files = [f for f in output_files if f.suffix == '.md']
-            json_files = [f for f in output_files if f.suffix in ['.json', '.jsonl']]
+            output = summarize_output(workspace_dir, pdf_path)
+            if output is None:
+                # 頁面錯誤率超過 --max_page_error_rate 時 pipeline 仍返回 0，但不寫出該文件
+                return error_result(UNKNOWN, detail='pipeline 完成但 workspace 中沒有該文件的結果（頁面錯誤率可能超限）')
 
             print(f"✅ 處理完成！")
             print(f"📁 工作目錄: {workspace_dir}")
-            print(f"📄 生成文件數量: {len(output_files)}")
-
-            if md_files:
-                print(f"📝 Markdown 文件 ({len(md_files)} 個):")
-                for f in md_files:
-                    size = f.stat().st_size
-                    print(f"   - {f.relative_to(workspace_dir)} ({size} bytes)")
-
-            if json_files:
-                print(f"🗂️  JSON 文件 ({len(json_files)} 個):")
-                for f in json_files:
-                    size = f.stat().st_size
-                    print(f"   - {f.relative_to(workspace_dir)} ({size} bytes)")
-
-            if output_files:
-                print("📝 其他文件:")
-                other_files = [f for f in output_files if f.suffix not in ['.md', '.json', '.jsonl']]
-                for f in other_files[:5]:  # 顯示前5個其他文件
-                    size = f.stat().st_size
-                    print(f"   - {f.relative_to(workspace_dir)} ({size} bytes)")
-                if len(other_files) > 5:
-                    print(f"   ... 還有 {len(other_files) - 5} 個文件")
-
-            return {
-                'success': True,
-                'workspace': str(workspace_dir),
-                'file_count': len(output_files),
-                'markdown_files': len(md_files),
-                'json_files': len(json_files),
-                'files': [str(f.relative_to(workspace_dir)) for f in output_files[:10]]
-            }
+            print(f"📄 頁數: {output['page_count']}（fallback {output['fallback_pages']} 頁）")
+            for f in output['files']:
+                print(f"   - {f}")
+
+            return dict(output, success=True)
         else:
-            return {
-                'success': False,
-                'error': f'olmOCR v0.4.6 處理失敗，返回碼: {result.returncode}',
-                'stderr': result.stderr[-500:] if result.stderr else None,
-                'stdout': result.stdout[-500:] if result.stdout else None
-            }
+            code = classify_output(result.returncode, (result.stderr or '') + (result.stdout or ''))
+            failure = error_result(code, detail=f'olmOCR v0.4.6 處理失敗，返回碼: {result.returncode}')
+            failure['stderr'] = result.stderr[-500:] if result.stderr else None
+            failure['stdout'] = result.stdout[-500:] if result.stdout else None
+            return failure
 
     except subprocess.TimeoutExpired:
-        return {'success': False, 'error': '處理超時（超過45分鐘）'}
+        return error_result(TIMEOUT, detail=f'超過{timeout // 60}分鐘')
+    except Preempted:
+        raise
     except Exception as e:
-        return {'success': False, 'error': str(e)}
+        return error_result(classify_exception(e), detail=str(e))
 
-def main():
-    """主函數：支持命令列參數或使用預設檔案"""
+def record_to_index(index, report, result):
+    """把 olmOCR 結果寫入結果索引，文字與按頁切分直接取自 workspace 的結果分片"""
+    markdown = pages = None
+    if result.get('success') and result.get('workspace'):
+        doc = Workspace(result['workspace']).document_for(report['input_path'])
+        if doc is not None:
+            markdown, pages = doc['text'], doc['pages']
+    result = dict(result, preflight=summarize(report))
+    index.record_run(report['path'], 'olmocr', result, markdown=markdown, pages=pages,
+                     output_path=result.get('workspace'))
 
-    # 檢查命令列參數
-    if len(sys.argv) > 1:
-        pdf_path = sys.argv[1]
-        if not os.path.exists(pdf_path):
-            print(f"❌ 錯誤：檔案不存在 - {pdf_path}")
-            return
-    else:
-        # 使用預設檔案
-        pdf_path = "/home/os-sunnie.gd.weng/python_workstation/side-project/RAG/OCR-tool-comparsion/03-advanced-tools/test_pdfs/2021_CLIP.pdf"
-        if not os.path.exists(pdf_path):
-            print(f"❌ 錯誤：預設檔案不存在 - {pdf_path}")
-            print("💡 使用方法: python demo.py <PDF檔案路徑>")
+def convert_pdfs_pooled(reports, pool, inbox_dir=None, reserved=0):
+    """
+    透過推理服務池並行處理多個 PDF，每份文件分派給最少負載的健康實例
+
+    reports 為預檢通過的報告（bulk）；inbox_dir 中新放入的 PDF 以 interactive 優先級插隊，
+    預檢後處理，reserved 個線程只處理 interactive 文件，剛啟動的 bulk pipeline 會被搶佔後重跑。
+    返回 (預檢報告, 結果) 列表：先是與 reports 同序的 bulk 文件，再是 interactive 文件。
+    """
+    output_dir = Path(__file__).parent / "output" / "workspace_pool"
+    repair_dir = Path(__file__).parent / "output" / "_repaired"
+
+    def convert_one(ctx):
+        if 'report' not in ctx:
+            # interactive 文件在運行期間才到達，尚未預檢
+            ctx['report'] = preflight_pdf(ctx['pdf'], repair_dir=repair_dir)
+            if not ctx['report']['ok']:
+                print(f"  ⛔ 預檢拒絕: {ctx['report']['file']} - {ctx['report']['reason']}")
+                ctx['result'] = rejected_result(ctx['report'])
+                return ctx
+        pdf_path = ctx['report']['input_path']
+        # 每份文件使用獨立 workspace，避免多個 pipeline 共用同一工作隊列；按原始路徑命名，同名 PDF 不共用
+        workspace_dir = output_dir / output_key(ctx['report']['path'])
+        # 續跑：上次已寫出結果分片且原始 PDF 未改變的文件直接沿用，不再佔用推理實例
+        existing = resumable_output(workspace_dir, pdf_path, source=ctx['report']['path'])
+        if existing is not None:
+            ctx['result'] = dict(existing, success=True, resumed=True, file=Path(pdf_path).name)
+            return ctx
+        # 實例故障由服務池切換處理，這裡不再按錯誤類型重試；被搶佔時不計入文件結果
+        with metrics.track_engine('olmocr'):
+            result = pool.dispatch(lambda inst: run_pipeline_v046(
+                pdf_path, server_url=inst.url, workspace_dir=workspace_dir, source=ctx['report']['path']))
+        metrics.observe_result('olmocr', result, pages=ctx['report']['page_count'])
+        result['file'] = Path(pdf_path).name
+        ctx['result'] = result
+        return ctx
+
+    pipeline = Pipeline([
+        Stage('engine', convert_one, len(pool), queue_gauge=metrics.QUEUE_DEPTH.labels('olmocr'), always=True,
+              reserved=reserved, preempt_grace=PREEMPT_GRACE, preempt_counter=metrics.PREEMPTIONS.labels('olmocr')),
+    ], wait_metric=lambda priority: metrics.QUEUE_WAIT.labels('olmocr', priority))
+    inbox = Inbox(inbox_dir, lambda item: {'pdf': item['path']}) if inbox_dir else None
+    outputs = pipeline.run(({'report': report, 'order': n} for n, report in enumerate(reports)), inbox=inbox)
+
+    # 流水線輸出順序不固定：bulk 按輸入順序排列，interactive 附加在後
+    outputs.sort(key=lambda ctx: ctx.get('order', len(reports)))
+    converted = []
+    for ctx in outputs:
+        result = ctx.get('result')
+        if result is None:
+            result = error_result(UNKNOWN, detail='; '.join(ctx.get('errors', [])))
+            result['file'] = Path(ctx['report']['input_path']).name
+        converted.append((ctx['report'], result))
+    resumed = sum(1 for _, r in converted if r.get('resumed'))
+    if resumed:
+        print(f"♻️  續跑：{resumed} 個文件已有結果，未重新處理")
+    pipeline.print_stats()
+    return converted
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="olmOCR v0.4.6 PDF 處理工具")
+    parser.add_argument("pdfs", nargs="*", help="PDF 檔案路徑")
+    parser.add_argument("--ports", help="推理服務池端口列表，例如 30024,30025")
+    parser.add_argument("--gpus", help="對應每個端口的 GPU 設備，例如 0,1")
+    parser.add_argument("--launch", action="store_true", help="為未運行的端口啟動 vLLM server")
+    return parser.parse_args()
+
+def main_pooled(pdf_paths, args):
+    """服務池模式：多個推理實例並行處理"""
+    from server_pool import ServerPool
+
+    ports = [int(p) for p in args.ports.split(",") if p]
+    gpus = [int(g) for g in args.gpus.split(",")] if args.gpus else None
+    pool = ServerPool.from_ports(ports, gpus)
+
+    try:
+        healthy = pool.launch() if args.launch else pool.attach()
+        if healthy == 0:
+            print("❌ 沒有可用的推理服務實例")
             return
 
+        accepted, rejected = preflight_all(pdf_paths, repair_dir=Path(__file__).parent / "output" / "_repaired")
+        results = [rejected_result(report) for report in rejected]
+        inbox_dir, reserved = from_env()
+        converted = convert_pdfs_pooled(accepted, pool, inbox_dir=inbox_dir, reserved=reserved)
+        with ResultIndex() as index:
+            for report, result in zip(rejected, results):
+                index.record_run(report['path'], 'olmocr', result)
+            for report, result in converted:
+                if report['ok']:
+                    record_to_index(index, report, result)
+                else:
+                    index.record_run(report['path'], 'olmocr', result)
+        results += [result for _, result in converted]
+
+        print("=" * 60)
+        for r in results:
+            if r.get('resumed'):
+                print(f"♻️  {r['file']} ← {r['workspace']}")
+            elif r['success']:
+                print(f"✅ {r['file']} ← {r.get('server')}")
+            else:
+                print(f"❌ {r['file']}: {r['error']}")
+        for s in pool.status():
+            print(f"🖥️  {s['url']}: 完成 {s['completed']} 份, healthy={s['healthy']}")
+    finally:
+        pool.shutdown()
+
+def main_single(pdf_path):
+    """單一檔案模式"""
     print("🧪 olmOCR v0.4.6 PDF 處理工具")
     print("=" * 60)
     print(f"📄 目標檔案: {pdf_path}")
     print(f"📏 檔案大小: {Path(pdf_path).stat().st_size / (1024*1024):.1f} MB")
 
-    result = convert_pdf_v046(pdf_path)
+    # 預檢：損壞或需要密碼的 PDF 直接拒絕，不進入 45 分鐘的 pipeline
+    report = preflight_pdf(pdf_path, repair_dir=Path(__file__).parent / "output" / "_repaired")
+    if not report['ok']:
+        print(f"⛔ 預檢拒絕: {report['reason']}")
+        return
+    if report['page_count']:
+        print(f"📑 頁數: {report['page_count']}，文字層: {'有' if report['has_text_layer'] else '無'}")
+    if report['status'] != 'ok':
+        print(f"🩹 {report['reason']}")
+
+    # 續跑：workspace 中已有該文件的結果且 PDF 未改變時直接沿用，不必再啟動 vLLM
+    workspace = Workspace(Path(__file__).parent / "output" / "workspace")
+    existing = resumable_output(workspace.path, report['input_path'], source=report['path'])
+    if existing is not None:
+        print(f"♻️  workspace 中已有結果，跳過處理（刪除 {existing['shard']} 可重跑）")
+        result = dict(existing, success=True, resumed=True)
+    else:
+        pending = sum(1 for _ in workspace.pending_items())
+        if pending:
+            # 共用 workspace 的 pipeline 會一併處理上次中斷時未完成的工作組
+            print(f"⏳ workspace 中有 {pending} 個上次未完成的工作組，將一併續跑")
+        start_time = time.time()
+        with metrics.track_job('olmocr') as job:
+            result = convert_pdf_v046(report['input_path'], source=report['path'])
+            job['result'] = result
+            job['pages'] = report['page_count']
+        result['process_time'] = time.time() - start_time
+
+        with ResultIndex() as index:
+            record_to_index(index, report, result)
 
     print("=" * 60)
     if result['success']:
@@ -157,5 +301,33 @@ def main():
 
     print(f"🏁 最終結果: {result}")
 
+def main():
+    """主函數：支持命令列參數或使用預設檔案"""
+    args = parse_args()
+
+    # 檢查命令列參數
+    if args.pdfs:
+        for pdf_path in args.pdfs:
+            if not os.path.exists(pdf_path):
+                print(f"❌ 錯誤：檔案不存在 - {pdf_path}")
+                return
+        pdf_path = args.pdfs[0]
+    else:
+        # 使用預設檔案
+        pdf_path = "/home/os-sunnie.gd.weng/python_workstation/side-project/RAG/OCR-tool-comparsion/03-advanced-tools/test_pdfs/2021_CLIP.pdf"
+        if not os.path.exists(pdf_path):
+            print(f"❌ 錯誤：預設檔案不存在 - {pdf_path}")
+            print("💡 使用方法: python demo.py <PDF檔案路徑>")
+            return
+
+    exporters = metrics.start_from_env()
+    try:
+        if args.ports:
+            main_pooled(args.pdfs or [pdf_path], args)
+        else:
+            main_single(pdf_path)
+    finally:
+        metrics.stop_exporters(exporters)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -11,6 +11,10 @@ import json
 import socket
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.errors import MISSING_BINARY, TIMEOUT, classify_exception, classify_output, error_result, is_failure
+from workspace_reader import summarize_output
+
 # 配置：指定使用的 GPU 設備
 GPU_DEVICE = 1
 
@@ -143,64 +147,40 @@ def convert_pdf_fixed(pdf_path):
         if GPU_DEVICE is not None:
             env['CUDA_VISIBLE_DEVICES'] = str(GPU_DEVICE)
 
+        # 運行前該 PDF 已有的結果分片（上次運行留下的），用來區分本次是否真的寫出了結果
+        previous = summarize_output(workspace_dir, pdf_path)
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=900, env=env)
 
-        # 檢查 stderr 中是否有錯誤
-        error_output = result.stderr.strip() or result.stdout.strip()
-        has_gpu_memory_error = error_output and ('gpu memory' in error_output.lower() or 'kv cache is larger' in error_output.lower() or 'out of memory' in error_output.lower())
-        has_compatibility_error = error_output and ('attributeerror' in error_output.lower() and '_inductor' in error_output.lower() and 'config' in error_output.lower())
-        has_vllm_server_error = error_output and ('vllm server task ended' in error_output.lower() or 'vllm server' in error_output.lower())
-        has_error = error_output and ('error' in error_output.lower() or 'not found' in error_output.lower() or 'traceback' in error_output.lower() or has_gpu_memory_error or has_compatibility_error or has_vllm_server_error)
+        # 按返回碼與輸出特徵分類錯誤（共用分類器，避免 "error" 字樣誤判）
+        error_output = "\n".join(part for part in (result.stderr.strip(), result.stdout.strip()) if part)
+        # 只看屬於此 PDF 且本次新寫出的結果記錄：共用 workspace 中其他文件或上次運行留下的輸出不算
+        output = summarize_output(workspace_dir, pdf_path)
+        fresh = output is not None and (previous is None or output['shard'] != previous['shard'])
+        code = classify_output(result.returncode, error_output, has_output=fresh)
 
         # 檢查返回碼和輸出
-        if result.returncode == 0 and not has_error:
-            # 查找生成的 markdown 文件
-            md_files = list(workspace_dir.rglob('*.md'))
-            if md_files:
-                output_size = sum(f.stat().st_size for f in md_files)
-                file_preview = [str(f.relative_to(workspace_dir)) for f in md_files[:3]]
-                return {
-                    'success': True,
-                    'output_size': output_size,
-                    'md_count': len(md_files),
-                    'output_dir': str(workspace_dir),
-                    'files': file_preview
-                }
-            else:
-                # 檢查其他可能的輸出格式
-                json_files = list(workspace_dir.rglob('*.json'))
-                if json_files:
-                    output_size = sum(f.stat().st_size for f in json_files)
-                    return {'success': True, 'output_size': output_size, 'json_count': len(json_files), 'output_dir': str(workspace_dir)}
-
-                return {
-                    'success': True,
-                    'output_size': 0,
-                    'md_count': 0,
-                    'output_dir': str(workspace_dir),
-                    'warning': '命令執行成功但未找到輸出文件'
-                }
+        if not is_failure(code):
+            if output is not None:
+                return dict(output, success=True, output_dir=str(workspace_dir))
+            return {
+                'success': True,
+                'output_size': 0,
+                'md_count': 0,
+                'output_dir': str(workspace_dir),
+                'warning': '命令執行成功但 workspace 中沒有該文件的結果'
+            }
         else:
             # 命令失敗，組合錯誤信息
             if not error_output:
-                error_msg = f"命令執行失敗，返回碼: {result.returncode}"
-            else:
-                if has_compatibility_error:
-                    error_msg = "vLLM 內部錯誤，可能是模型載入或配置問題"
-                elif has_gpu_memory_error:
-                    error_msg = "GPU 記憶體不足，已嘗試優化但仍不足"
-                elif has_vllm_server_error:
-                    error_msg = "vLLM 服務器啟動失敗，可能是版本兼容性問題"
-                else:
-                    error_msg = error_output[:300]
-            return {'success': False, 'error': error_msg}
+                return error_result(code, detail=f"命令執行失敗，返回碼: {result.returncode}")
+            return error_result(code, error_output)
 
     except FileNotFoundError:
-        return {'success': False, 'error': 'olmOCR 模組未找到，請確認已安裝 olmocr'}
+        return error_result(MISSING_BINARY, detail='olmocr')
     except subprocess.TimeoutExpired:
-        return {'success': False, 'error': '處理超時（超過900秒）'}
+        return error_result(TIMEOUT, detail='超過900秒')
     except Exception as e:
-        return {'success': False, 'error': str(e)}
+        return error_result(classify_exception(e), detail=str(e))
     finally:
         # 清理 SGLang server 進程
         if server_proc is not None:
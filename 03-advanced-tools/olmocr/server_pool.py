@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+olmOCR 推理服務池 - 管理多個 vLLM / SGLang server 實例
+支持啟動或連接 N 個後端，依健康狀態與在途請求數分派文件，實例失效時自動切換
+"""
+
+import subprocess
+import sys
+import os
+import time
+import threading
+import urllib.request
+import urllib.error
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.priority import Preempted
+
+# 預設模型與健康檢查路徑（vLLM 與 SGLang 都提供 /health）
+DEFAULT_MODEL = "allenai/olmOCR-2-7B-1025-FP8"
+HEALTH_PATH = "/health"
+
+
+class ServerInstance:
+    """單一推理服務實例的狀態"""
+
+    def __init__(self, port, gpu_device=None, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.gpu_device = gpu_device
+        self.proc = None          # 由服務池啟動時的進程
+        self.healthy = False
+        self.in_flight = 0        # 在途文件數
+        self.completed = 0
+        self.failures = 0         # 連續失敗次數
+        self.last_check = 0.0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def status(self):
+        return {
+            'url': self.url,
+            'gpu_device': self.gpu_device,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failures': self.failures,
+            'managed': self.proc is not None,
+        }
+
+
+class ServerPool:
+    """多實例服務池：最少負載分派 + 健康檢查 + 故障切換"""
+
+    def __init__(self, instances, health_timeout=2.0, max_failures=2, recheck_interval=10.0, acquire_timeout=300.0):
+        if not instances:
+            raise ValueError("服務池至少需要一個實例")
+        self.instances = list(instances)
+        self.health_timeout = health_timeout
+        self.max_failures = max_failures
+        self.recheck_interval = recheck_interval
+        # acquire 未指定 timeout 時最多等待這麼久（連接模式的實例下線後池無法得知它是否會恢復）
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    @classmethod
+    def from_ports(cls, ports, gpu_devices=None, host="127.0.0.1", **kwargs):
+        """由端口列表（及對應 GPU）建立服務池"""
+        gpu_devices = list(gpu_devices) if gpu_devices is not None else [None] * len(ports)
+        if len(gpu_devices) != len(ports):
+            raise ValueError("ports 與 gpu_devices 數量不一致")
+        return cls([ServerInstance(p, g, host) for p, g in zip(ports, gpu_devices)], **kwargs)
+
+    def __len__(self):
+        return len(self.instances)
+
+    # ---------- 健康檢查 ----------
+
+    def check_health(self, instance, probation=False):
+        """
+        對單一實例發送健康檢查請求，返回檢查是否通過
+
+        連續失敗達到 max_failures 的實例即使檢查通過也保持下線，
+        直到 recheck_interval 後的定期複查（probation=True）才以試用身份重新加入：
+        再失敗一次即再次下線，成功一次後失敗計數歸零。
+        """
+        healthy = False
+        if instance.proc is None or instance.proc.poll() is None:
+            try:
+                with urllib.request.urlopen(instance.url + HEALTH_PATH, timeout=self.health_timeout) as resp:
+                    healthy = resp.status == 200
+            except (urllib.error.URLError, OSError):
+                healthy = False
+        with self._lock:
+            instance.last_check = time.time()
+            if healthy and probation and instance.failures >= self.max_failures:
+                instance.failures = self.max_failures - 1
+            instance.healthy = healthy and instance.failures < self.max_failures
+            if instance.healthy:
+                self._available.notify_all()
+        return healthy
+
+    def attach(self):
+        """連接已在運行的實例，返回健康實例數"""
+        for inst in self.instances:
+            self.check_health(inst)
+        healthy = sum(1 for inst in self.instances if inst.healthy)
+        print(f"🔗 服務池: {healthy}/{len(self.instances)} 個實例健康")
+        return healthy
+
+    def launch(self, model_path=DEFAULT_MODEL, extra_args=None, startup_timeout=600):
+        """為尚未運行的實例啟動 vLLM server，等待其通過健康檢查"""
+        for inst in self.instances:
+            if self.check_health(inst):
+                print(f"  ✅ {inst.url} 已在運行，直接連接")
+                continue
+
+            cmd = [
+                sys.executable, "-m", "vllm.entrypoints.openai.api_server",
+                "--model", model_path,
+                "--served-model-name", "olmocr",
+                "--host", inst.host,
+                "--port", str(inst.port),
+            ] + list(extra_args or [])
+
+            env = os.environ.copy()
+            if inst.gpu_device is not None:
+                env['CUDA_VISIBLE_DEVICES'] = str(inst.gpu_device)
+
+            print(f"  🚀 啟動實例 {inst.url} (GPU: {inst.gpu_device})")
+            inst.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+
+        deadline = time.time() + startup_timeout
+        pending = [inst for inst in self.instances if not inst.healthy]
+        while pending and time.time() < deadline:
+            time.sleep(2)
+            for inst in list(pending):
+                if inst.proc is not None and inst.proc.poll() is not None:
+                    print(f"  ❌ 實例 {inst.url} 進程已退出，返回碼: {inst.proc.returncode}")
+                    pending.remove(inst)
+                elif self.check_health(inst):
+                    print(f"  ✅ 實例 {inst.url} 已就緒")
+                    pending.remove(inst)
+        for inst in pending:
+            print(f"  ❌ 實例 {inst.url} 啟動超時")
+
+        return sum(1 for inst in self.instances if inst.healthy)
+
+    def _recheck_unhealthy(self):
+        """定期重新檢查不健康的實例，讓恢復的實例重新加入"""
+        now = time.time()
+        for inst in self.instances:
+            if not inst.healthy and now - inst.last_check >= self.recheck_interval:
+                self.check_health(inst, probation=True)
+
+    # ---------- 分派 ----------
+
+    def acquire(self, timeout=None):
+        """取得在途請求最少的健康實例；無健康實例時等待直到超時（未指定時為 acquire_timeout）"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self._recheck_unhealthy()
+            with self._lock:
+                healthy = [inst for inst in self.instances if inst.healthy]
+                if healthy:
+                    inst = min(healthy, key=lambda i: (i.in_flight, i.completed))
+                    inst.in_flight += 1
+                    return inst
+                if not any(self._can_recover(i) for i in self.instances):
+                    raise RuntimeError("服務池中沒有可用的實例")
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("等待可用實例超時")
+                wait = self.recheck_interval if remaining is None else min(remaining, self.recheck_interval)
+                self._available.wait(wait)
+
+    def _can_recover(self, instance):
+        """被池啟動且進程已退出的實例不會再恢復"""
+        return instance.proc is None or instance.proc.poll() is None
+
+    def release(self, instance, ok=True):
+        """歸還實例並記錄結果（ok 為 None 時只歸還，不計入完成或失敗）"""
+        with self._lock:
+            instance.in_flight -= 1
+            if ok:
+                instance.completed += 1
+                instance.failures = 0
+            elif ok is not None:
+                instance.failures += 1
+                if instance.failures >= self.max_failures:
+                    instance.healthy = False
+                    instance.last_check = time.time()
+            self._available.notify_all()
+
+    def mark_dead(self, instance):
+        """將實例標記為不健康，後續文件不再分派給它"""
+        with self._lock:
+            instance.healthy = False
+            instance.last_check = time.time()
+        print(f"  ⚠️  實例 {instance.url} 已下線，切換到其他實例")
+
+    def dispatch(self, fn, max_attempts=None, timeout=None):
+        """
+        將一份工作分派給最少負載的健康實例並執行 fn(instance)
+
+        fn 返回含 'success' 的結果字典；失敗且實例健康檢查不通過時，
+        視為實例故障並切換到下一個實例重試，否則視為文件本身失敗直接返回。
+        """
+        max_attempts = max_attempts or len(self.instances)
+        last_result = {'success': False, 'error': '服務池中沒有可用的實例'}
+
+        for attempt in range(max_attempts):
+            try:
+                inst = self.acquire(timeout=timeout)
+            except (RuntimeError, TimeoutError) as e:
+                last_result = {'success': False, 'error': str(e)}
+                break
+
+            try:
+                result = fn(inst)
+            except Preempted:
+                # 工作被搶佔不是實例故障：歸還實例後交給調用方重新排隊
+                self.release(inst, ok=None)
+                raise
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+
+            ok = bool(result.get('success'))
+            self.release(inst, ok=ok)
+            result.setdefault('server', inst.url)
+            if ok:
+                return result
+
+            if self.check_health(inst):
+                return result
+
+            self.mark_dead(inst)
+            result['failover_attempts'] = attempt + 1
+            last_result = result
+
+        return last_result
+
+    # ---------- 收尾 ----------
+
+    def status(self):
+        with self._lock:
+            return [inst.status() for inst in self.instances]
+
+    def shutdown(self):
+        """終止由服務池啟動的實例進程"""
+        for inst in self.instances:
+            if inst.proc is None:
+                continue
+            try:
+                inst.proc.terminate()
+                inst.proc.wait(timeout=10)
+            except Exception as e:
+                print(f"  ⚠️  清理實例 {inst.url} 時出現問題: {e}")
+                try:
+                    inst.proc.kill()
+                except Exception:
+                    pass
+            inst.proc = None
+            inst.healthy = False
+
+
+def start_stub_servers(count, host="127.0.0.1", poll_interval=0.01):
+    """啟動 N 個本地 stub HTTP server（僅回應健康檢查），用於測試分派與故障切換"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == HEALTH_PATH else 404)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    servers = []
+    for _ in range(count):
+        server = ThreadingHTTPServer((host, 0), StubHandler)
+        # 輪詢間隔短一些，shutdown 不會每次卡住 0.5 秒
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval': poll_interval}, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def _check(problems, ok, message):
+    print(f"   {'✅' if ok else '❌'} {message}")
+    if not ok:
+        problems.append(message)
+
+
+def self_check(count=3, docs=12, delay=0.05, acquire_timeout=0.5, stats=None):
+    """
+    以本地 stub server 檢查服務池的行為，返回未通過的檢查說明列表（空列表表示全部通過）：
+    最少負載分派、實例中途關閉後的故障切換、連續失敗下線不被健康檢查撤銷、所有實例下線時 acquire 有界
+
+    delay 為每份文件的模擬推理耗時；傳入 stats 字典時寫入分派階段的耗時 'dispatch_seconds'
+    （基準測試以 delay=0 只測量服務池自身的分派開銷，不含 stub 啟停與等待上限的檢查）
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    problems = []
+    stubs = start_stub_servers(count)
+    pool = ServerPool.from_ports([s.server_address[1] for s in stubs], recheck_interval=1.0)
+    pool.attach()
+    down = set()
+
+    def fake_convert(inst):
+        if delay:
+            time.sleep(delay)
+        # 已關閉的 stub 上的請求失敗，模擬推理服務崩潰（服務池隨後的健康檢查會確認實例已下線）
+        if inst.port in down:
+            return {'success': False, 'error': '連線被拒絕'}
+        return {'success': True}
+
+    def run_batch(n):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            batch = list(executor.map(lambda _: pool.dispatch(fake_convert), range(n)))
+        return batch, time.perf_counter() - start
+
+    # 前一半文件分派完後關閉一個實例，後一半文件應切換到其他實例；
+    # 關閉的是此時負載最少的實例（下一份文件必定先分派給它），確保故障切換路徑被走到
+    results, first_seconds = run_batch(docs // 2)
+    victim = min(pool.instances, key=lambda i: (i.in_flight, i.completed))
+    stub = stubs[pool.instances.index(victim)]
+    stub.shutdown()
+    stub.server_close()
+    down.add(victim.port)
+    rest, second_seconds = run_batch(docs - docs // 2)
+    results += rest
+    if stats is not None:
+        stats['dispatch_seconds'] = first_seconds + second_seconds
+
+    status = pool.status()
+    _check(problems, all(r['success'] for r in results),
+           f"故障切換：{sum(1 for r in results if r['success'])}/{docs} 份成功")
+    _check(problems, not victim.healthy, "關閉的實例已下線")
+    _check(problems, all(s['completed'] > 0 for s in status), "每個實例都分派到文件")
+
+    # 文件接連失敗但健康檢查仍通過：達到 max_failures 後應下線，不被 dispatch 內的健康檢查恢復
+    # （選負載最少的健康實例，失敗不增加完成數，接下來的文件都會先分派給它）
+    inst = min((i for i in pool.instances if i.healthy), key=lambda i: (i.in_flight, i.completed))
+    for _ in range(pool.max_failures * len(pool)):
+        if inst.failures >= pool.max_failures:
+            break
+        pool.dispatch(lambda i: {'success': False, 'error': '文件失敗'} if i is inst else {'success': True})
+    _check(problems, not inst.healthy and inst.failures >= pool.max_failures,
+           f"連續失敗 {pool.max_failures} 次後下線（failures={inst.failures}）")
+
+    # 所有連接模式的實例都下線：未指定 timeout 的 acquire 也應在 acquire_timeout 內返回
+    for inst, s in zip(pool.instances, stubs):
+        if inst is not victim:
+            s.shutdown()
+            s.server_close()
+    dead = ServerPool.from_ports([s.server_address[1] for s in stubs], recheck_interval=0.1,
+                                 acquire_timeout=acquire_timeout)
+    dead.attach()
+    start = time.time()
+    result = dead.dispatch(fake_convert)
+    waited = time.time() - start
+    _check(problems, not result['success'] and waited < acquire_timeout + 5, f"無可用實例時 {waited:.1f} 秒後放棄")
+
+    return problems
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"🧪 服務池 stub 檢查（{n} 個實例）")
+    failed = self_check(count=n)
+    print(f"{'❌' if failed else '✅'} {n} 個實例：{len(failed)} 項檢查未通過")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+olmOCR workspace 讀取器
+串流讀取 pipeline 的結果分片（results/output_<hash>.jsonl）與工作隊列索引（work_index_list.csv.zstd），
+按文件返回文字與頁面元數據，並找出尚未完成的工作項，讓中斷的批次只重跑未完成的部分。
+
+workspace 結構（olmocr.pipeline）：
+    work_index_list.csv.zstd     每行: 工作組雜湊,PDF路徑1,PDF路徑2,...
+    results/output_<雜湊>.jsonl   該工作組完成後寫出，每行一份 Dolma 格式文件
+    markdown/<PDF路徑>.md         指定 --markdown 時的輸出（保留 --pdfs 路徑的目錄結構）
+    stamps/<文件鍵>.json          本工具寫入：處理時來源 PDF 的大小與 mtime，續跑時據此判斷結果是否過時
+
+用法：
+    python workspace_reader.py output/workspace          # 工作隊列狀態
+    python workspace_reader.py output/workspace a.pdf    # 某文件的結果
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.discovery import output_key
+
+INDEX_FILE = "work_index_list.csv.zstd"
+RESULTS_DIR = "results"
+SHARD_PREFIX = "output_"
+STAMPS_DIR = "stamps"
+STALE_SUFFIX = ".stale"
+
+# 只取出 Source-File 而不解碼整行（文字內容可能有數 MB）
+_SOURCE_RE = re.compile(r'"Source-File"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def _pdf_key(path):
+    """PDF 路徑的比較鍵：Source-File 記錄的是傳給 --pdfs 的路徑，統一解析為絕對路徑再比較"""
+    path = str(path)
+    if '://' in path:
+        return path
+    return str(Path(path).resolve())
+
+
+class Workspace:
+    """單一 olmOCR workspace 的唯讀視圖"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.results_dir = self.path / RESULTS_DIR
+
+    # ---------- 工作隊列 ----------
+
+    def _open_index(self):
+        """以文本串流打開工作隊列索引（zstd 壓縮或未壓縮的 csv）"""
+        index_path = self.path / INDEX_FILE
+        if index_path.exists():
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("讀取 work_index_list.csv.zstd 需要 zstandard（olmocr 依賴已包含）")
+            raw = open(index_path, 'rb')
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        plain = self.path / INDEX_FILE[:-len('.zstd')]
+        if plain.exists():
+            return open(plain, 'r', encoding='utf-8', newline='')
+        return None
+
+    def work_items(self):
+        """逐個產出工作隊列中的工作組：{'hash', 'pdfs'}"""
+        stream = self._open_index()
+        if stream is None:
+            return
+        with stream:
+            for row in csv.reader(stream):
+                if row and row[0]:
+                    yield {'hash': row[0], 'pdfs': row[1:]}
+
+    def done_hashes(self):
+        """已寫出結果分片的工作組雜湊"""
+        if not self.results_dir.exists():
+            return set()
+        return {p.stem[len(SHARD_PREFIX):] for p in self.results_dir.glob(f"{SHARD_PREFIX}*.jsonl")}
+
+    def pending_items(self):
+        """尚未完成的工作組"""
+        done = self.done_hashes()
+        for item in self.work_items():
+            if item['hash'] not in done:
+                yield item
+
+    def status(self):
+        """工作隊列進度統計"""
+        done = self.done_hashes()
+        total = finished = pdfs = finished_pdfs = 0
+        for item in self.work_items():
+            total += 1
+            pdfs += len(item['pdfs'])
+            if item['hash'] in done:
+                finished += 1
+                finished_pdfs += len(item['pdfs'])
+        return {'groups': total, 'done_groups': finished, 'pdfs': pdfs, 'done_pdfs': finished_pdfs,
+                'shards': len(done)}
+
+    # ---------- 結果分片 ----------
+
+    def shards(self):
+        return sorted(self.results_dir.glob(f"{SHARD_PREFIX}*.jsonl")) if self.results_dir.exists() else []
+
+    def iter_documents(self, pdf_path=None):
+        """逐行串流讀取所有結果分片，產出文件字典；指定 pdf_path 時只產出該文件"""
+        for shard, record in self.iter_records(pdf_path):
+            yield parse_document(record, shard)
+
+    def iter_records(self, pdf_path=None):
+        """
+        逐行串流讀取所有結果分片，產出 (分片路徑, 原始 Dolma 記錄)；指定 pdf_path 時只產出該文件
+
+        只解析需要的行：先以文件名做子字串預篩，再用 _SOURCE_RE 解碼 Source-File 比較，相符才 json 解析整行。
+        分片由 json.dumps 寫出，非 ASCII 文件名是 \\uXXXX 轉義，預篩同時比對原文與轉義形式。
+        """
+        key = needles = None
+        if pdf_path:
+            key = _pdf_key(pdf_path)
+            name = Path(pdf_path).name
+            needles = {name, json.dumps(name)[1:-1]}
+        for shard in self.shards():
+            with open(shard, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if key is not None:
+                        if not any(needle in line for needle in needles):
+                            continue
+                        match = _SOURCE_RE.search(line)
+                        if not match or _pdf_key(json.loads(match.group(1))) != key:
+                            continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield shard, record
+
+    def iter_sources(self):
+        """逐個產出結果分片中已完成的 Source-File，不解析文字內容"""
+        for shard in self.shards():
+            with open(shard, 'r', encoding='utf-8') as f:
+                for line in f:
+                    match = _SOURCE_RE.search(line)
+                    if match:
+                        yield json.loads(match.group(1))
+
+    def document_for(self, pdf_path):
+        """返回某 PDF 的結果文件，沒有則返回 None"""
+        return next(self.iter_documents(pdf_path), None)
+
+    def pending_pdfs(self, pdf_paths):
+        """從 pdf_paths 中篩出在此 workspace 尚無結果的文件（用於續跑）"""
+        remaining = {_pdf_key(p) for p in pdf_paths}
+        for source in self.iter_sources():
+            remaining.discard(_pdf_key(source))
+            if not remaining:
+                break
+        return [p for p in pdf_paths if _pdf_key(p) in remaining]
+
+    def markdown_files(self, pdf_path):
+        """
+        --markdown 模式下該 PDF 對應的 markdown 文件
+
+        pipeline 按 Source-File 的完整路徑寫到 markdown/<路徑>.md，這裡按同一規則定位，
+        不按文件名搜索（不同目錄中同名的 PDF 不會被誤認）
+        """
+        source = str(pdf_path)
+        if '://' in source:
+            source = source.split('://', 1)[1]
+        relative = Path(source.lstrip('/\\'))
+        path = self.path / "markdown" / relative.parent / f"{relative.stem}.md"
+        return [path] if path.is_file() else []
+
+    # ---------- 來源文件戳記 ----------
+
+    def _stamp_path(self, pdf_path):
+        return self.path / STAMPS_DIR / f"{output_key(pdf_path)}.json"
+
+    def write_stamp(self, pdf_path, source=None):
+        """記錄處理時來源 PDF（預設即 pdf_path；預檢修復時為原始文件）的大小與 mtime"""
+        source = Path(source or pdf_path)
+        st = source.stat()
+        stamp_path = self._stamp_path(pdf_path)
+        stamp_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(stamp_path, 'w', encoding='utf-8') as f:
+            json.dump({'source': str(source), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, f)
+
+    def stamp_matches(self, pdf_path, source=None):
+        """來源 PDF 的大小與 mtime 與處理時記錄的一致（沒有戳記時視為不一致）"""
+        try:
+            with open(self._stamp_path(pdf_path), 'r', encoding='utf-8') as f:
+                stamp = json.load(f)
+            st = Path(source or pdf_path).stat()
+        except (OSError, ValueError):
+            return False
+        return (stamp.get('size'), stamp.get('mtime_ns')) == (st.st_size, st.st_mtime_ns)
+
+    def invalidate(self, pdf_path):
+        """
+        把含該 PDF 結果的分片改名為 *.jsonl.stale，返回移走的分片數
+
+        pipeline 以分片是否存在判斷工作組已完成，移走後再次運行會重新處理該工作組
+        （同組的其他文件一併重跑）
+        """
+        shards = {shard for shard, _ in self.iter_records(pdf_path)}
+        for shard in shards:
+            os.replace(shard, shard.with_name(shard.name + STALE_SUFFIX))
+        try:
+            self._stamp_path(pdf_path).unlink()
+        except OSError:
+            pass
+        return len(shards)
+
+
+def parse_document(record, shard=None):
+    """把一行 Dolma 記錄整理為文件字典，按 pdf_page_numbers 切出各頁文字"""
+    text = record.get('text') or ''
+    metadata = record.get('metadata') or {}
+    spans = (record.get('attributes') or {}).get('pdf_page_numbers') or []
+    pages = {}
+    for start, end, page in spans:
+        pages[int(page)] = text[start:end]
+    return {
+        'id': record.get('id'),
+        'source_file': metadata.get('Source-File', ''),
+        'text': text,
+        'pages': pages,
+        'total_pages': metadata.get('pdf-total-pages'),
+        'fallback_pages': metadata.get('total-fallback-pages', 0),
+        'input_tokens': metadata.get('total-input-tokens'),
+        'output_tokens': metadata.get('total-output-tokens'),
+        'shard': str(shard) if shard else None,
+    }
+
+
+def summarize_output(workspace_dir, pdf_path):
+    """
+    只統計屬於 pdf_path 的輸出（workspace 可能殘留其他文件的結果），返回結果字典的輸出部分
+
+    workspace 中沒有該文件的記錄時返回 None（pipeline 返回 0 但頁面錯誤率超限時會發生）
+    """
+    workspace = Workspace(workspace_dir)
+    doc = workspace.document_for(pdf_path)
+    if doc is None:
+        return None
+    md_files = workspace.markdown_files(doc['source_file'] or pdf_path)
+    return {
+        'workspace': str(workspace.path),
+        'shard': doc['shard'],
+        'markdown_files': len(md_files),
+        'json_files': 1,
+        'files': [str(Path(doc['shard']).relative_to(workspace.path))] +
+                 [str(f.relative_to(workspace.path)) for f in md_files],
+        'file_count': 1 + len(md_files),
+        'page_count': doc['total_pages'],
+        'fallback_pages': doc['fallback_pages'],
+        'output_size': len(doc['text'].encode('utf-8')),
+    }
+
+
+def resumable_output(workspace_dir, pdf_path, source=None):
+    """
+    續跑用的 summarize_output：只有來源 PDF 的大小與 mtime 與處理時記錄的一致才返回結果
+
+    PDF 在原路徑被修改或替換（或結果沒有戳記）時返回 None，並移走過時的結果分片，讓 pipeline 重新處理
+    """
+    output = summarize_output(workspace_dir, pdf_path)
+    if output is None:
+        return None
+    workspace = Workspace(workspace_dir)
+    if workspace.stamp_matches(pdf_path, source):
+        return output
+    print(f"🔄 {Path(source or pdf_path).name} 在處理後已改變，舊結果作廢")
+    workspace.invalidate(pdf_path)
+    return None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("💡 使用方法: python workspace_reader.py <workspace> [PDF檔案路徑]")
+        sys.exit(1)
+    ws = Workspace(sys.argv[1])
+    if len(sys.argv) > 2:
+        doc = ws.document_for(sys.argv[2])
+        if doc is None:
+            print(f"❌ workspace 中沒有 {sys.argv[2]} 的結果")
+            sys.exit(1)
+        print(f"📄 {doc['source_file']}: {doc['total_pages']} 頁（fallback {doc['fallback_pages']} 頁），"
+              f"{len(doc['text'])} 字元 ← {doc['shard']}")
+    else:
+        s = ws.status()
+        print(f"📋 工作組 {s['done_groups']}/{s['groups']} 完成，PDF {s['done_pdfs']}/{s['pdfs']}，結果分片 {s['shards']} 個")
+        for item in ws.pending_items():
+            print(f"   ⏳ {item['hash'][:12]}: {', '.join(Path(p).name for p in item['pdfs'])}")
@@ -3,12 +3,36 @@
 Unstructured PDF數據處理實現
 """
 
+import sys
 import time
 import json
 from pathlib import Path
 
-def process_pdfs(output_dir=None):
-    """處理test_pdfs目錄下的PDF文件"""
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import metrics, profiling
+from common.discovery import Manifest, output_key
+from common.errors import COMPAT, MISSING_BINARY, classify_exception
+from common.pipeline import Pipeline, Stage
+from common.priority import Inbox, from_env
+from common.preflight import preflight_pdf, rejected_result, summarize
+from common.result_index import ResultIndex
+from element_store import save_elements, store_path
+
+# 各階段的預設線程數：partition 佔用最多 CPU/記憶體，只開一個
+DEFAULT_WORKERS = {'preflight': 2, 'engine': 1, 'postprocess': 2, 'write': 1}
+
+def process_pdfs(output_dir=None, index=None, workers=None, manifest=None, input_dir=None, store_elements=True,
+                 inbox_dir=None, reserved=0):
+    """
+    遞迴處理 input_dir（預設 test_pdfs）目錄下的PDF文件，index 為 ResultIndex 時逐份寫入結果索引
+
+    以分階段流水線執行：preflight → engine(partition) → postprocess(markdown) → write/index，
+    引擎處理下一份文件的同時，上一份的 markdown 渲染與寫盤在其他線程完成。
+    文件由 manifest（common.discovery）邊遍歷邊產出，未變更的目錄不再重新 stat。
+    store_elements 為 True 時把元素寫入 output/elements/<文件名>-<路徑雜湊>.elements（見 element_store.py），之後可不經 partition 重新渲染。
+    inbox_dir 中新放入的 PDF 以 interactive 優先級插隊，reserved 個 engine 線程只處理 interactive 文件；
+    partition 在進程內執行無法中途終止，bulk 文件不被搶佔，只是排在 interactive 之後。
+    """
     # 設置輸出目錄
     if output_dir is None:
         output_dir = Path(__file__).parent / "output"
@@ -18,38 +42,112 @@ def process_pdfs(output_dir=None):
     # 確保輸出目錄存在
     output_dir.mkdir(exist_ok=True)
 
-    # 指向父目錄的 test_pdfs
-    test_dir = Path(__file__).parent.parent / "test_pdfs"
+    # 預設指向父目錄的 test_pdfs
+    test_dir = Path(input_dir) if input_dir else Path(__file__).parent.parent / "test_pdfs"
     if not test_dir.exists():
         print("❌ test_pdfs目錄不存在")
         print(f"   預期路徑: {test_dir.absolute()}")
         return []
 
-    pdf_files = list(test_dir.glob("*.pdf"))
-    if not pdf_files:
-        print("❌ 無PDF文件")
-        return []
-
-    print(f"📁 發現 {len(pdf_files)} 個PDF")
+    workers = dict(DEFAULT_WORKERS, **(workers or {}))
+    repair_dir = output_dir / "_repaired"
     results = []
+    own_manifest = manifest is None
+    manifest = manifest or Manifest()
+
+    def preflight_stage(ctx):
+        # 預檢：拒絕損壞/加密的文件，修復 xref 損壞的文件
+        report = preflight_pdf(ctx['pdf'], repair_dir=repair_dir)
+        ctx['report'] = report
+        if not report['ok']:
+            print(f"  ⛔ 預檢拒絕: {report['file']} - {report['reason']}")
+            ctx['failed'] = True
+            ctx['result_data'] = rejected_result(report)
+        else:
+            report['sha256'] = manifest.ensure_hash(ctx['item'])
+        return ctx
 
-    for pdf in pdf_files:
-        size_mb = pdf.stat().st_size / (1024*1024)
-        print(f"處理: {pdf.name} ({size_mb:.1f}MB)")
+    def engine_stage(ctx):
+        report = ctx['report']
+        pdf = Path(report['input_path'])
+        print(f"處理: {pdf.name} ({report['size_mb']:.1f}MB, {report['page_count'] or '?'} 頁)")
+        start_time = time.time()
+        with metrics.track_engine('unstructured'):
+            try:
+                with profiling.profile_document(report['path'], 'partition'):
+                    ctx['elements'] = partition_pdf(pdf)
+            except Exception as e:
+                ctx['failed'] = True
+                ctx['result'] = failure_result(e)
+        ctx['process_time'] = time.time() - start_time
+        return ctx
 
+    def postprocess_stage(ctx):
         start_time = time.time()
-        result = convert_pdf(pdf, output_dir)
-        process_time = time.time() - start_time
-
-        results.append({
-            'file': pdf.name,
-            'size_mb': size_mb,
-            'process_time': process_time,
-            'success': result['success'],
-            'output_size': result.get('output_size', 0),
-            'output_file': result.get('output_file', None),
-            'error': result.get('error', None)
-        })
+        # 渲染後即釋放元素列表，控制在途記憶體
+        elements = ctx.pop('elements')
+        # 輸出按原始路徑命名（input_path 可能是預檢修復後的副本）
+        pdf = Path(ctx['report']['path'])
+        if store_elements:
+            save_elements(elements, store_path(output_dir, pdf), source=pdf)
+        with profiling.profile_document(ctx['report']['path'], 'render'):
+            ctx['rendered'] = render_elements(elements)
+        ctx['process_time'] += time.time() - start_time
+        return ctx
+
+    def write_stage(ctx):
+        report = ctx['report']
+        if 'result_data' not in ctx:
+            if 'rendered' in ctx:
+                start_time = time.time()
+                result = write_markdown(Path(report['path']), output_dir, ctx['rendered'])
+                ctx['process_time'] += time.time() - start_time
+            else:
+                result = ctx.get('result') or {'success': False, 'error': '; '.join(ctx.get('errors', []))}
+            ctx['result'] = result
+            ctx['result_data'] = {
+                'file': report['file'],
+                'size_mb': report['size_mb'],
+                'process_time': ctx.get('process_time', 0),
+                'success': result['success'],
+                'output_size': result.get('output_size', 0),
+                'output_file': result.get('output_file', None),
+                'error': result.get('error', None),
+                'error_code': result.get('error_code', None),
+                'sha256': report.get('sha256'),
+                'preflight': summarize(report)
+            }
+
+        result = ctx.get('result') or {}
+        result_data = ctx['result_data']
+        metrics.observe_result('unstructured', result_data, pages=result.get('page_count') or report['page_count'])
+        results.append(result_data)
+
+        if index is not None:
+            output_path = output_dir / result_data['output_file'] if result_data.get('output_file') else None
+            index.record_run(report['path'], 'unstructured', result_data, markdown=result.get('markdown'),
+                             pages=result.get('page_texts'), output_path=output_path)
+        return ctx
+
+    pipeline = Pipeline([
+        Stage('preflight', preflight_stage, workers['preflight']),
+        Stage('engine', engine_stage, workers['engine'], queue_gauge=metrics.QUEUE_DEPTH.labels('unstructured'),
+              reserved=reserved),
+        Stage('postprocess', postprocess_stage, workers['postprocess']),
+        Stage('write', write_stage, workers['write'], always=True),
+    ], wait_metric=lambda priority: metrics.QUEUE_WAIT.labels('unstructured', priority))
+    inbox = Inbox(inbox_dir, lambda item: {'pdf': item['path'], 'item': item}) if inbox_dir else None
+    # 邊遍歷邊送入流水線：第一份文件不必等整個語料掃描完畢即開始預檢
+    try:
+        pipeline.run(({'pdf': item['path'], 'item': item} for item in manifest.walk(test_dir)), inbox=inbox)
+        manifest.print_stats()
+    finally:
+        if own_manifest:
+            manifest.close()
+    if not results:
+        print("❌ 無PDF文件")
+        return []
+    pipeline.print_stats()
 
     return results
 
@@ -111,43 +209,74 @@ def elements_to_markdown(elements):
     
     return "".join(markdown_lines)
 
-def convert_pdf(pdf_path, output_dir):
-    """使用Unstructured解析PDF並轉換為Markdown"""
-    try:
-        from unstructured.partition.auto import partition
+def partition_pdf(pdf_path):
+    """使用Unstructured解析PDF，返回元素列表"""
+    from unstructured.partition.auto import partition
 
-        elements = partition(filename=str(pdf_path))
-        
-        # 轉換為 Markdown 格式
-        markdown_content = elements_to_markdown(elements)
-        # 保留原始文本用於預覽
-        text_preview = "\n".join([str(element) for element in elements[:5]])
+    return partition(filename=str(pdf_path))
 
-        # 保存提取的文本到 output 目錄
-        output_dir = Path(output_dir)
-        output_dir.mkdir(exist_ok=True)
-        
-        # 生成輸出文件名（PDF文件名 + .md）
-        output_file = output_dir / f"{pdf_path.stem}.md"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-
-        return {
-            'success': True,
-            'output_size': len(markdown_content.encode('utf-8')),
-            'element_count': len(elements),
-            'text_preview': text_preview[:200],
-            'output_file': str(output_file.relative_to(output_dir))
-        }
-
-    except ImportError:
-        return {'success': False, 'error': 'unstructured套件未安裝，請查看 README.md'}
-    except (AttributeError, Exception) as e:
-        error_msg = str(e)
-        # 檢查是否是 NumPy 兼容性問題
-        if '_ARRAY_API' in error_msg or ('NumPy' in error_msg and '2.' in error_msg):
-            return {'success': False, 'error': 'NumPy 版本不兼容，請查看 README.md 安裝要求'}
-        return {'success': False, 'error': error_msg}
+def render_elements(elements):
+    """把元素渲染為 Markdown，並整理預覽與按頁文字"""
+    # 轉換為 Markdown 格式
+    markdown_content = elements_to_markdown(elements)
+    # 保留原始文本用於預覽
+    text_preview = "\n".join([str(element) for element in elements[:5]])
+
+    # 按頁碼分組的文字（寫入結果索引的 pages 表）
+    page_texts = {}
+    for element in elements:
+        page_number = getattr(getattr(element, 'metadata', None), 'page_number', None)
+        if page_number:
+            page_texts.setdefault(page_number, []).append(str(element))
+
+    return {
+        'markdown': markdown_content,
+        'element_count': len(elements),
+        'page_count': max(page_texts) if page_texts else None,
+        'text_preview': text_preview[:200],
+        'page_texts': {n: "\n".join(texts) for n, texts in page_texts.items()}
+    }
+
+def write_markdown(pdf_path, output_dir, rendered):
+    """保存 Markdown 到 output 目錄，返回結果字典"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+
+    # 生成輸出文件名（PDF文件名 + 路徑雜湊 + .md，不同子目錄的同名 PDF 不互相覆蓋）
+    output_file = output_dir / f"{output_key(pdf_path)}.md"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(rendered['markdown'])
+
+    result = dict(rendered)
+    result.update({
+        'success': True,
+        'output_size': len(rendered['markdown'].encode('utf-8')),
+        'output_file': str(output_file.relative_to(output_dir))
+    })
+    return result
+
+def failure_result(e):
+    """把 partition / 渲染過程中的異常轉成失敗結果"""
+    if isinstance(e, ImportError):
+        return {'success': False, 'error': 'unstructured套件未安裝，請查看 README.md', 'error_code': MISSING_BINARY}
+    error_msg = str(e)
+    # 檢查是否是 NumPy 兼容性問題
+    if '_ARRAY_API' in error_msg or ('NumPy' in error_msg and '2.' in error_msg):
+        return {'success': False, 'error': 'NumPy 版本不兼容，請查看 README.md 安裝要求', 'error_code': COMPAT}
+    return {'success': False, 'error': error_msg, 'error_code': classify_exception(e)}
+
+def convert_pdf(pdf_path, output_dir, store_elements=True):
+    """使用Unstructured解析PDF並轉換為Markdown（單文件、順序執行）"""
+    try:
+        with profiling.profile_document(pdf_path, 'partition'):
+            elements = partition_pdf(pdf_path)
+        if store_elements:
+            save_elements(elements, store_path(output_dir, pdf_path), source=pdf_path)
+        with profiling.profile_document(pdf_path, 'render'):
+            rendered = render_elements(elements)
+        return write_markdown(Path(pdf_path), output_dir, rendered)
+    except Exception as e:
+        return failure_result(e)
 
 def analyze_results(results, output_dir=None):
     """分析處理結果"""
@@ -175,6 +304,17 @@ def analyze_results(results, output_dir=None):
     if total_time > 0:
         print(f"平均速度: {total_size/total_time:.2f}MB/秒")
 
+    # 預檢統計：頁數與文字層（掃描版）分佈
+    preflight = [r['preflight'] for r in results if r.get('preflight')]
+    total_pages = sum(p['page_count'] or 0 for p in preflight)
+    if total_pages:
+        print(f"總頁數: {total_pages}")
+        if total_time > 0:
+            print(f"平均速度: {total_pages/total_time:.2f}頁/秒")
+    scanned = sum(1 for p in preflight if p['has_text_layer'] is False)
+    if scanned:
+        print(f"無文字層（掃描版）: {scanned} 個")
+
     # 顯示錯誤
     for r in results:
         if not r['success']:
@@ -200,8 +340,16 @@ def main():
     
     # 設置輸出目錄
     output_dir = Path(__file__).parent / "output"
-    results = process_pdfs(output_dir=output_dir)
-    analyze_results(results, output_dir=output_dir)
+    exporters = metrics.start_from_env()
+    index = ResultIndex()
+    inbox_dir, reserved = from_env()
+    try:
+        results = process_pdfs(output_dir=output_dir, index=index, inbox_dir=inbox_dir, reserved=reserved)
+        analyze_results(results, output_dir=output_dir)
+        print(f"結果索引: {index.db_path}")
+    finally:
+        index.close()
+        metrics.stop_exporters(exporters)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+unstructured 元素的列式存儲
+每份文件一個 <文件名>-<路徑雜湊>.elements，各欄位以列式連續存放，讀取時整個文件 mmap，欄位直接是 NumPy 視圖：
+
+    OCRELEM1 + 標頭長度 + 標頭 JSON（元素數、類型/分類詞表、來源文件、各欄位的 dtype/shape/偏移量）
+    type / category    詞表編碼（uint8）
+    page               頁碼（int32，-1 表示無）
+    bbox               座標外框 x0, y0, x1, y1（float32，無座標為 NaN）
+    text + text_offsets          UTF-8 文字
+    metadata + metadata_offsets  其餘元數據（每個元素一段 JSON，按需解碼）
+
+修改 elements_to_markdown 或新增輸出格式時，直接從這裡重新渲染，不必重新 partition。
+
+用法：
+    python element_store.py render output/elements/2015_ResNet-1a2b3c4d.elements   # 重新渲染 markdown
+    python element_store.py render output/elements --output output/rerendered
+    python element_store.py stats output/elements                          # 全部文件的類型與頁數統計
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.discovery import output_key
+
+MAGIC = b"OCRELEM1"
+FORMAT_VERSION = 1
+SUFFIX = ".elements"
+NO_PAGE = -1
+ALIGN = 8
+_HEADER_LEN = struct.Struct('<Q')
+
+
+# ---------- 寫入 ----------
+
+def _bbox(metadata):
+    """從 CoordinatesMetadata.points 計算外框"""
+    coordinates = getattr(metadata, 'coordinates', None)
+    points = getattr(coordinates, 'points', None)
+    if not points:
+        return (np.nan, np.nan, np.nan, np.nan)
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def _extra_metadata(element):
+    """已有專門欄位以外的元數據（element_id、text_as_html、parent_id 等）"""
+    metadata = getattr(element, 'metadata', None)
+    extra = {}
+    if metadata is not None and hasattr(metadata, 'to_dict'):
+        extra = {k: v for k, v in metadata.to_dict().items() if k not in ('coordinates', 'page_number')}
+    element_id = getattr(element, 'id', None)
+    if element_id is not None:
+        extra['element_id'] = element_id
+    return extra
+
+
+def _encode_column(values, vocab):
+    index = {name: i for i, name in enumerate(vocab)}
+    dtype = np.uint8 if len(vocab) <= 256 else np.uint16
+    return np.fromiter((index[v] for v in values), dtype=dtype, count=len(values))
+
+
+def _blob(chunks):
+    """多段位元組 → (連續位元組, 偏移量)"""
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in chunks], out=offsets[1:])
+    return np.frombuffer(b''.join(chunks), dtype=np.uint8), offsets
+
+
+def _padding(n):
+    return -n % ALIGN
+
+
+def store_path(output_dir, pdf_path):
+    """某份 PDF 的元素存儲路徑：<output>/elements/<文件名>-<路徑雜湊>.elements（同名 PDF 不互相覆蓋）"""
+    return Path(output_dir) / "elements" / f"{output_key(pdf_path)}{SUFFIX}"
+
+
+def save_elements(elements, path, source=None):
+    """把元素列表寫成一個列式文件（先寫臨時文件再替換），返回元素數"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    types = [type(e).__name__ for e in elements]
+    categories = [getattr(e, 'category', None) or '' for e in elements]
+    type_vocab = sorted(set(types))
+    category_vocab = sorted(set(categories))
+    text, text_offsets = _blob([str(e).encode('utf-8') for e in elements])
+    metadata, metadata_offsets = _blob([
+        json.dumps(_extra_metadata(e), ensure_ascii=False, default=str).encode('utf-8') for e in elements])
+
+    columns = {
+        'type': _encode_column(types, type_vocab),
+        'category': _encode_column(categories, category_vocab),
+        'page': np.fromiter(
+            ((getattr(getattr(e, 'metadata', None), 'page_number', None) or NO_PAGE) for e in elements),
+            dtype=np.int32, count=len(elements)),
+        'bbox': np.array([_bbox(getattr(e, 'metadata', None)) for e in elements], dtype=np.float32).reshape(-1, 4),
+        'text': text,
+        'text_offsets': text_offsets,
+        'metadata': metadata,
+        'metadata_offsets': metadata_offsets,
+    }
+
+    # 欄位偏移量相對於數據區起點，標頭長度因此不依賴偏移量本身
+    layout, offset = {}, 0
+    for name, array in columns.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'count': len(elements),
+        'source': str(source) if source else None,
+        'types': type_vocab,
+        'categories': category_vocab,
+        'columns': layout,
+    }, ensure_ascii=False).encode('utf-8')
+    header += b' ' * _padding(len(MAGIC) + _HEADER_LEN.size + len(header))
+
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + _HEADER_LEN.pack(len(header)) + header)
+        for array in columns.values():
+            f.write(array.tobytes())
+            f.write(b'\0' * _padding(array.nbytes))
+    os.replace(tmp, path)
+    return len(elements)
+
+
+# ---------- 讀取 ----------
+
+class _Metadata:
+    __slots__ = ('page_number', 'bbox', '_store', '_index')
+
+    def __init__(self, page_number, bbox, store, index):
+        self.page_number = page_number
+        self.bbox = bbox
+        self._store = store
+        self._index = index
+
+    def to_dict(self):
+        """完整元數據（按需從 metadata 欄位解碼）"""
+        extra = self._store.extra_metadata(self._index)
+        extra['page_number'] = self.page_number
+        return extra
+
+
+class StoredElement:
+    """從存儲讀回的元素：類名、category、str() 與 metadata.page_number 與原元素一致"""
+
+    __slots__ = ('category', 'text', 'metadata')
+
+    def __init__(self, category, text, metadata):
+        self.category = category
+        self.text = text
+        self.metadata = metadata
+
+    def __str__(self):
+        return self.text
+
+
+_element_classes = {}
+
+
+def _element_class(name):
+    """elements_to_markdown 按 type(element).__name__ 判斷類型，為每個類名建立同名子類"""
+    cls = _element_classes.get(name)
+    if cls is None:
+        cls = _element_classes[name] = type(name, (StoredElement,), {'__slots__': ()})
+    return cls
+
+
+class ElementStore:
+    """以 mmap 方式讀取一份文件的元素存儲；各欄位是指向映射區域的唯讀 NumPy 數組"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"不是元素存儲文件: {self.path}")
+        (header_len,) = _HEADER_LEN.unpack_from(self._map, len(MAGIC))
+        data_start = len(MAGIC) + _HEADER_LEN.size + header_len
+        self.meta = json.loads(self._map[len(MAGIC) + _HEADER_LEN.size:data_start])
+        if self.meta.get('format') != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(f"不支持的元素存儲格式: {self.meta.get('format')}")
+
+        columns = {}
+        for name, spec in self.meta['columns'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            columns[name] = np.frombuffer(self._map, dtype=dtype, count=count,
+                                          offset=data_start + spec['offset']).reshape(spec['shape'])
+        self.types = columns['type']
+        self.categories = columns['category']
+        self.pages = columns['page']
+        self.bbox = columns['bbox']
+        self._text = columns['text']
+        self._text_offsets = columns['text_offsets']
+        self._metadata = columns['metadata']
+        self._metadata_offsets = columns['metadata_offsets']
+
+    def __len__(self):
+        return self.meta['count']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def text(self, i):
+        return self._text[self._text_offsets[i]:self._text_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def extra_metadata(self, i):
+        return json.loads(self._metadata[self._metadata_offsets[i]:self._metadata_offsets[i + 1]].tobytes())
+
+    def __iter__(self):
+        type_names = self.meta['types']
+        category_names = self.meta['categories']
+        text = self._text.tobytes()
+        offsets = self._text_offsets.tolist()
+        for i, (type_code, category_code, page) in enumerate(
+                zip(self.types.tolist(), self.categories.tolist(), self.pages.tolist())):
+            metadata = _Metadata(None if page == NO_PAGE else page, tuple(self.bbox[i].tolist()), self, i)
+            cls = _element_class(type_names[type_code])
+            yield cls(category_names[category_code] or None, text[offsets[i]:offsets[i + 1]].decode('utf-8'), metadata)
+
+    def elements(self):
+        """讀回完整元素列表（可直接交給 render_elements / elements_to_markdown）"""
+        return list(self)
+
+    def type_counts(self):
+        """各類型元素數（向量化，不解碼文字）"""
+        counts = np.bincount(self.types, minlength=len(self.meta['types']))
+        return {name: int(n) for name, n in zip(self.meta['types'], counts)}
+
+    def page_count(self):
+        valid = self.pages[self.pages != NO_PAGE]
+        return int(valid.max()) if valid.size else None
+
+    def text_bytes(self):
+        return int(self._text_offsets[-1])
+
+    def close(self):
+        """釋放映射；讀回的元素已複製成 Python 字串，不受影響"""
+        self.types = self.categories = self.pages = self.bbox = None
+        self._text = self._text_offsets = self._metadata = self._metadata_offsets = None
+        try:
+            self._map.close()
+        except BufferError:
+            # 呼叫方仍持有欄位視圖，映射隨最後一個引用釋放
+            pass
+
+
+def iter_stores(root):
+    """遍歷 root 下所有元素存儲（root 本身也可以是單一存儲文件）"""
+    root = Path(root)
+    if root.is_file():
+        yield ElementStore(root)
+        return
+    for path in sorted(root.glob(f"*{SUFFIX}")):
+        yield ElementStore(path)
+
+
+# ---------- 命令列 ----------
+
+def _cmd_render(args):
+    from demo import render_elements, write_markdown
+
+    count = 0
+    for store in iter_stores(args.root):
+        output_dir = Path(args.output) if args.output else store.path.parent.parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        source = Path(store.meta['source'] or store.path.stem)
+        result = write_markdown(source, output_dir, render_elements(store.elements()))
+        store.close()
+        count += 1
+        print(f"  📝 {source.name} → {output_dir / result['output_file']}（{len(store)} 個元素）")
+    print(f"✅ 重新渲染 {count} 份文件")
+
+
+def _cmd_stats(args):
+    documents = elements = text_bytes = pages = 0
+    types = {}
+    for store in iter_stores(args.root):
+        documents += 1
+        elements += len(store)
+        text_bytes += store.text_bytes()
+        pages += store.page_count() or 0
+        for name, n in store.type_counts().items():
+            types[name] = types.get(name, 0) + n
+        store.close()
+    print(f"📚 {documents} 份文件，{elements} 個元素，{pages} 頁，文字 {text_bytes / (1024 * 1024):.1f}MB")
+    for name, n in sorted(types.items(), key=lambda kv: kv[1], reverse=True):
+        print(f"   {name:<20} {n}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="unstructured 元素存儲：重新渲染與統計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_render = sub.add_parser("render", help="從元素存儲重新渲染 markdown（不重新 partition）")
+    p_render.add_argument("root")
+    p_render.add_argument("--output", help="markdown 輸出目錄（預設為 elements 目錄的上一層）")
+    p_stats = sub.add_parser("stats", help="元素類型與頁數統計")
+    p_stats.add_argument("root")
+    args = parser.parse_args(argv)
+
+    if args.command == "render":
+        _cmd_render(args)
+    else:
+        _cmd_stats(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())